@@ -1,6 +1,10 @@
 """This is the chartreux templating engine"""
 
-from .compiler import compile, compile_path, translate, translate_path, Compiler
-from .renderer import render, render_path, call
-from .runtime import BaseRuntime, Runtime
+__version__ = '0.2'
 
+from .cache import LRUCache, BytecodeCache, FragmentCache, FileFragmentCache
+from .environment import Environment
+from .profiler import Profiler
+from .compiler import compile, compile_iter, compile_path, compile_setup, compile_source, translate, translate_path, Compiler
+from .renderer import render, render_async, render_iter, render_many, render_parallel, render_path, render_to, call, call_iter, call_many, call_parallel, call_to, template_cache
+from .runtime import BaseRuntime, Runtime, Lazy, Markup, pure
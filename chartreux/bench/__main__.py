@@ -0,0 +1,69 @@
+"""Run the benchmark suite.
+
+    python -m chartreux.bench                           # all workloads, print a summary
+    python -m chartreux.bench --json results.json       # save machine-readable results
+    python -m chartreux.bench --baseline results.json   # compare with saved results
+
+With `--baseline`, the exit status is 1 if a metric regressed by more than `--threshold` percent.
+"""
+
+import argparse
+import json
+import sys
+
+from . import suite, workloads
+
+
+def main(argv=None):
+    names = [wl.__name__ for wl in workloads.ALL]
+
+    ap = argparse.ArgumentParser(prog='python -m chartreux.bench', description='chartreux benchmark suite')
+    ap.add_argument('workloads', nargs='*', metavar='workload', help='workloads to run: ' + ', '.join(names))
+    ap.add_argument('--runs', type=int, default=20, help='renders per workload (default: 20)')
+    ap.add_argument('--compile-runs', type=int, default=5, help='compiles per workload (default: 5)')
+    ap.add_argument('--scale', type=float, default=1, help='workload size factor (default: 1)')
+    ap.add_argument('--quick', action='store_true', help='small workloads and few runs, same as --scale 0.1 --runs 5')
+    ap.add_argument('--json', metavar='PATH', help="write results as JSON ('-' for stdout)")
+    ap.add_argument('--baseline', metavar='PATH', help='compare with results saved by --json')
+    ap.add_argument('--threshold', type=float, default=10, help='regression threshold in percent (default: 10)')
+    args = ap.parse_args(argv)
+
+    for name in args.workloads:
+        if name not in names:
+            ap.error('unknown workload {!r}'.format(name))
+
+    if args.quick:
+        args.scale, args.runs = 0.1, 5
+
+    # with JSON on stdout, the summary goes to stderr
+
+    log = sys.stderr if args.json == '-' else sys.stdout
+
+    def report(name, r):
+        print(suite.format_result(name, r), file=log, flush=True)
+
+    res = suite.run(args.workloads, args.scale, args.runs, args.compile_runs, report)
+
+    if args.json == '-':
+        json.dump(res, sys.stdout, indent=4)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(res, fp, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline.get('meta', {}).get('scale') != args.scale:
+            print('warning: baseline scale differs', file=log)
+        rows = suite.compare(res, baseline, args.threshold)
+        print(file=log)
+        print(suite.format_comparison(rows), file=log)
+        if any(r[-1] for r in rows):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Context variable access: fast locals vs. '_GET_VAR' lookups.
+
+Run with `python -m chartreux.bench.context_vars`.
+"""
+
+import timeit
+
+import chartreux
+
+# each template reads 10 context variables per row
+
+TEMPLATES = {
+    'interpolations': '''
+        @each rows as r
+            {a}{b}{c}{d}{e}{a}{b}{c}{d}{e}
+        @end
+    ''',
+    'expression': '''
+        @each rows as r
+            {a + b + c + d + e + a + b + c + d + e}
+        @end
+    ''',
+}
+
+ACCESSES_PER_ROW = 10
+
+
+def run(rows=2000, number=20):
+    context = {'rows': range(rows), 'a': 1, 'b': 2, 'c': 3, 'd': 4, 'e': 5}
+    res = {}
+
+    for name, text in TEMPLATES.items():
+        for fast_locals in (False, True):
+            tpl = chartreux.compile(text, fast_locals=fast_locals)
+            t = min(timeit.repeat(lambda: chartreux.call(tpl, context), number=number, repeat=5))
+            res[name, fast_locals] = t / number / (rows * ACCESSES_PER_ROW) * 1e9
+
+    return res
+
+
+def main():
+    res = run()
+    print('{:16} {:>12} {:>12} {:>12}'.format('ns per access', '_GET_VAR', 'fast locals', 'saved'))
+    for name in TEMPLATES:
+        slow, fast = res[name, False], res[name, True]
+        print('{:16} {:12.1f} {:12.1f} {:12.1f}'.format(name, slow, fast, slow - fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Dot access on objects and dicts.
+
+Run with `python -m chartreux.bench.dot_access`.
+"""
+
+import timeit
+
+import chartreux
+from chartreux import runtime
+
+TEMPLATE = '''
+@each rows as r
+    {r.a}{r.b}{r.c}{r.d}{r.e}{r.a}{r.b}{r.c}{r.d}{r.e}
+@end
+'''
+
+READS_PER_ROW = 10
+
+
+class Row:
+    def __init__(self, n):
+        self.a = self.b = self.c = self.d = self.e = n
+
+
+class UncachedRuntime(runtime.Runtime):
+    # overriding 'get' (with the same code) disables the call site caches
+    def get(self, obj, prop):
+        try:
+            return obj[prop]
+        except:
+            pass
+        return getattr(obj, prop)
+
+
+def run(rows=2000, number=10):
+    tpl = chartreux.compile(TEMPLATE)
+    data = {
+        'objects': [Row(n) for n in range(rows)],
+        'dicts': [vars(Row(n)) for n in range(rows)],
+    }
+    res = {}
+
+    for kind, items in data.items():
+        for name, rt in (('uncached', UncachedRuntime()), ('cached', runtime.Runtime())):
+            t = min(timeit.repeat(lambda: chartreux.call(tpl, {'rows': items}, runtime=rt), number=number, repeat=5))
+            res[kind, name] = t / number / (rows * READS_PER_ROW) * 1e9
+
+    return res
+
+
+def main():
+    res = run()
+    print('{:16} {:>12} {:>12}'.format('ns per read', 'uncached', 'cached'))
+    for kind in ('objects', 'dicts'):
+        print('{:16} {:12.1f} {:12.1f}'.format(kind, res[kind, 'uncached'], res[kind, 'cached']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Escaping: per-character replace statements vs. chained replaces with safe markup.
+
+Run with `python -m chartreux.bench.escaping`.
+
+`old` is the previous implementation of the filters, `translate` is a
+single-pass `str.translate`, `new` is the current runtime. The last case is
+a pre-rendered fragment (e.g. the output of a @def) which is escaped once more.
+"""
+
+import html
+import timeit
+
+from chartreux import runtime
+
+_XMLQUOTE = {ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;', ord('"'): '&quot;', ord("'"): '&apos;'}
+
+
+def old_xmlquote(val):
+    val = str(val)
+    val = val.replace('&', '&amp;')
+    val = val.replace('<', '&lt;')
+    val = val.replace('>', '&gt;')
+    val = val.replace('"', '&quot;')
+    val = val.replace('\'', '&apos;')
+    return val
+
+
+def old_html(val):
+    return html.escape(str(val))
+
+
+def translate_xmlquote(val):
+    return str(val).translate(_XMLQUOTE)
+
+
+def run(number=20000, repeat=7):
+    rt = runtime.Runtime()
+
+    fragment = rt.markup('<tr><td class="name">Tom &amp; Jerry</td></tr>\n' * 200)
+
+    cases = {
+        'xmlquote, plain text': (
+            'hello world',
+            {'old': old_xmlquote, 'translate': translate_xmlquote, 'new': rt.filter_xmlquote},
+        ),
+        'xmlquote, markup chars': (
+            'Tom & "Jerry" <b>\'x\'</b>',
+            {'old': old_xmlquote, 'translate': translate_xmlquote, 'new': rt.filter_xmlquote},
+        ),
+        'html, 10KB fragment': (
+            fragment,
+            {'old': old_html, 'new': rt.filter_html},
+        ),
+    }
+
+    res = {}
+
+    for case, (val, variants) in cases.items():
+        times = {name: [] for name in variants}
+        for _ in range(repeat):
+            for name, fn in variants.items():
+                times[name].append(timeit.timeit(lambda: fn(val), number=number))
+        res[case] = {name: min(t) / number * 1e9 for name, t in times.items()}
+
+    return res
+
+
+def main():
+    for case, times in run().items():
+        print(case)
+        for name, ns in times.items():
+            print('    {:12} {:10.1f} ns'.format(name, ns))
+
+
+if __name__ == '__main__':
+    main()
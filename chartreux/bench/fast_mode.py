@@ -0,0 +1,88 @@
+"""The default compile mode vs. the 'fast' mode.
+
+Run with `python -m chartreux.bench.fast_mode`. `setup` and `body` are the bytecode sizes
+of the setup and the body function of a template, including nested functions.
+"""
+
+import timeit
+
+import chartreux
+
+TEMPLATES = {
+    'interpolations': '''
+        @each rows as r
+            <td>{r.a}</td><td>{r.b}</td><td>{r.c | html}</td><td>{r.d}</td><td>{title}</td>
+        @end
+    ''',
+    'conditions': '''
+        @each rows as r
+            @if r.a > 10
+                big
+            @elif r.b
+                {r.b}
+            @else
+                small
+            @end
+        @end
+    ''',
+    'commands': '''
+        @def cell x
+            <td>{x}</td>
+        @end
+        @each rows as r
+            @cell r.a
+            @cell r.b
+            @cell r.c
+        @end
+    ''',
+}
+
+
+class Row:
+    def __init__(self, n):
+        self.a = n
+        self.b = n % 3
+        self.c = '<%d>' % n
+        self.d = 'x' * (n % 5)
+
+
+def _code_size(code):
+    # bytecode size, including nested functions
+    return len(code.co_code) + sum(_code_size(c) for c in code.co_consts if hasattr(c, 'co_code'))
+
+
+def _code_sizes(tpl):
+    # the template function only calls the setup function, which defines the helpers
+    # and returns the body function, see 'compile_setup'. Sizes are (setup without the body, body)
+
+    setup = chartreux.compile_setup(tpl).__code__
+    body = [c for c in setup.co_consts if getattr(c, 'co_name', None) == tpl.__name__ + '_BODY']
+    body_size = sum(_code_size(c) for c in body)
+    return _code_size(setup) - body_size, body_size
+
+
+def run(rows=1000, number=20):
+    context = {'rows': [Row(n) for n in range(rows)], 'title': 'hello'}
+    res = {}
+
+    for name, text in TEMPLATES.items():
+        for fast in (False, True):
+            tpl = chartreux.compile(text, fast=fast)
+            t = min(timeit.repeat(lambda: chartreux.call(tpl, context), number=number, repeat=5))
+            res[name, fast] = (t / number * 1e3, len(tpl.source.splitlines())) + _code_sizes(tpl)
+
+    return res
+
+
+def main():
+    res = run()
+    print('{:16} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        '', 'ms', 'ms fast', 'lines', 'lines fast', 'setup', 'setup fast', 'body', 'body fast'))
+    for name in TEMPLATES:
+        a, b = res[name, False], res[name, True]
+        print('{:16} {:10.2f} {:10.2f} {:10d} {:10d} {:10d} {:10d} {:10d} {:10d}'.format(
+            name, a[0], b[0], a[1], b[1], a[2], b[2], a[3], b[3]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Filter calls: compiled templates with and without filter optimizations.
+
+Run with `python -m chartreux.bench.filters`.
+
+Each template is compiled by chartreux twice, with and without an optimization:
+
+    fuse_filters    chains of runtime filters are called as one fused function
+                    (the `fuse_filters` pass of the `optimize` option)
+    fold            pure filters applied to literals are evaluated at compile time
+                    (the `fold` option)
+
+Times are per filter in the template, including the template machinery.
+"""
+
+import timeit
+
+import chartreux
+
+VARIABLES = '''
+    @each rows as r
+        {r | strip | lower | html}{r | upper}{r | title | h}{r | as_int}
+    @end
+'''
+
+CONSTANTS = '''
+    @each rows as r
+        {'Tom & Jerry' | upper | html}{' abc ' | strip | title}{r | as_int}
+    @end
+'''
+
+# filters per row of each template
+
+FILTERS_PER_ROW = {'fuse_filters': 7, 'fold': 5}
+
+# all passes but fuse_filters
+
+_OTHER_PASSES = list(chartreux.compiler.Optimizer.passes)
+
+
+def variants():
+    rt = chartreux.Runtime()
+    return {
+        'fuse_filters': (
+            rt,
+            chartreux.compile(VARIABLES, optimize=_OTHER_PASSES),
+            chartreux.compile(VARIABLES, optimize=True),
+        ),
+        'fold': (
+            rt,
+            chartreux.compile(CONSTANTS, runtime=rt, fold=False),
+            chartreux.compile(CONSTANTS, runtime=rt, fold=True),
+        ),
+    }
+
+
+def run(rows=2000, number=10, repeat=15):
+    context = {'rows': [' %d ' % n for n in range(rows)]}
+    res = {}
+
+    for name, (rt, off, on) in variants().items():
+        assert chartreux.call(off, context, runtime=rt) == chartreux.call(on, context, runtime=rt)
+
+        times = {False: [], True: []}
+        for _ in range(repeat):
+            for key, tpl in ((False, off), (True, on)):
+                times[key].append(timeit.timeit(lambda: chartreux.call(tpl, context, runtime=rt), number=number))
+
+        n = number * rows * FILTERS_PER_ROW[name]
+        res[name] = min(times[False]) / n * 1e9, min(times[True]) / n * 1e9
+
+    return res
+
+
+def main():
+    res = run()
+    print('{:16} {:>14} {:>14}'.format('ns per filter', 'off', 'on'))
+    for name, (off, on) in res.items():
+        print('{:16} {:14.1f} {:14.1f}'.format(name, off, on))
+
+
+if __name__ == '__main__':
+    main()
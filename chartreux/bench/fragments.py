@@ -0,0 +1,91 @@
+"""Fragment caching: a layout with an expensive navigation tree, with and without `@cache`.
+
+Run with `python -m chartreux.bench.fragments`.
+
+The navigation tree is the same for every request, the page content
+differs. `memory` and `file` are the in-process and the file backend.
+"""
+
+import tempfile
+import timeit
+
+import chartreux
+
+LAYOUT = '''
+@def tree(node)
+    <li><a href="{node.url | xmlquote}">{node.title | html}</a>
+    @if node.children
+        <ul>
+        @each node.children as c
+            @tree c
+        @end
+        </ul>
+    @end
+    </li>
+@end
+<html><body>
+{cache_begin}
+<nav><ul>
+@tree nav
+</ul></nav>
+{cache_end}
+<main>
+    <h1>{page.title | html}</h1>
+    <p>{page.body | html}</p>
+</main>
+</body></html>
+'''
+
+
+def make_nav(depth, width, prefix=''):
+    return {
+        'url': '/' + prefix,
+        'title': 'Section ' + (prefix or 'home'),
+        'children': [make_nav(depth - 1, width, prefix + str(n)) for n in range(width)] if depth else [],
+    }
+
+
+def run(number=200, repeat=5):
+    context = {
+        'nav': make_nav(4, 5),
+        'page': {'title': 'A page', 'body': 'Some <content>'},
+    }
+
+    plain = LAYOUT.replace('{cache_begin}', '').replace('{cache_end}', '')
+    cached = LAYOUT.replace('{cache_begin}', "@cache 'nav', 'en' ttl=300").replace('{cache_end}', '@end')
+
+    with tempfile.TemporaryDirectory() as dirname:
+        rt_file = chartreux.Runtime()
+        rt_file.fragment_cache = chartreux.FileFragmentCache(dirname)
+
+        variants = {
+            'no cache': (chartreux.compile(plain), chartreux.Runtime()),
+            'memory': (chartreux.compile(cached), chartreux.Runtime()),
+            'file': (chartreux.compile(cached), rt_file),
+        }
+
+        expected = chartreux.call(variants['no cache'][0], context)
+        for tpl, rt in variants.values():
+            assert chartreux.call(tpl, context, runtime=rt).split() == expected.split()
+
+        times = {name: [] for name in variants}
+        for _ in range(repeat):
+            for name, (tpl, rt) in variants.items():
+                times[name].append(timeit.timeit(lambda: chartreux.call(tpl, context, runtime=rt), number=number))
+
+        res = {name: min(t) / number * 1000 for name, t in times.items()}
+        stats = {name: rt.fragments().stats() for name, (tpl, rt) in variants.items() if name != 'no cache'}
+
+    return res, stats
+
+
+def main():
+    res, stats = run()
+    for name, ms in res.items():
+        print('{:10} {:8.3f} ms/render'.format(name, ms))
+    for name, st in stats.items():
+        print('{:10} hits {hits}, misses {misses}'.format(name, **st))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Loops over streaming sources: peak memory and time of `@each` over a generator.
+
+Run with `python -m chartreux.bench.loops [rows]`.
+
+The output goes to a null stream with `call_to`, so the peak memory is
+the memory of the loop itself. `@each` consumes a generator row by row,
+unless the loop asks for the total length (`index n, total`), which needs
+all rows at once.
+"""
+
+import io
+import sys
+import time
+import tracemalloc
+
+import chartreux
+
+TEMPLATE = '''
+@each rows as r {index}
+    {{r.id}},{{r.name}},{{r.price | ':.2f'}}
+@end
+'''
+
+
+class Null(io.TextIOBase):
+    def write(self, s):
+        return len(s)
+
+
+def rows(n):
+    for k in range(n):
+        yield {'id': k, 'name': 'row %d' % k, 'price': k * 0.5}
+
+
+def measure(tpl, n):
+    # NB: tracemalloc slows the render down, so the time is measured in a separate run
+
+    t = time.perf_counter()
+    chartreux.call_to(tpl, Null(), {'rows': rows(n)})
+    elapsed = time.perf_counter() - t
+
+    tracemalloc.start()
+    try:
+        chartreux.call_to(tpl, Null(), {'rows': rows(n)})
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return elapsed * 1000, peak / 1024
+
+
+def run(n=200000):
+    variants = {
+        'as r': chartreux.compile(TEMPLATE.format(index='')),
+        'as r index n': chartreux.compile(TEMPLATE.format(index='index n')),
+        'as r index n, total': chartreux.compile(TEMPLATE.format(index='index n, total')),
+    }
+    return {name: measure(tpl, n) for name, tpl in variants.items()}
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print('{} rows'.format(n))
+    for name, (ms, kb) in run(n).items():
+        print('@each rows {:20} {:10.1f} ms {:10.0f} KB peak'.format(name, ms, kb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Batch rendering: a loop of `call` vs. `call_many`.
+
+Run with `python -m chartreux.bench.many`.
+
+A mail-merge template is rendered with many small contexts. `call` sets
+up the runtime, the error function and the helpers on every call,
+`call_many` does that once for the whole batch.
+"""
+
+import timeit
+
+import chartreux
+
+LETTER = '''
+Dear {title} {name},
+
+your order #{order.id} of {order.date} has been shipped to
+    {order.address.street}
+    {order.address.zip} {order.address.city | upper}
+
+@each order.items as item
+    {item.qty} x {item.name | strip}   {item.price | ':.2f'}
+@end
+
+@if order.vip
+Thank you for being a valued customer!
+@end
+Yours, {shop}
+'''
+
+
+def contexts(n):
+    return [
+        {
+            'title': 'Mx',
+            'name': 'Customer %d' % i,
+            'shop': 'ACME',
+            'order': {
+                'id': i,
+                'date': '2020-01-01',
+                'vip': i % 3 == 0,
+                'address': {'street': 'Main st. %d' % i, 'zip': '%05d' % i, 'city': 'Springfield'},
+                'items': [{'qty': q, 'name': ' item %d ' % q, 'price': q * 1.5} for q in range(1, 3)],
+            },
+        }
+        for i in range(n)
+    ]
+
+
+def run(n=5000, number=3, repeat=7):
+    tpl = chartreux.compile(LETTER)
+    ctxs = contexts(n)
+
+    variants = {
+        'call() loop': lambda: [chartreux.call(tpl, c) for c in ctxs],
+        'call_many()': lambda: list(chartreux.call_many(tpl, ctxs)),
+    }
+
+    res = [fn() for fn in variants.values()]
+    assert res[0] == res[1]
+
+    times = {name: [] for name in variants}
+    for _ in range(repeat):
+        for name, fn in variants.items():
+            times[name].append(timeit.timeit(fn, number=number))
+
+    return {name: n * number / min(t) for name, t in times.items()}
+
+
+def main():
+    print('{:14} {:>14}'.format('', 'renders/s'))
+    for name, rps in run().items():
+        print('{:14} {:14.0f}'.format(name, rps))
+
+
+if __name__ == '__main__':
+    main()
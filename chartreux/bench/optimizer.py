@@ -0,0 +1,111 @@
+"""Code optimizer passes.
+
+Run with `python -m chartreux.bench.optimizer`.
+"""
+
+import timeit
+
+import chartreux
+from chartreux import compiler
+
+# a typical list page: a table with conditions, a helper def and optional fields
+
+PAGE = '''
+@def price p
+    @if p.sale
+        <s>{p.price}</s> <b>{p.sale}</b>
+    @else
+        {p.price}
+    @end
+@end
+<h1>{title}</h1>
+<table>
+@each products as p index n
+    <tr class="{n}">
+        <td>{p.id}</td>
+        <td><a href="/p/{p.id}">{p.name}</a></td>
+        <td>{p.category.name} / {p.category.parent}</td>
+        <td>@price p</td>
+        @if p.stock == 0
+            <td>sold out</td>
+        @elif p.featured
+            <td>featured</td>
+        @else
+        @end
+        @with p.note as note
+            <td>{note}</td>
+        @else
+        @end
+    </tr>
+@else
+    <tr><td>nothing found</td></tr>
+@end
+</table>
+'''
+
+# a condition-heavy fragment
+
+CONDITIONS = '''
+@each products as p
+    @if p.sale
+        sale
+    @elif p.featured
+        featured
+    @elif p.stock == 0
+        sold out
+    @end
+@end
+'''
+
+TEMPLATES = {'page': PAGE, 'conditions': CONDITIONS}
+
+
+class Category:
+    def __init__(self, n):
+        self.name = 'cat%d' % n
+        self.parent = 'root'
+
+
+class Product:
+    def __init__(self, n):
+        self.id = n
+        self.name = 'product %d' % n
+        self.price = n * 10
+        self.sale = n * 9 if n % 4 == 0 else None
+        self.stock = n % 7
+        self.featured = n % 5 == 0
+        self.note = 'note' if n % 3 == 0 else ''
+        self.category = Category(n % 10)
+
+
+def run(rows=500, number=5, repeat=40):
+    context = {'title': 'Products', 'products': [Product(n) for n in range(rows)]}
+    variants = [('none', False)] + [(p, [p]) for p in compiler.Optimizer.passes] + [('all', True)]
+    res = {}
+
+    for tname, text in TEMPLATES.items():
+        templates = {name: chartreux.compile(text, optimize=opt) for name, opt in variants}
+        times = {name: [] for name in templates}
+
+        # NB: variants are interleaved, so that they are equally affected by the machine load
+
+        for _ in range(repeat):
+            for name, tpl in templates.items():
+                times[name].append(timeit.timeit(lambda: chartreux.call(tpl, context), number=number))
+
+        for name, tpl in templates.items():
+            res[tname, name] = min(times[name]) / number * 1e3, len(tpl.source.splitlines())
+
+    return res
+
+
+def main():
+    res = run()
+    print('{:12} {:16} {:>10} {:>10} {:>10}'.format('template', 'passes', 'ms', 'gain %', 'lines'))
+    for (tname, name), (ms, lines) in res.items():
+        base = res[tname, 'none'][0]
+        print('{:12} {:16} {:10.3f} {:10.1f} {:10d}'.format(tname, name, ms, (base - ms) / base * 100, lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Parallel rendering: `call_many` in one process vs. `call_parallel` with a process pool.
+
+Run with `python -m chartreux.bench.parallel [contexts]`.
+
+Renders a config file template for many contexts with 1, 2, 4... workers,
+up to the number of CPUs, and reports the throughput and the speedup over
+a single process.
+"""
+
+import os
+import sys
+import time
+
+import chartreux
+
+CONFIG = '''
+# generated config for {host.name}
+
+[server]
+name = {host.name}
+address = {host.ip}
+port = {host.port}
+
+@each host.services as svc
+[service.{svc.name}]
+enabled = {svc.enabled | as_str | lower}
+@if svc.replicas > 1
+replicas = {svc.replicas}
+@end
+@each svc.env as key, val
+env.{key | upper} = "{val | xmlquote}"
+@end
+
+@end
+'''
+
+
+def contexts(n):
+    return [
+        {
+            'host': {
+                'name': 'host-%05d' % i,
+                'ip': '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                'port': 8000 + i % 100,
+                'services': [
+                    {
+                        'name': 'svc%d' % s,
+                        'enabled': (i + s) % 2 == 0,
+                        'replicas': s,
+                        'env': {'var_%d' % e: 'value "%d" <%d>' % (e, i) for e in range(6)},
+                    }
+                    for s in range(4)
+                ],
+            }
+        }
+        for i in range(n)
+    ]
+
+
+def run(n=20000, chunk_size=256):
+    tpl = chartreux.compile(CONFIG)
+    ctxs = contexts(n)
+
+    t = time.perf_counter()
+    expected = list(chartreux.call_many(tpl, ctxs))
+    base = n / (time.perf_counter() - t)
+
+    res = {'call_many, 1 process': (base, 1.0)}
+
+    workers = 1
+    cpus = os.cpu_count() or 1
+    while True:
+        t = time.perf_counter()
+        out = list(chartreux.call_parallel(tpl, ctxs, workers=workers, chunk_size=chunk_size))
+        rps = n / (time.perf_counter() - t)
+        assert out == expected
+        res['call_parallel, {} workers'.format(workers)] = (rps, rps / base)
+        if workers >= cpus:
+            break
+        workers = min(workers * 2, cpus)
+
+    return res
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('{} contexts, {} CPUs'.format(n, os.cpu_count()))
+    print('{:28} {:>12} {:>8}'.format('', 'renders/s', 'speedup'))
+    for name, (rps, speedup) in run(n).items():
+        print('{:28} {:12.0f} {:8.2f}'.format(name, rps, speedup))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Pure defs: `@def` vs. `@pure` for a def called many times with few distinct arguments.
+
+Run with `python -m chartreux.bench.pure`.
+
+A price list calls `price_badge amount currency` for every row, most rows
+share a handful of prices. With `@pure`, repeated calls within a render
+are served from the per-render memo.
+"""
+
+import timeit
+
+import chartreux
+
+TEMPLATE = '''
+@{kind} price_badge(amount, currency)
+    <span class="badge badge-{{currency | lower}}">
+        @if amount > 100
+            <b>{{amount | ':.2f'}} {{currency | html}}</b>
+        @else
+            {{amount | ':.2f'}} {{currency | html}}
+        @end
+    </span>
+@end
+<table>
+@each rows as r
+    <tr><td>{{r.name | html}}</td><td>{{price_badge(r.price, r.currency)}}</td></tr>
+@end
+</table>
+'''
+
+
+def run(rows=5000, distinct=10, number=10, repeat=5):
+    context = {
+        'rows': [
+            {'name': 'item %d' % n, 'price': 50.0 * (n % distinct), 'currency': 'EUR' if n % 2 else 'USD'}
+            for n in range(rows)
+        ]
+    }
+
+    variants = {kind: chartreux.compile(TEMPLATE.format(kind=kind)) for kind in ('def', 'pure')}
+    rt = chartreux.Runtime()
+
+    assert chartreux.call(variants['def'], context) == chartreux.call(variants['pure'], context, runtime=rt)
+    rt.reset_memo_stats()
+
+    times = {kind: [] for kind in variants}
+    for _ in range(repeat):
+        for kind, tpl in variants.items():
+            times[kind].append(timeit.timeit(lambda: chartreux.call(tpl, context, runtime=rt), number=number))
+
+    res = {kind: min(t) / number * 1000 for kind, t in times.items()}
+    return res, rt.memo_stats()
+
+
+def main():
+    res, stats = run()
+    for kind, ms in res.items():
+        print('@{:8} {:10.2f} ms/render'.format(kind, ms))
+    for s in stats:
+        print('{name}: {calls} calls, hit rate {hit_rate:.1%}'.format(**s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark suite: compile time, render latency, throughput and peak memory.
+
+Run with `python -m chartreux.bench`, see `python -m chartreux.bench --help`.
+"""
+
+import gc
+import math
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import chartreux
+from chartreux import compiler, renderer
+from . import workloads
+
+# metrics checked against a baseline, lower is better
+
+COMPARED = [
+    ('compile_ms', 'p50'),
+    ('render_ms', 'p50'),
+    ('render_ms', 'p90'),
+    ('peak_memory_kb', None),
+]
+
+
+def run(names=None, scale=1, runs=20, compile_runs=5, report=None):
+    """Run workloads and return the results as a JSON-compatible dict."""
+
+    res = {
+        'meta': {
+            'chartreux': chartreux.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'scale': scale,
+            'runs': runs,
+            'compile_runs': compile_runs,
+        },
+        'workloads': {},
+    }
+
+    for wl in workloads.ALL:
+        if names and wl.__name__ not in names:
+            continue
+        with tempfile.TemporaryDirectory() as dirname:
+            res['workloads'][wl.__name__] = measure(wl(dirname, scale), runs, compile_runs)
+        if report:
+            report(wl.__name__, res['workloads'][wl.__name__])
+
+    return res
+
+
+def measure(spec, runs, compile_runs):
+    options = spec.get('options', {})
+
+    if 'path' in spec:
+        def comp():
+            return compiler.compile_path(spec['path'], **options)
+    else:
+        def comp():
+            return compiler.compile(spec['text'], **options)
+
+    def render():
+        return renderer.call(template, spec['context'], error=spec.get('error'))
+
+    compile_times = [_timed(comp) for _ in range(compile_runs)]
+
+    template = comp()
+    out = render()
+
+    render_times = [_timed(render) for _ in range(runs)]
+
+    # peak memory of a single render, including its output
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        render()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    mean = sum(render_times) / len(render_times)
+
+    return {
+        'compile_ms': _stats(compile_times),
+        'render_ms': _stats(render_times),
+        'throughput': {
+            'renders_per_s': 1000 / mean if mean else None,
+            'output_mb_per_s': len(out) / 1e6 / (mean / 1000) if mean else None,
+        },
+        'output_kb': len(out) / 1024,
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def compare(current, baseline, threshold=10):
+    """Compare results with a baseline.
+
+    Returns a list of `(workload, metric, base, current, change_percent, is_regression)`.
+    A metric regresses when it grows by more than `threshold` percent.
+    """
+
+    rows = []
+
+    for name, cur in current['workloads'].items():
+        base = baseline.get('workloads', {}).get(name)
+        if not base:
+            continue
+        for metric, key in COMPARED:
+            a = _metric(base, metric, key)
+            b = _metric(cur, metric, key)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a * 100 if a else 0
+            label = metric + ('.' + key if key else '')
+            rows.append((name, label, a, b, change, change > threshold))
+
+    return rows
+
+
+def format_result(name, r):
+    return '{:14} compile {:9.2f} ms | render p50 {:9.2f} p90 {:9.2f} p99 {:9.2f} ms | {:9.1f}/s {:7.1f} MB/s | peak {:9.0f} KB'.format(
+        name,
+        r['compile_ms']['p50'],
+        r['render_ms']['p50'],
+        r['render_ms']['p90'],
+        r['render_ms']['p99'],
+        r['throughput']['renders_per_s'] or 0,
+        r['throughput']['output_mb_per_s'] or 0,
+        r['peak_memory_kb'],
+    )
+
+
+def format_comparison(rows):
+    lines = []
+    for name, label, a, b, change, bad in rows:
+        lines.append('{:14} {:18} {:12.2f} -> {:12.2f} {:+8.1f}%{}'.format(
+            name, label, a, b, change, '  REGRESSION' if bad else ''))
+    return '\n'.join(lines)
+
+
+##
+
+
+def _timed(fn):
+    t = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t) * 1000
+
+
+def _percentile(ts, p):
+    # nearest-rank percentile of sorted values
+    return ts[max(0, math.ceil(p / 100 * len(ts)) - 1)]
+
+
+def _stats(ts):
+    ts = sorted(ts)
+    return {
+        'min': ts[0],
+        'mean': sum(ts) / len(ts),
+        'p50': _percentile(ts, 50),
+        'p90': _percentile(ts, 90),
+        'p99': _percentile(ts, 99),
+        'max': ts[-1],
+    }
+
+
+def _metric(r, metric, key):
+    v = r.get(metric)
+    if key and isinstance(v, dict):
+        v = v.get(key)
+    return v if isinstance(v, (int, float)) else None
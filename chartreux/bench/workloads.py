@@ -0,0 +1,191 @@
+"""Benchmark workloads.
+
+A workload is a function `(dirname, scale) -> dict` which returns a template
+`text` (or a `path` to a template file in `dirname`), a render `context`
+and optional compile `options` and `error` function. `scale` is the size
+factor, `1` is the full size.
+"""
+
+import os
+
+
+def flat_text(dirname, scale):
+    """large flat text with sparse interpolations"""
+
+    lines = []
+    for n in range(_n(20000, scale)):
+        if n % 20 == 0:
+            lines.append('<p class="{cls}">paragraph %d, {title}</p>' % n)
+        else:
+            lines.append('Lorem ipsum dolor sit amet, consectetur adipiscing elit, line %d.' % n)
+
+    return {
+        'text': '\n'.join(lines),
+        'context': {'cls': 'text', 'title': 'Flat text'},
+    }
+
+
+def deep_if(dirname, scale):
+    """deeply nested @if/@elif/@else conditions"""
+
+    depth = _n(60, scale, minimum=6)
+    text = []
+
+    for n in range(depth):
+        text.append('@if v%d == 1' % n)
+        text.append('<a%d>' % n)
+    text.append('{leaf}')
+    for n in reversed(range(depth)):
+        text.append('@elif v%d == 2' % n)
+        text.append('two %d' % n)
+        text.append('@else')
+        text.append('none %d' % n)
+        text.append('@end')
+
+    context = {'v%d' % n: 1 for n in range(depth)}
+    context['leaf'] = 'leaf'
+
+    return {
+        'text': '\n'.join(text),
+        'context': context,
+    }
+
+
+def each_rows(dirname, scale):
+    """@each over 100k rows with filters"""
+
+    text = '''
+        <table>
+        @each rows as r index n
+            <tr class="{n}">
+                <td>{r.id}</td>
+                <td>{r.name | strip | html}</td>
+                <td>{r.price | ':.2f'}</td>
+                <td>{r.tags | join(', ') | upper}</td>
+                <td>{r.note | cut(20, '...')}</td>
+            </tr>
+        @end
+        </table>
+    '''
+
+    rows = [
+        {
+            'id': n,
+            'name': ' Product <%d> ' % n,
+            'price': n * 0.25,
+            'tags': ['tag%d' % (n % 7), 'tag%d' % (n % 11)],
+            'note': 'A fairly long product note that gets cut, number %d' % n,
+        }
+        for n in range(_n(100000, scale))
+    ]
+
+    return {
+        'text': text,
+        'context': {'rows': rows},
+    }
+
+
+def def_tree(dirname, scale):
+    """recursive @def rendering a tree"""
+
+    text = '''
+        @def node(n)
+            <li>{n.name}
+            @if n.children
+                <ul>
+                @each n.children as c
+                    @node c
+                @end
+                </ul>
+            @end
+            </li>
+        @end
+        <ul>
+        @node root
+        </ul>
+    '''
+
+    def make(depth, name):
+        return {
+            'name': name,
+            'children': [make(depth - 1, '%s.%d' % (name, i)) for i in range(4)] if depth else [],
+        }
+
+    return {
+        'text': text,
+        'context': {'root': make(_n(7, scale, minimum=3), 'root')},
+    }
+
+
+def includes(dirname, scale):
+    """layout built from many included partials"""
+
+    num = _n(50, scale, minimum=5)
+
+    _write(dirname, 'partials/item.cx', '''
+        <span class="item">{item.title | html}</span>
+    ''')
+
+    for n in range(num):
+        _write(dirname, 'partials/p%d.cx' % n, '''
+            <section id="s%d">
+                <h2>{sections[%d].title}</h2>
+                @each sections[%d].items as item
+                    @include ./item.cx
+                @end
+            </section>
+        ''' % (n, n, n))
+
+    _write(dirname, 'layout.cx', '\n'.join(
+        ['<html><body>', '@include ./header.cx'] +
+        ['@include ./partials/p%d.cx' % n for n in range(num)] +
+        ['</body></html>']
+    ))
+
+    _write(dirname, 'header.cx', '''
+        <header><h1>{title}</h1></header>
+    ''')
+
+    sections = [
+        {'title': 'Section %d' % n, 'items': [{'title': 'Item %d.%d' % (n, i)} for i in range(10)]}
+        for n in range(num)
+    ]
+
+    return {
+        'path': os.path.join(dirname, 'layout.cx'),
+        'context': {'title': 'Includes', 'sections': sections},
+    }
+
+
+def sparse_errors(dirname, scale):
+    """sparse context, most lookups fail and are reported"""
+
+    text = '''
+        @each rows as r
+            <div>{r.name}|{r.missing.prop}|{user.profile.name}|{r.price | ':.2f'}</div>
+        @end
+    '''
+
+    rows = [{'name': 'row %d' % n} if n % 2 else {'name': 'row %d' % n, 'price': n} for n in range(_n(5000, scale))]
+
+    return {
+        'text': text,
+        'context': {'rows': rows},
+        'error': lambda exc, path, line: None,
+    }
+
+
+ALL = [flat_text, deep_if, each_rows, def_tree, includes, sparse_errors]
+
+##
+
+
+def _n(n, scale, minimum=1):
+    return max(minimum, int(n * scale))
+
+
+def _write(dirname, name, text):
+    path = os.path.join(dirname, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.write(text)
@@ -0,0 +1,294 @@
+"""Template caches"""
+
+import collections
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from . import __version__
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with hit/miss/eviction counters."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                val = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def put(self, key, val):
+        with self.lock:
+            self.data[key] = val
+            self.data.move_to_end(key)
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.data),
+                'maxsize': self.maxsize,
+            }
+
+    def _evict(self):
+        while len(self.data) > max(self.maxsize, 0):
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+
+class FragmentCache(LRUCache):
+    """In-process cache of rendered fragments for the `@cache` command.
+
+    A bounded LRU cache, where entries can have a time to live (in seconds).
+    Expired entries are dropped on lookup and counted as misses.
+    """
+
+    def __init__(self, maxsize=256):
+        super().__init__(maxsize)
+        self.expired = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                expires, val = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self.data[key]
+                self.expired += 1
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def put(self, key, val, ttl=None):
+        super().put(key, (None if ttl is None else time.monotonic() + ttl, val))
+
+    def clear(self):
+        super().clear()
+        with self.lock:
+            self.expired = 0
+
+    def stats(self):
+        d = super().stats()
+        d['expired'] = self.expired
+        return d
+
+
+class FileFragmentCache:
+    """Cache of rendered fragments in a directory, which can be shared between processes.
+
+    Each entry is a file named by a hash of the `repr` of its key, so keys
+    should be made of strings and numbers. Expired entries are deleted on lookup.
+    """
+
+    suffix = '.cxf'
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # NB: the cache can be passed to other processes (e.g. with the runtime, see 'call_parallel')
+        d = dict(self.__dict__)
+        del d['lock']
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                expires, val = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            self._count('misses')
+            return default
+
+        if expires is not None and expires <= time.time():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            self._count('expired', 'misses')
+            return default
+
+        self._count('hits')
+        return val
+
+    def put(self, key, val, ttl=None):
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                marshal.dump((None if ttl is None else time.time() + ttl, str(val)), fp)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.dirname)
+        except OSError:
+            names = []
+        for name in names:
+            if name.endswith(self.suffix):
+                try:
+                    os.unlink(os.path.join(self.dirname, name))
+                except OSError:
+                    pass
+        with self.lock:
+            self.hits = self.misses = self.expired = 0
+
+    def stats(self):
+        try:
+            size = sum(1 for name in os.listdir(self.dirname) if name.endswith(self.suffix))
+        except OSError:
+            size = 0
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'size': size,
+            }
+
+    def _count(self, *names):
+        with self.lock:
+            for name in names:
+                setattr(self, name, getattr(self, name) + 1)
+
+    def _path(self, key):
+        h = hashlib.sha256(repr(key).encode('utf8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.dirname, h + self.suffix)
+
+
+class BytecodeCache:
+    """On-disk cache of compiled template code objects.
+
+    A cache file stores the marshalled code object and the python source
+    of a template along with the modification times and sizes of all included files, so that a changed
+    include invalidates the entry.
+    """
+
+    suffix = '.cxc'
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def key(self, text, fingerprint):
+        h = hashlib.sha256()
+        for s in (__version__, sys.version, importlib.util.MAGIC_NUMBER.hex(), fingerprint, text):
+            h.update(s.encode('utf8', 'surrogatepass'))
+            h.update(b'\x00')
+        return h.hexdigest()
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'rb') as fp:
+                deps, python, code = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        for path, mtime, size in deps:
+            if _stat(path) != (mtime, size):
+                return None
+
+        return python, code, [d[0] for d in deps]
+
+    def store(self, key, python, code, includes):
+        deps = [(path,) + _stat(path) for path in includes]
+        if any(d[1] is None for d in deps):
+            return
+
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                marshal.dump((deps, python, code), fp)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.dirname)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(self.suffix):
+                try:
+                    os.unlink(os.path.join(self.dirname, name))
+                except OSError:
+                    pass
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key + self.suffix)
+
+
+def make_key(*args):
+    """Convert compile arguments into a hashable cache key."""
+
+    return tuple(_freeze(a) for a in args)
+
+
+def _freeze(v):
+    if isinstance(v, dict):
+        return tuple(sorted((k, _freeze(x)) for k, x in v.items()))
+    if isinstance(v, (list, tuple, set, frozenset)):
+        return tuple(_freeze(x) for x in v)
+    try:
+        hash(v)
+    except TypeError:
+        # NB: unhashable objects (e.g. plugins) are keyed by identity
+        return ('id', id(v))
+    return v
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None, None
@@ -1,8 +1,15 @@
 """Template compiler"""
 
 import ast
+import builtins
+import hashlib
+import inspect
+import operator
 import os
 import re
+import time
+
+from . import cache, runtime
 
 
 class Error(ValueError):
@@ -26,6 +33,8 @@ ERROR_FILE = 'file not found'
 ERROR_NOT_SUPPORTED = 'syntax not supported'
 ERROR_ARG_NOT_SUPPORTED = 'argument syntax not supported'
 ERROR_FILTER = 'invalid or unknown filter'
+ERROR_OPTION = 'invalid option value'
+ERROR_STATIC = 'static value cannot be inlined'
 
 _DEFAULT_OPTIONS = {
     'syntax': {
@@ -34,25 +43,86 @@ _DEFAULT_OPTIONS = {
         'start': r'{(?=\S)',
         'end': r'}',
     },
+    'async_mode': False,
+    'autoescape': False,
+    'cache_dir': None,
     'filter': None,
     'finder': None,
     'globals': [],
     'name': '_RENDER',
     'path': '',
+    'runtime': None,
+    'static_context': None,
+    'stats': False,
     'strip': False,
     'commands': None,
+    'fast': False,
+    'fast_locals': True,
+    'fold': True,
+    'optimize': True,
 }
 
 _COMMAND_BLOCK = 0x01
 
+_DefaultRuntime = runtime.Runtime()
+
+# folded values are inlined as python literals, up to this length
+
+_FOLD_MAX_SIZE = 0x10000
+
 
 ##
 
 def compile(text, **options):
+    start = time.perf_counter()
     cc = Compiler(options)
+
+    bc = None
+    fingerprint = _options_fingerprint(cc.options) if cc.option('cache_dir') and _cacheable(cc.options) else None
+    if fingerprint:
+        bc = cache.BytecodeCache(cc.option('cache_dir'))
+        key = bc.key(text, fingerprint)
+        hit = bc.load(key)
+        if hit:
+            python, code, includes = hit
+            if cc.stats:
+                cc.stats.cached_hit(python, includes)
+            return _template(cc, python, cc.timed('exec', _exec)(code), includes, start)
+
     python = cc.run(text)
-    locs = _eval(python)
-    return locs[cc.option('name')]
+    code = cc.timed('compile', _code)(python, cc.code.lines)
+    if bc:
+        bc.store(key, python, code, cc.includes)
+    return _template(cc, python, cc.timed('exec', _exec)(code), cc.includes, start)
+
+
+def compile_iter(template):
+    """Return the streaming variant of a compiled template.
+
+    The variant is a generator function, which yields top-level output
+    chunks as they are produced.
+    """
+
+    fn = getattr(template, 'iter_function', None)
+    if not fn:
+        if template.source.startswith('async'):
+            _error(ERROR_NOT_SUPPORTED, None, None, 'async_mode')
+        python = re.sub(r'(?m)^(\s*)' + Code.iter_mark, r'\1', template.source)
+        fn = template.iter_function = _eval(python)[template.__name__]
+    return fn
+
+
+def compile_setup(template):
+    """Return the setup function of a compiled template.
+
+    The setup function binds a runtime and an error function once and returns
+    a function, which renders a context. It can be called many times in a row,
+    but not concurrently.
+    """
+
+    if template.source.startswith('async'):
+        _error(ERROR_NOT_SUPPORTED, None, None, 'async_mode')
+    return template.__globals__[template.__name__ + '_SETUP']
 
 
 def compile_path(path, **options):
@@ -63,7 +133,7 @@ def compile_path(path, **options):
 def translate(text, **options):
     cc = Compiler(options)
     python = cc.run(text)
-    _eval(python)
+    _code(python, cc.code.lines)
     return python
 
 
@@ -72,16 +142,49 @@ def translate_path(path, **options):
     return translate(_read(path), **options)
 
 
+def compile_source(python, name='_RENDER'):
+    """Create a template function from the python source of a compiled template (`template.source`).
+
+    Used to recreate templates in other processes, since template functions cannot be pickled.
+    """
+
+    ns = _eval(python)
+    fn = ns[name]
+    fn.source = python
+    fn.includes = []
+    fn.lines = {n: (ns['_PATHS'][p], ln) for n, (p, ln) in ns.get('_LINES', {}).items()}
+    fn.stats = None
+    return fn
+
+
 def _eval(python):
+    return _exec(_code(python))
+
+
+def _code(python, lines=None):
     try:
-        locs = {}
-        exec(python, {}, locs)
-        return locs
+        return builtins.compile(python, '<string>', 'exec')
     except SyntaxError as exc:
-        loc = _source_location(python, exc.lineno - 1)
+        loc = _source_location(lines or {}, exc.lineno)
         _error(ERROR_SYNTAX, loc[0], loc[1], exc.msg)
 
 
+def _exec(code):
+    # NB: the generated module has its own globals, which hold per-template data
+    ns = {}
+    exec(code, ns)
+    return ns
+
+
+def _template(cc, python, ns, includes, start=None):
+    fn = ns[cc.option('name')]
+    fn.source = python
+    fn.includes = includes
+    fn.stats = cc.stats.done(start) if cc.stats else None
+    fn.lines = {n: (ns['_PATHS'][p], ln) for n, (p, ln) in ns.get('_LINES', {}).items()}
+    return fn
+
+
 ##
 
 class Source:
@@ -106,6 +209,8 @@ class Parser:
 
     def add_source(self, text, path):
         self.source.append(Source(text, path))
+        if self.cc.stats:
+            self.cc.stats.template_lines += self.current_source.maxline
 
     @property
     def current_source(self):
@@ -201,6 +306,9 @@ class Expression:
     def __init__(self, compiler):
         self.cc = compiler
         self.default_filter = [None, None]
+        self.safe = False
+        self.value = _NOCONST
+        self.node = None
 
     def _ast(self, arg):
         try:
@@ -224,10 +332,20 @@ class Expression:
         has_filter = _cname(n.body) == 'BinOp' and _cname(n.body.op) == 'BitOr'
         flt = self.get_default_filter()
 
+        node = n.body
         if with_default_filter and flt and not has_filter:
-            return self.make_filter(n, flt)
+            node = ast.BinOp(left=n.body, op=ast.BitOr(), right=flt)
+
+        # 'value' is the compile-time value of the whole expression, if any
 
-        return self.walk(n)
+        self.node = node
+        self.value = self.fold(node, output=with_default_filter)
+        if self.value is not _NOCONST:
+            self.safe = True
+            return repr(self.value)
+
+        self.safe = node is n.body and self.is_safe(node)
+        return self.walk(node)
 
     def parse_ast(self, node):
         return self.walk(node)
@@ -241,7 +359,12 @@ class Expression:
     def walk(self, n):
         t = _cname(n)
 
-        if t == 'NameConstant':
+        if t in self._foldable:
+            v = self.fold(n)
+            if v is not _NOCONST:
+                return repr(v)
+
+        if t in ('Constant', 'NameConstant'):
             return repr(n.value)
         if t == 'Num':
             return repr(n.n)
@@ -269,10 +392,12 @@ class Expression:
         if t == 'Name':
             if self.is_global(n) or self.is_local(n):
                 return n.id
+            if self.is_static(n):
+                return self.cc.error(ERROR_STATIC, n.id)
             return self.make_context_getter(n.id)
 
         if t == 'Call':
-            return _f('{}({})', self.walk(n.func), _comma(self.walk_args(n)))
+            return self.awaited(_f('{}({})', self.walk(n.func), _comma(self.walk_args(n))))
         if t == 'keyword':
             e = self.walk(n.value)
             if n.arg:
@@ -304,6 +429,168 @@ class Expression:
 
         return self.cc.error(ERROR_NOT_SUPPORTED, t)
 
+    # constant folding
+    #
+    # literal-only expressions and pure filters applied to them are evaluated at compile time,
+    # using the 'runtime' option to look up filters. If the evaluation fails, the expression
+    # is left for the run time, so that the error is reported as usual
+    #
+    # runtime methods are only called at compile time if the render runtime is known,
+    # that is, with the 'runtime' option, or if they must be, for 'static_context' values.
+    # Methods called this way are recorded and checked against the render runtime, see 'fold_runtime'
+
+    _foldable = {'Attribute', 'BinOp', 'BoolOp', 'Compare', 'IfExp', 'Name', 'Subscript', 'UnaryOp'}
+
+    _fold_operators = {
+        'Add': operator.add,
+        'Div': operator.truediv,
+        'FloorDiv': operator.floordiv,
+        'Mod': operator.mod,
+        'Mult': operator.mul,
+        'Pow': operator.pow,
+        'Sub': operator.sub,
+        'Not': operator.not_,
+        'UAdd': operator.pos,
+        'USub': operator.neg,
+        'Gt': operator.gt,
+        'GtE': operator.ge,
+        'Lt': operator.lt,
+        'LtE': operator.le,
+        'Eq': operator.eq,
+        'NotEq': operator.ne,
+        'In': lambda a, b: a in b,
+        'NotIn': lambda a, b: a not in b,
+    }
+
+    def fold(self, n, output=False):
+        # NB: 'static_context' implies 'fold'
+        if not self.cc.option('fold') and not self.cc.option('static_context'):
+            return _NOCONST
+        try:
+            v = self.evaluate(n)
+        except Exception:
+            return _NOCONST
+        # NB: safe markup can only be inlined as output text, elsewhere it would become a plain str
+        if output and type(v) is runtime.Markup:
+            return v if _is_literal(str(v)) else _NOCONST
+        if not _is_literal(v):
+            return _NOCONST
+        return v
+
+    def evaluate(self, n):
+        t = _cname(n)
+
+        if t in ('Constant', 'NameConstant'):
+            return n.value
+        if t == 'Num':
+            return n.n
+        if t == 'Str':
+            return n.s
+
+        if t == 'List':
+            return [self.evaluate(x) for x in n.elts]
+        if t == 'Dict':
+            return {self.evaluate(k): self.evaluate(v) for k, v in zip(n.keys, n.values)}
+
+        # names from the 'static_context' option and their properties
+
+        if t == 'Name':
+            if self.is_static(n):
+                return self.cc.option('static_context')[n.id]
+            raise _NotConstant()
+        if t == 'Attribute':
+            return self.fold_runtime('get', n).get(self.evaluate(n.value), n.attr)
+        if t == 'Subscript':
+            return self.evaluate(n.value)[self.evaluate(n.slice)]
+        if t == 'Index':
+            return self.evaluate(n.value)
+
+        if t == 'BinOp':
+            if _cname(n.op) == 'BitOr':
+                return self.evaluate_filter(n.left, n.right)
+            a = self.evaluate(n.left)
+            b = self.evaluate(n.right)
+            _check_fold_size(_cname(n.op), a, b)
+            return self._fold_operators[_cname(n.op)](a, b)
+
+        if t == 'UnaryOp':
+            return self._fold_operators[_cname(n.op)](self.evaluate(n.operand))
+
+        if t == 'BoolOp':
+            v = None
+            for x in n.values:
+                v = self.evaluate(x)
+                if bool(v) == (_cname(n.op) == 'Or'):
+                    break
+            return v
+
+        if t == 'Compare':
+            a = self.evaluate(n.left)
+            for o, c in zip(n.ops, n.comparators):
+                b = self.evaluate(c)
+                if not self._fold_operators[_cname(o)](a, b):
+                    return False
+                a = b
+            return True
+
+        if t == 'IfExp':
+            return self.evaluate(n.body) if self.evaluate(n.test) else self.evaluate(n.orelse)
+
+        raise _NotConstant()
+
+    def evaluate_filter(self, le, ri):
+        t = _cname(ri)
+        args, kwargs = [], {}
+
+        if t == 'Name':
+            name = ri.id
+        elif t == 'Call' and _cname(ri.func) == 'Name':
+            name = ri.func.id
+            args = [self.evaluate(a) for a in ri.args]
+            for k in ri.keywords:
+                if not k.arg:
+                    raise _NotConstant()
+                kwargs[k.arg] = self.evaluate(k.value)
+        elif t in ('Str', 'Constant') and isinstance(self.evaluate(ri), str):
+            name = 'format'
+            fmt = self.evaluate(ri)
+            args = ['{' + fmt + '}' if '{' not in fmt else fmt]
+        else:
+            raise _NotConstant()
+
+        if name in self.cc.scope:
+            raise _NotConstant()
+
+        rt = self.fold_runtime(self.filter_prefix + name, le)
+        fn = getattr(rt, self.filter_prefix + name, None) if rt else None
+        if not getattr(fn, 'pure', False) or inspect.iscoroutinefunction(fn):
+            raise _NotConstant()
+
+        val = self.evaluate(le)
+
+        # in the autoescape mode, markup filters escape their input, see 'BaseRuntime.filter'
+
+        if self.cc.option('autoescape') and name in getattr(rt, 'markup_filters', ()):
+            val = self.fold_runtime('escape', le).escape(val)
+
+        return fn(val, *args, **kwargs)
+
+    def fold_runtime(self, attr, node=None):
+        # the runtime to call 'attr' at compile time, or None if the render runtime is unknown
+        #
+        # the method is recorded in the template and '_RENDER_SETUP' checks
+        # that the render runtime has the same one, see 'BaseRuntime.check_runtime'
+
+        rt = self.cc.option('runtime')
+        if not rt:
+            if node is None or not any(_cname(x) == 'Name' and self.is_static(x) for x in ast.walk(node)):
+                return None
+            rt = _DefaultRuntime
+        fn = getattr(type(rt), attr, None)
+        if fn:
+            self.cc.folded[attr] = _qualname(fn)
+        return rt
+
     def fix_args(self, args):
         args = args.strip()
 
@@ -332,16 +619,24 @@ class Expression:
     filter_prefix = 'filter_'
 
     def filter_call(self, name, args):
-        # a filter is either a local var or 'self.filter_xxx'
+        # a filter is either a local var or a runtime filter, bound once per call, see Code.filter_var
         if name in self.cc.scope:
-            return _f('{}({})', name, args)
-        return _f('_RT.{}{}({})', self.filter_prefix, name, args)
+            return self.awaited(_f('{}({})', name, args))
+        return self.awaited(_f('{}({})', self.cc.code.filter_var(name), args))
 
     def make_filter(self, le, ri):
         t = _cname(ri)
 
         # xyz | html
+        # xyz | strip | lower | html (fused, see BaseRuntime.fused)
         if t == 'Name':
+            names = [ri.id]
+            if ri.id not in self.cc.scope and not self.cc.option('async_mode') and Optimizer(self.cc).enabled('fuse_filters'):
+                while self.is_runtime_filter(le):
+                    names.insert(0, le.right.id)
+                    le = le.left
+            if len(names) > 1:
+                return _f('{}({})', self.cc.code.fused_var(names), self.walk(le))
             return self.filter_call(ri.id, self.walk(le))
 
         # xyz | cut(5)
@@ -353,8 +648,8 @@ class Expression:
             return self.filter_call(func.id, _comma(args))
 
         # xyz | '{:1f}'
-        if t == 'Str':
-            fmt = ri.s
+        if t == 'Str' or (t == 'Constant' and isinstance(ri.value, str)):
+            fmt = ri.value if t == 'Constant' else ri.s
             if '{' not in fmt:
                 fmt = '{' + fmt + '}'
             args = [self.walk(le), repr(fmt)]
@@ -362,12 +657,48 @@ class Expression:
 
         return self.cc.error(ERROR_FILTER, t)
 
+    def is_runtime_filter(self, n):
+        # is this a 'xyz | name' node with a runtime filter?
+        return (
+                _cname(n) == 'BinOp'
+                and _cname(n.op) == 'BitOr'
+                and _cname(n.right) == 'Name'
+                and n.right.id not in self.cc.scope)
+
     def operator(self, n):
         t = _cname(n)
         if t not in self._operators:
             return self.cc.error(ERROR_NOT_SUPPORTED, t)
         return self._operators[t]
 
+    def is_safe(self, n):
+        # can an expression be evaluated without raising?
+        #
+        # context variables and dot access report errors via '_ERR' and return undef,
+        # so they only raise when the render is aborted anyway
+
+        if self.cc.option('async_mode') or self.cc.option('fast'):
+            return False
+
+        t = _cname(n)
+
+        if t in ('Constant', 'NameConstant', 'Num', 'Str'):
+            return True
+        if t == 'Name':
+            if n.id in self.cc.bound:
+                return True
+            return not self.is_global(n) and not self.is_local(n)
+        if t == 'Attribute':
+            return not self.is_global(n) and self.is_safe(n.value)
+
+        # NB: operators are not safe, even 'not' or '==' call user methods (__bool__, __eq__), which can raise
+
+        return False
+
+    def is_static(self, n):
+        static = self.cc.option('static_context')
+        return bool(static) and n.id in static and not self.is_global(n) and not self.is_local(n)
+
     def is_global(self, n):
         t = _cname(n)
         if t == 'Attribute':
@@ -390,12 +721,25 @@ class Expression:
 
     def make_getter(self, var, prop):
         fn = '_GET_NOEXC' if self.cc.noexc_block else '_GET'
-        return _f('{}({},{},__POS__)', fn, var, repr(prop))
+        site = self.cc.code.new_site()
+        return self.awaited(_f('{}({},{},{})', fn, var, repr(prop), site))
 
     def make_context_getter(self, var):
-        self.cc.code.add_context_var(var)
         fn = '_GET_VAR_NOEXC' if self.cc.noexc_block else '_GET_VAR'
-        return _f('{}({},__POS__)', fn, repr(var))
+        e = _f('{}({})', fn, repr(var))
+        # with 'fast_locals', context variables are bound to locals once per call, see Code.python
+        if self.cc.option('fast_locals'):
+            e = _f('(_CV_{} if _CV_{} is not _UNSET else {})', var, var, e)
+            self.cc.code.add_context_var(var, local=True)
+        else:
+            self.cc.code.add_context_var(var)
+        return self.awaited(e)
+
+    def awaited(self, e):
+        # in the async mode, values are awaited when they are accessed
+        if self.cc.option('async_mode'):
+            return _f('(await _AWAIT({}))', e)
+        return e
 
 
 class Command:
@@ -472,16 +816,27 @@ class Command:
             v = self.cc.new_var()
             self.cc.code.add('_PUSHBUF()')
             self.cc.parser.parse_until('end')
-            self.cc.code.add(_f('{} = _POPBUF()', v))
+            self.cc.code.add(_f('{} = {}', v, self.cc.code.popbuf()))
             args.insert(0, v)
-            self.cc.code.try_block(_f('_PRINT({}({}))', cmd, _comma(args)))
-        else:
-            self.cc.code.try_block(_f('_PRINT({}({}))', cmd, _comma(args)))
+
+        aw = 'await ' if self.cc.option('async_mode') else ''
+        self.cc.code.try_block(_f('_PRINT({})', self.cc.code.escaped(_f('{}{}({})', aw, cmd, _comma(args)))))
 
     def text_command(self, arg):
         for m, val in self.parse_interpolations(arg, with_default_filter=True):
-            if m:
-                self.cc.code.try_block(_f('_PRINT({})', val))
+            if m and self.cc.expression.value is not _NOCONST:
+                # NB: constant values become text, see Expression.fold
+                v = self.cc.expression.value
+                rt = self.cc.expression.fold_runtime('escape', self.cc.expression.node) if self.cc.option('autoescape') else None
+                if rt:
+                    v = rt.escape(v)
+                if rt or not self.cc.option('autoescape') or v is None or type(v) is runtime.Markup:
+                    self.cc.code.text('' if v is None else str(v))
+                else:
+                    self.cc.code.try_block(_f('_PRINT({})', self.cc.code.escaped(val)), safe=True)
+            elif m:
+                # NB: apart from str() errors in Writer outputs, printing a safe value doesn't raise
+                self.cc.code.try_block(_f('_PRINT({})', self.cc.code.escaped(val)), safe=self.cc.expression.safe)
             else:
                 self.cc.code.string(val)
 
@@ -500,14 +855,18 @@ class Command:
 
         self.cc.options[arg[0]] = val
 
-    def if_head(self, arg):
+    def if_head(self, e):
+        if self.cc.option('fast'):
+            self.cc.code.add(_f('if {}:', e), 'if_branch', head=e, safe=True)
+            return
+        safe = self.cc.expression.safe
         v = self.cc.new_var()
-        e = self.cc.expression.parse(arg)
         self.cc.code.try_block(
             _f('{} = {}', v, e),
-            _f('{} = None', v)
+            _f('{} = None', v),
+            safe=safe
         )
-        self.cc.code.add(_f('if {}:', v))
+        self.cc.code.add(_f('if {}:', v), 'if_branch', head=e, safe=safe)
 
     def command_if(self, arg):
         # @if cond ...flow... @elif cond ...flow... @else ...flow... @end
@@ -539,38 +898,57 @@ class Command:
                         zzzz
                         break
 
-
+            conditions with known values (see Expression.fold) are resolved at compile time:
+            false branches and branches after a true one are not emitted,
+            the 'for' construct is only used when there are conditions left
         """
 
-        self.cc.code.add(_f('for {} in "_":', self.cc.new_var()))
-        self.cc.code.begin()
-
-        self.if_head(arg)
-        self.cc.code.begin()
+        opened = False
+        taken = False
+        cmd = 'if'
+
+        while cmd != 'end':
+            live = cond = False
+
+            if not taken:
+                static = True
+                if cmd != 'else':
+                    e = self.cc.expression.parse(arg)
+                    v = self.cc.expression.value
+                    static = bool(v) if v is not _NOCONST else None
+
+                if static is None:
+                    if not opened:
+                        self.cc.code.add(_f('for {} in "_":', self.cc.new_var()), 'if_chain')
+                        self.cc.code.begin()
+                        opened = True
+                    self.if_head(e)
+                    self.cc.code.begin()
+                    live = cond = True
+                elif static:
+                    if opened:
+                        self.cc.code.add('if True:', 'if_else')
+                        self.cc.code.begin()
+                        cond = True
+                    live = taken = True
+
+            if not live:
+                self.cc.code.mute_begin()
 
-        while True:
-            cmd, arg = self.cc.parser.parse_until('end', 'else', 'elif')
-            if cmd == 'elif':
-                self.cc.code.add('break')
-                self.cc.code.end()
-                self.if_head(arg)
-                self.cc.code.begin()
-                continue
-            if cmd == 'end':
-                self.cc.code.add('break')
-                self.cc.code.end()
-                break
             if cmd == 'else':
-                self.cc.code.add('break')
-                self.cc.code.end()
-                self.cc.code.add('if True:')
-                self.cc.code.begin()
-                self.cc.parser.parse_until('end')
-                self.cc.code.add('break')
+                cmd, arg = self.cc.parser.parse_until('end')
+            else:
+                cmd, arg = self.cc.parser.parse_until('end', 'else', 'elif')
+
+            if not live:
+                self.cc.code.mute_end()
+
+            if cond:
+                self.cc.code.add('break', 'break')
                 self.cc.code.end()
-                break
 
-        self.cc.code.end()
+        if opened:
+            self.cc.code.end()
 
     def command_return(self, arg):
         # @return expr
@@ -613,7 +991,7 @@ class Command:
 
     func_def_re = r'^(\w+)(.*)$'
 
-    def parse_def_body(self, arg, flags):
+    def parse_def_body(self, arg, flags, pure=False):
         m = re.search(self.func_def_re, arg)
         if not m:
             self.cc.error(ERROR_DEF)
@@ -627,11 +1005,28 @@ class Command:
         arg_names, signature = self.parse_def_args(args)
         self.cc.scope.update(arg_names)
 
+        # a pure def is compiled under an internal name and wrapped in a memo, see 'memo_wrapper'
+
+        fname = name
+        if pure:
+            self.cc.pure_defs.append(name)
+            src = self.cc.parser.current_source
+            pos = src.path, src.lineno
+            fname = self.cc.new_var()
+            memo = self.cc.new_var()
+            self.cc.code.add(_f('{} = _RT.memo({!r}, {!r}, {!r})', memo, name, src.path, src.lineno))
+
         snt = self.cc.new_var()
         fun = self.cc.new_var()
         res = self.cc.new_var()
         buf = self.cc.new_var()
 
+        # in the async mode, def's are coroutines
+
+        df, aw = 'def', ''
+        if self.cc.option('async_mode'):
+            df, aw = 'async def', 'await '
+
         # def's are wrapped in push/popbuf to allow explicit @return's
         #
         # def userfunc(args):
@@ -648,28 +1043,104 @@ class Command:
         #     return buf if res == snt else res
         #
 
-        self.cc.code.add(_f('def {}({}):', name, signature))
+        self.cc.code.add(_f('{} {}({}):', df, fname, signature))
         self.cc.code.begin()
 
         self.cc.code.add(_f('{} = object()', snt))
 
-        self.cc.code.add(_f('def {}():', fun))
+        self.cc.code.add(_f('{} {}():', df, fun))
         self.cc.code.begin()
 
+        bound = self.cc.bound
+        self.cc.bound = bound | set(arg_names)
         self.cc.parser.parse_until('end')
+        self.cc.bound = bound
         self.cc.code.add(_f('return {}', snt))
         self.cc.code.end()
 
         self.cc.code.add('_PUSHBUF()')
-        self.cc.code.add(_f('{} = {}()', res, fun))
-        self.cc.code.add(_f('{} = _POPBUF()', buf))
+        self.cc.code.add(_f('{} = {}{}()', res, aw, fun))
+        self.cc.code.add(_f('{} = {}', buf, self.cc.code.popbuf()))
         self.cc.code.add(_f('return {} if {} == {} else {}', buf, res, snt, res))
         self.cc.code.end()
 
         self.cc.pop_scope()
 
+        if pure:
+            self.memo_wrapper(name, fname, memo, args, signature, pos)
+
         return name
 
+    def memo_wrapper(self, name, fname, memo, args, signature, pos):
+        # def name(args):
+        #     try:
+        #         key = (arg, type(arg), ...)
+        #         res = memo.cache[key]
+        #     except KeyError:
+        #         return memo.put(key, fname(args))
+        #     except TypeError:
+        #         (unhashable arguments are not cached)
+        #         memo.counters[2] += 1
+        #         return fname(args)
+        #     memo.counters[0] += 1
+        #     return res
+        #
+        # the key includes argument types, so that e.g. 1, 1.0 and True are cached separately
+
+        node = self.cc.expression.parse_args_ast(args)
+
+        key = []
+        call = []
+
+        for a in node.args:
+            if _cname(a) == 'Name':
+                key.append(_f('{0}, type({0})', a.id))
+                call.append(a.id)
+            else:
+                key.append(_f('{0}, tuple(map(type, {0}))', a.value.id))
+                call.append(_f('*{}', a.value.id))
+
+        for a in node.keywords:
+            if a.arg:
+                key.append(_f('{0}, type({0})', a.arg))
+                call.append(_f('{0}={0}', a.arg))
+            else:
+                key.append(_f('frozenset((k, v, type(v)) for k, v in {}.items())', a.value.id))
+                call.append(_f('**{}', a.value.id))
+
+        k = self.cc.new_var()
+        res = self.cc.new_var()
+
+        df, aw = 'def', ''
+        if self.cc.option('async_mode'):
+            df, aw = 'async def', 'await '
+
+        code = [
+            _f('{} {}({}):', df, name, signature),
+            'BEGIN',
+            'try:',
+            'BEGIN',
+            _f('{} = ({},)', k, _comma(key)) if key else _f('{} = ()', k),
+            _f('{} = {}.cache[{}]', res, memo, k),
+            'END',
+            'except KeyError:',
+            'BEGIN',
+            _f('return {}.put({}, {}{}({}))', memo, k, aw, fname, _comma(call)),
+            'END',
+            'except TypeError:',
+            'BEGIN',
+            _f('{}.counters[2] += 1', memo),
+            _f('return {}{}({})', aw, fname, _comma(call)),
+            'END',
+            _f('{}.counters[0] += 1', memo),
+            _f('return {}', res),
+            'END',
+        ]
+
+        # the wrapper is mapped to the @pure line, like the def itself
+        for s in code:
+            self.cc.code.add(s, pos=pos)
+
     def command_def(self, arg):
         # @def name args ...body... @end
         self.parse_def_body(arg, 0)
@@ -678,6 +1149,10 @@ class Command:
         # @block name args ...body... @end
         self.parse_def_body(arg, _COMMAND_BLOCK)
 
+    def command_pure(self, arg):
+        # @pure name args ...body... @end
+        self.parse_def_body(arg, 0, pure=True)
+
     def command_import(self, arg):
         # @import arg
 
@@ -704,6 +1179,9 @@ class Command:
                     return self.cc.error(ERROR_EOF)
                 buf.append(ln.rstrip())
 
+        # NB: raw code can read and write the context, so it has to be looked up dynamically
+        self.cc.code.dynamic_context = True
+
         self.cc.code.try_block(_dedent(buf))
 
     def parse_quote(self, arg, emit=True):
@@ -758,7 +1236,76 @@ class Command:
                 return self.cc.error(ERROR_BLOCK_MULTI_LET)
             self.cc.code.add('_PUSHBUF()')
             self.cc.parser.parse_until('end')
-            self.cc.code.add(_f('{} = _POPBUF()', _comma(names)))
+            self.cc.code.add(_f('{} = {}', _comma(names), self.cc.code.popbuf()))
+
+    cache_re = r'''(?x)
+        ^
+        (?P<key> .+?)
+        (
+            (\s+ | \s*,\s*)
+            ttl \s* = (?!=) \s*
+            (?P<ttl> .+)
+        )?
+        $
+    '''
+
+    def command_cache(self, arg):
+        # @cache key [ttl=seconds] ...flow... @end
+        #
+        # errors = number of reported errors
+        # try:
+        #     key = (path, line, key,)
+        #     val = CACHE_GET(key)
+        # except:
+        #     key = val = None
+        # if val is None:
+        #     PUSHBUF
+        #     ...flow...
+        #     val = POPBUF
+        #     if key is not None and no new errors:
+        #         CACHE_PUT(key, val, ttl)
+        # PRINT(val)
+        #
+        # fragments with reported errors (in the key or the flow) are printed, but not cached
+        #
+        # the key is prefixed with the '@cache' site, that is, the template path
+        # (or a digest of the text) and the line, so that other sites don't share it
+
+        m = re.search(self.cache_re, arg.strip())
+        if not m:
+            return self.cc.error(ERROR_IDENT)
+
+        src = self.cc.parser.current_source
+        site = (src.path or hashlib.sha256(''.join(src.lines).encode('utf8', 'surrogatepass')).hexdigest(), src.lineno)
+
+        keys = [repr(x) for x in site] + self.cc.expression.parse_args(m.group('key'))
+        ttl = self.cc.expression.parse(m.group('ttl')) if m.group('ttl') else 'None'
+
+        key = self.cc.new_var()
+        val = self.cc.new_var()
+        err = self.cc.new_var()
+
+        self.cc.code.add(_f('{} = _ST.errors', err))
+        self.cc.code.try_block(
+            [
+                _f('{} = ({},)', key, _comma(keys)),
+                _f('{} = {}({})', val, self.cc.code.runtime_var('_CACHE_GET', 'cache_get'), key),
+            ],
+            _f('{} = {} = None', key, val)
+        )
+
+        self.cc.code.add(_f('if {} is None:', val))
+        self.cc.code.begin()
+        self.cc.code.add('_PUSHBUF()')
+        self.cc.parser.parse_until('end')
+        self.cc.code.add(_f('{} = _POPBUF()', val))
+        self.cc.code.add(_f('if {} is not None and _ST.errors == {}:', key, err))
+        self.cc.code.begin()
+        self.cc.code.try_block(_f('{}({}, {}, {})', self.cc.code.runtime_var('_CACHE_PUT', 'cache_put'), key, val, ttl))
+        self.cc.code.end()
+        self.cc.code.end()
+
+        self.cc.code.add(_f('_PRINT({})', val))
 
     def command_var(self, arg):
         # @var var, var,... DEPRECATED
@@ -812,16 +1359,26 @@ class Command:
 
         self.cc.scope.update(vnames.values())
 
+        # in the async mode, async iterables are collected with 'aiter'
+
+        it = 'await _RT.aiter' if self.cc.option('async_mode') else '_RT.iter'
+
         if vnames['x'] and vnames['y']:
-            init = _f('{} = _RT.iter2({})', lst, e)
+            init = _f('{} = {}2({})', lst, it, e)
             head = _f('for {}, {} in {}:', vnames['x'], vnames['y'], lst)
         elif vnames['x']:
-            init = _f('{} = _RT.iter1({})', lst, e)
+            init = _f('{} = {}1({})', lst, it, e)
             head = _f('for {} in {}:', vnames['x'], lst)
         else:
-            init = _f('{} = _RT.iter1({})', lst, e)
+            init = _f('{} = {}1({})', lst, it, e)
             head = _f('for {} in {}:', self.cc.new_var(), lst)
 
+        # the total length is only computed if it's requested, other loops consume the iterable lazily
+
+        init = [init]
+        if vnames['len']:
+            init.append(_f('{} = _RT.sized({})', lst, lst))
+
         self.cc.code.try_block(
             init,
             _f('{} = []', lst))
@@ -837,10 +1394,24 @@ class Command:
         if vnames['index']:
             self.cc.code.add(_f('{} += 1', vnames['index']))
 
+        bound = self.cc.bound
+        self.cc.bound = bound | set(v for v in vnames.values() if v)
         cmd, _ = self.cc.parser.parse_until('end', 'else')
+        self.cc.bound = bound
+
+        # an iterator can't be checked for emptiness, so the loop body resets the iterable variable
+        # (which doesn't affect the running loop) and @else runs if it's still set:
+        #
+        # for x in lst:
+        #     ...
+        #     lst = None
+        # if lst is not None:
+        #     ...else...
+
         if cmd == 'else':
+            self.cc.code.add(_f('{} = None', lst))
             self.cc.code.end()
-            self.cc.code.add(_f('if not {}:', lst))
+            self.cc.code.add(_f('if {} is not None:', lst), 'else')
             self.cc.code.begin()
             self.cc.parser.parse_until('end')
 
@@ -860,6 +1431,7 @@ class Command:
         self.cc.noexc_block += 1
 
         e = self.cc.expression.parse(arg)
+        v = self.cc.expression.value
 
         # NB 'with' argument never throws
 
@@ -872,18 +1444,40 @@ class Command:
 
         self.cc.scope.add(name)
 
-        self.cc.code.add(_f('if not _RT.isempty({}):', name))
-        self.cc.code.begin()
+        # with a known value, only one of the branches is emitted
+
+        static = None
+        rt = self.cc.expression.fold_runtime('isempty', self.cc.expression.node) if v is not _NOCONST else None
+        if rt:
+            static = not rt.isempty(v)
+
+        if static is None:
+            self.cc.code.add(_f('if not _RT.isempty({}):', name))
+            self.cc.code.begin()
+        elif not static:
+            self.cc.code.mute_begin()
 
+        bound = self.cc.bound
+        self.cc.bound = bound | {name}
         cmd, _ = self.cc.parser.parse_until('end', 'else')
+        self.cc.bound = bound
 
-        if cmd == 'else':
+        if static is None:
             self.cc.code.end()
-            self.cc.code.add('else:')
-            self.cc.code.begin()
-            self.cc.parser.parse_until('end')
+        elif not static:
+            self.cc.code.mute_end()
 
-        self.cc.code.end()
+        if cmd == 'else':
+            if static is None:
+                self.cc.code.add('else:', 'else')
+                self.cc.code.begin()
+            elif static:
+                self.cc.code.mute_begin()
+            self.cc.parser.parse_until('end')
+            if static is None:
+                self.cc.code.end()
+            elif static:
+                self.cc.code.mute_end()
 
     def command_include(self, arg):
         # @include path
@@ -892,6 +1486,7 @@ class Command:
         path = fn(self.cc.parser.current_source.path, arg.strip())
         if path:
             self.cc.parser.add_source(_read(path, self.cc), path)
+            self.cc.includes.append(path)
 
 
 class Code:
@@ -900,12 +1495,22 @@ class Code:
         self.cc = compiler
         self.buf = []
         self.textbuf = []
+        self.textpos = None
         self.context_vars = set()
-
-    def _emit(self, s):
-        if s:
+        self.local_vars = set()
+        self.dynamic_context = False
+        self.num_sites = 0
+        self.num_try = 0
+        self.mute = 0
+        self.filters = {}
+        self.fused = {}
+        self.helpers = {}
+
+    def _emit(self, s, kind=None, pos=None, **meta):
+        if s and not self.mute:
             src = self.cc.parser.current_source
-            self.buf.append([src.path, src.lineno, s])
+            path, line = pos or (src.path, src.lineno)
+            self.buf.append(Node(path, line, s, kind, meta))
 
     def _flushbuf(self):
         if self.textbuf:
@@ -917,11 +1522,12 @@ class Code:
                 if not s:
                     return
 
-            self._emit(_f('_PRINT({})', repr(s)))
+            # NB: buffered text is mapped to the line where it starts
+            self._emit(_f('_PRINT({})', repr(s)), 'text', pos=self.textpos, text=s)
 
-    def add(self, s):
+    def add(self, s, kind=None, **meta):
         self._flushbuf()
-        self._emit(s)
+        self._emit(s, kind, **meta)
 
     def begin(self):
         self.add('BEGIN')
@@ -930,153 +1536,639 @@ class Code:
         self.add('END')
 
     def string(self, s):
-        self.textbuf.append(s)
+        if not self.mute:
+            if not self.textbuf:
+                src = self.cc.parser.current_source
+                self.textpos = src.path, src.lineno
+            self.textbuf.append(s)
+
+    def mute_begin(self):
+        # code between mute_begin and mute_end is parsed, but not emitted (dead branches)
+        self._flushbuf()
+        self.mute += 1
+
+    def mute_end(self):
+        self._flushbuf()
+        self.mute -= 1
+
+    def text(self, s):
+        # output text which is not subject to 'strip'
+        self._flushbuf()
+        if s:
+            self._emit(_f('_PRINT({})', repr(s)), 'text', text=s)
+
+    def raw_try_block(self, body, fallback, exc_var=None, **meta):
+        # 'meta' describes the body for the optimizer, e.g. 'safe' means the body never raises
 
-    def raw_try_block(self, body, fallback, exc_var=None):
         exc_var = exc_var or self.cc.new_var()
-        self.add('try:')
+        fallback = _as_list(fallback)
+
+        self.add('try:', 'try', **meta)
         self.begin()
         for ln in _as_list(body):
             self.add(ln)
         self.end()
-        self.add(_f('except Exception as {}:', exc_var))
+        self.add(
+            _f('except Exception as {}:', exc_var),
+            'except',
+            fallback=[re.sub(r'\b' + exc_var + r'\b', '$', ln) for ln in fallback])
         self.begin()
-        for ln in _as_list(fallback):
+        for ln in fallback:
             self.add(ln)
         self.end()
 
-    def try_block(self, body, fallback=None):
+    def try_block(self, body, fallback=None, **meta):
         if not body:
             return
 
+        # in the fast mode, errors are only caught by the outer handler, see 'python'
+
+        if self.cc.option('fast'):
+            for ln in _as_list(body):
+                self.add(ln)
+            return
+
         exc = self.cc.new_var()
 
         fallback = _as_list(fallback or [])
-        fallback.insert(0, _f('_ERR({},__POS__)', exc))
+        fallback.insert(0, _f('_ERR({})', exc))
+
+        self.raw_try_block(body, fallback, exc, **meta)
 
-        self.raw_try_block(body, fallback, exc)
+    def tree(self):
+        # convert the flat buffer into a tree of nodes, BEGIN...END become the body of the preceding node
 
-    def add_context_var(self, v):
-        self.context_vars.add(v)
+        root = []
+        stack = [root]
+
+        for node in self.buf:
+            if node.op == 'BEGIN':
+                stack[-1][-1].body = []
+                stack.append(stack[-1][-1].body)
+            elif node.op == 'END':
+                stack.pop()
+            else:
+                stack[-1].append(node)
+
+        return root
+
+    def add_context_var(self, v, local=False):
+        if not self.mute:
+            self.context_vars.add(v)
+            if local:
+                self.local_vars.add(v)
+
+    def filter_var(self, name):
+        if name not in self.filters and not self.mute:
+            self.filters[name] = '_F_' + name
+        return '_F_' + name
+
+    def fused_var(self, names):
+        names = tuple(names)
+        if names not in self.fused and not self.mute:
+            self.fused[names] = _f('_FUSED_{}', len(self.fused))
+        return self.fused.get(names, '_FUSED_')
+
+    def runtime_var(self, var, attr):
+        # a runtime method, bound once per call like filters
+        if var not in self.helpers and not self.mute:
+            self.helpers[var] = attr
+        return var
+
+    def escaped(self, e):
+        # in the autoescape mode, printed values are escaped unless they are safe markup
+        if self.cc.option('autoescape'):
+            return _f('{}({})', self.runtime_var('_ESC', 'escape'), e)
+        return e
+
+    def popbuf(self):
+        # in the autoescape mode, captured output is safe markup
+        if self.cc.option('autoescape'):
+            return _f('{}(_POPBUF())', self.runtime_var('_MARKUP', 'markup'))
+        return '_POPBUF()'
+
+    def new_site(self):
+        self.num_sites += 1
+        return self.num_sites - 1
 
     python_indent = 4
 
+    # lines prefixed with 'iter_mark' are comments in the normal function
+    # and become code in the streaming (generator) variant, see 'compile_iter'
+
+    iter_mark = '##ITER '
+    iter_flush = 'if len(_ST.buf[-1]) >= 32: yield _POPBUF(); _PUSHBUF()'
+
     def python(self):
         self._flushbuf()
 
         rs = []
 
+        # python line numbers of the template code are mapped to template positions,
+        # the table is emitted with the code and used to locate errors, see '_POS'
+
         pos = {
             'path': None,
             'line': None,
+            'mapped': False,
         }
 
         paths = []
+        self.lines = {}
 
         def indent(lev):
             return ' ' * (self.python_indent * lev)
 
         def w(lev, s):
-            if '__POS__' in s:
-                s = s.replace('__POS__', _f('({},{})', paths.index(pos['path']), pos['line']))
             rs.append(indent(lev) + s)
+            if pos['mapped']:
+                self.lines[len(rs)] = (paths.index(pos['path']), pos['line'])
 
         def wcode(lev, code):
             for s in _dedent(code.splitlines()):
                 w(lev, s)
 
-        def linemark(path, line):
-            if path != pos['path'] or line != pos['line']:
-                if path not in paths:
-                    paths.append(path)
-                pos['path'] = path
-                pos['line'] = line
-                w(0, _f('## {}:{}', pos['path'], pos['line']))
+        def setpos(path, line):
+            if path not in paths:
+                paths.append(path)
+            pos['path'] = path
+            pos['line'] = line
+
+        fast = self.cc.option('fast')
+        name = self.cc.option('name')
+
+        # the template function is split in two: the setup function binds the runtime and the error handler
+        # and defines helpers, the body function renders a context, see 'compile_setup'
+        #
+        # def _RENDER(_RT, _, _ERROR=None, _OUT=None):
+        #     return _RENDER_SETUP(_RT, _ERROR)(_, _OUT)
+        #
+        # def _RENDER_SETUP(_RT, _ERROR=None):
+        #     ...helpers...
+        #     def _RENDER_BODY(_CONTEXT, _OUT=None):
+        #         ...
+        #     return _RENDER_BODY
+
+        if self.cc.option('async_mode'):
+            w(0, _f('async def {}(_RT, _, _ERROR=None, _OUT=None):', name))
+            w(1, _f('return await {}_SETUP(_RT, _ERROR)(_, _OUT)', name))
+            df = 'async def'
+        else:
+            w(0, _f('def {}(_RT, _, _ERROR=None, _OUT=None):', name))
+            w(1, _f('return {}_SETUP(_RT, _ERROR)(_, _OUT)', name))
+            df = 'def'
+
+        w(0, '')
+        w(0, _f('def {}_SETUP(_RT, _ERROR=None):', name))
 
-        w(0, _f('def {}(_RT, _, _ERROR=None):', self.cc.option('name')))
+        # runtime methods called at compile time, see Expression.fold_runtime
+
+        if self.cc.folded:
+            w(1, _f('_RT.check_runtime({!r})', self.cc.folded))
 
         if not self.buf:
-            w(1, 'return ""')
+            w(1, _f('{} {}_BODY(_, _OUT=None):', df, name))
+            w(2, self.iter_mark + 'return')
+            w(2, 'return ""')
+            w(1, _f('return {}_BODY', name))
             return '\n'.join(rs)
 
-        linemark(self.buf[0][0], self.buf[0][1])
+        setpos(self.buf[0].path, self.buf[0].line)
 
         wcode(1, '''
-            _PATHS = __PATHS__
-            _PUSHBUF = _RT.pushbuf
-            _POPBUF = _RT.popbuf
-            _PRINT = _RT.prints
-            _HAS_EXC = [False]
-            print = _RT.printa 
-
-            def _ERR(exc, pos=None):
+            _ST = _RT.state()
+            _PUSHBUF = _ST.pushbuf
+            _POPBUF = _ST.popbuf
+            _PRINT = _ST.prints
+            print = _ST.printa 
+
+            def _ERR(exc):
                 if _ERROR:
+                    _ST.errors += 1
+                    pos = _POS(exc)
                     try:
                         _ERROR(exc, _PATHS[pos[0]] if pos else None, pos[1] if pos else None)
                     except:
-                        _HAS_EXC[0] = True
+                        _ST.error = True
                         raise
                 else:
-                    _HAS_EXC[0] = True
+                    _ST.error = True
                     raise exc
 
-            def _GET(obj, prop, pos):
-                try:
-                    return _RT.get(obj, prop)
-                except Exception as _EXC:
-                    _ERR(_EXC, pos)
-                    return _RT.undef
-            
-            def _GET_NOEXC(obj, prop, pos):
+            # dot access sites remember the type which was last resolved by an attribute
+            # or an item lookup and try that first, see BaseRuntime.get_cached
+
+            _ASITES, _ISITES = _RT.site_caches(_ATTR_SITES, _ITEM_SITES)
+
+            # lazy values are computed when they are accessed, see runtime.Lazy
+
+            _LAZY = _RT.lazy_class
+
+            def _GET_NOEXC(obj, prop, site):
                 try:
-                    return _RT.get(obj, prop)
+                    cls = type(obj)
+                    if cls is _ASITES[site]:
+                        val = getattr(obj, prop)
+                    elif cls is _ISITES[site]:
+                        try:
+                            val = obj[prop]
+                        except Exception:
+                            val = getattr(obj, prop)
+                    else:
+                        val = _RT.get_cached(obj, prop, _ASITES, _ISITES, site)
+                    return val.get() if type(val) is _LAZY else val
                 except Exception as _EXC:
                     return _RT.undef
-            
-            def _GET_VAR(prop, pos):
+
+            def _GET_VAR_NOEXC(prop):
                 try:
-                    return _[prop] if prop in _ else _GLOBALS[prop]
+                    val = _[prop] if prop in _ else _GLOBALS[prop]
+                    return val.get() if type(val) is _LAZY else val
                 except Exception as _EXC:
-                    _ERR(_EXC, pos)
                     return _RT.undef
+        ''')
 
-            def _GET_VAR_NOEXC(prop, pos):
-                try:
-                    return _[prop] if prop in _ else _GLOBALS[prop]
+        # in the fast mode, errors are only caught by the outer handler
+
+        if fast:
+            wcode(1, '''
+                def _GET(obj, prop, site):
+                    cls = type(obj)
+                    if cls is _ASITES[site]:
+                        val = getattr(obj, prop)
+                    elif cls is _ISITES[site]:
+                        try:
+                            val = obj[prop]
+                        except Exception:
+                            val = getattr(obj, prop)
+                    else:
+                        val = _RT.get_cached(obj, prop, _ASITES, _ISITES, site)
+                    return val.get() if type(val) is _LAZY else val
+
+                def _GET_VAR(prop):
+                    val = _[prop] if prop in _ else _GLOBALS[prop]
+                    return val.get() if type(val) is _LAZY else val
+            ''')
+        else:
+            wcode(1, '''
+                def _GET(obj, prop, site):
+                    try:
+                        cls = type(obj)
+                        if cls is _ASITES[site]:
+                            val = getattr(obj, prop)
+                        elif cls is _ISITES[site]:
+                            try:
+                                val = obj[prop]
+                            except Exception:
+                                val = getattr(obj, prop)
+                        else:
+                            val = _RT.get_cached(obj, prop, _ASITES, _ISITES, site)
+                        return val.get() if type(val) is _LAZY else val
+                    except Exception as _EXC:
+                        _ERR(_EXC)
+                        return _RT.undef
+
+                def _GET_VAR(prop):
+                    try:
+                        val = _[prop] if prop in _ else _GLOBALS[prop]
+                        return val.get() if type(val) is _LAZY else val
+                    except Exception as _EXC:
+                        _ERR(_EXC)
+                        return _RT.undef
+            ''')
+
+        if self.cc.option('async_mode'):
+            # NB: an awaitable can only be awaited once, so results are kept per render
+            wcode(1, '''
+                _AWAITED = {}
+
+                async def _AWAIT(val):
+                    if not hasattr(type(val), '__await__'):
+                        return val
+                    key = id(val)
+                    if key not in _AWAITED:
+                        _AWAITED[key] = val, await val
+                    return _AWAITED[key][1]
+            ''')
+
+        # runtime filters are looked up once per setup
+
+        # in the autoescape mode, they escape the input of markup filters
+
+        esc = ', True' if self.cc.option('autoescape') else ''
+        for fname, var in sorted(self.filters.items()):
+            w(1, _f('{} = _RT.filter({!r}{})', var, fname, esc))
+        for names, var in self.fused.items():
+            w(1, _f('{} = _RT.fused({!r}{})', var, names, esc))
+        for var, attr in sorted(self.helpers.items()):
+            w(1, _f('{} = _RT.{}', var, attr))
+
+        # the context and globals are set by the body, helpers refer to them
+
+        w(1, '_ = _GLOBALS = None')
+        w(1, '_UNSET = object()')
+
+        w(1, _f('{} {}_BODY(_CONTEXT, _OUT=None):', df, name))
+        w(2, 'nonlocal _, _GLOBALS')
+        w(2, 'try:')
+        pos['mapped'] = True
+
+        w(3, _f('_, _GLOBALS = _RT.prepare(_CONTEXT, {})', sorted(self.context_vars)))
+
+        # with 'fast_locals', context variables are bound to locals once per call
+        # and '_GET_VAR' is only used for missing ones, see Expression.make_context_getter.
+        # If the context is dynamic (raw code can change it), the locals are left unset
+        #
+        # NB: lazy values are not bound to locals, they are computed on the first access via _GET_VAR
+
+        for v in sorted(self.local_vars):
+            if self.dynamic_context:
+                w(3, _f('_CV_{} = _UNSET', v))
+            else:
+                w(3, _f('_CV_{} = _[{!r}] if {!r} in _ else _GLOBALS.get({!r}, _UNSET)', v, v, v, v))
+                w(3, _f('if type(_CV_{}) is _LAZY: _CV_{} = _UNSET', v, v))
+
+        w(3, '_PUSHBUF(_OUT)')
+
+        # for the streaming variant, track the output depth (captured buffers and def bodies)
+
+        captures = [0]
+
+        def emit(nodes, level, in_def):
+            for node in nodes:
+                setpos(node.path, node.line)
+                w(level, node.op)
+                captures[0] += node.op.count('_PUSHBUF()') - node.op.count('_POPBUF()')
+                if node.kind == 'try':
+                    self.num_try += 1
+                if node.op.startswith('_PRINT(') and not in_def and not captures[0]:
+                    w(level, self.iter_mark + self.iter_flush)
+                if node.body is not None:
+                    is_def = node.op.startswith(('def ', 'async def '))
+                    emit(node.body or [Node(node.path, node.line, 'pass')], level + 1, in_def or is_def)
+
+        emit(Optimizer(self.cc).run(self.tree()), 3, False)
+
+        w(3, self.iter_mark + 'yield _POPBUF(); return')
+        w(3, 'return _POPBUF()')
+
+        pos['mapped'] = False
+
+        if fast:
+            # NB: the render stops at the first error, the partial output is returned
+            wcode(2, '''
                 except Exception as _EXC:
-                    return _RT.undef
+                    _ERR(_EXC)
+                    return _ST.unwind()
+            ''')
+        else:
+            wcode(2, '''
+                except Exception as _EXC:
+                    if _ST.error:
+                        raise
+                    else:
+                        _ERR(_EXC)
+            ''')
+
+        w(1, _f('return {}_BODY', name))
+
+        w(0, _f('_ATTR_SITES = [None] * {}', self.num_sites))
+        w(0, _f('_ITEM_SITES = [None] * {}', self.num_sites))
+
+        w(0, _f('_PATHS = {!r}', paths))
+        w(0, _f('_LINES = {!r}', self.lines))
+        w(0, '_MODULE = globals()')
+
+        # the template position of an error is the innermost template line in the traceback,
+        # or, if the exception was caught in a helper, the template line which called it
+
+        wcode(0, '''
+            def _POS(exc):
+                pos = None
+                tb = exc.__traceback__
+                frame = tb.tb_frame if tb else None
+                while tb:
+                    if tb.tb_frame.f_globals is _MODULE:
+                        pos = _LINES.get(tb.tb_lineno, pos)
+                    tb = tb.tb_next
+                while frame and not pos:
+                    if frame.f_globals is _MODULE:
+                        pos = _LINES.get(frame.f_lineno)
+                    frame = frame.f_back
+                return pos
         ''')
 
-        w(1, 'try:')
+        self.lines = {n: (paths[p], ln) for n, (p, ln) in self.lines.items()}
 
-        w(2, _f('_, _GLOBALS = _RT.prepare(_, {})', sorted(self.context_vars)))
-        w(2, '_PUSHBUF()')
+        return '\n'.join(rs)
 
-        level = 2
 
-        for path, line, op in self.buf:
-            linemark(path, line)
-            if op == 'BEGIN':
-                level += 1
-            elif op == 'END':
-                level -= 1
-            elif op:
-                w(level, op)
+class Node:
+    """An entry of the intermediate code: a python statement, its template position and an optional body.
 
-        w(2, 'return _POPBUF()')
+    The `kind` and `meta` describe what the statement does to the optimizer,
+    statements without a `kind` (e.g. from custom commands) are left alone.
+    """
 
-        wcode(1, '''
-            except Exception as _EXC:
-                if _HAS_EXC[0]:
-                    raise
+    def __init__(self, path, line, op, kind=None, meta=None):
+        self.path = path
+        self.line = line
+        self.op = op
+        self.kind = kind
+        self.meta = meta or {}
+        self.body = None
+
+    def __repr__(self):
+        return _f('Node({!r}, {!r}, {})', self.op, self.kind, self.body)
+
+
+class Optimizer:
+    """Optimization passes on the intermediate code tree.
+
+    The `optimize` option is either `True` (all passes), `False` (none)
+    or a list of pass names.
+    """
+
+    passes = ['native_if', 'remove_empty', 'merge_try', 'merge_text']
+
+    # applied when expressions are translated, see Expression.make_filter
+
+    expression_passes = ['fuse_filters']
+
+    def __init__(self, compiler):
+        self.cc = compiler
+
+    def enabled(self, name):
+        opt = self.cc.option('optimize')
+        return opt is True or (bool(opt) and name in _as_list(opt))
+
+    def run(self, nodes):
+        opt = self.cc.option('optimize')
+        if not opt:
+            return nodes
+        names = self.passes if opt is True else _as_list(opt)
+        for name in names:
+            if name in self.expression_passes:
+                continue
+            fn = getattr(self, 'pass_' + name, None)
+            if not fn:
+                self.cc.error(ERROR_OPTION, 'optimize', name)
+            nodes = self.walk(nodes, fn)
+        return nodes
+
+    def walk(self, nodes, fn):
+        # apply a pass bottom-up to every block
+        for node in nodes:
+            if node.body:
+                node.body = self.walk(node.body, fn)
+        return fn(nodes)
+
+    def pass_native_if(self, nodes):
+        # replace the 'for..once' construct of '@if' (see Command.command_if)
+        # with a native if/elif/else chain, when no condition needs its own try block
+
+        if self.cc.code.dynamic_context:
+            # NB: a 'break' in raw code would exit the loop
+            return nodes
+
+        out = []
+
+        for node in nodes:
+            if node.kind != 'if_chain':
+                out.append(node)
+                continue
+
+            branches = [n for n in node.body if n.kind in ('if_branch', 'if_else')]
+            if not all(n.kind == 'if_else' or n.meta.get('safe') for n in branches):
+                out.append(node)
+                continue
+
+            for n, br in enumerate(branches):
+                if br.kind == 'if_else':
+                    op, kind = 'else:', 'else'
                 else:
-                    _ERR(_EXC, __POS__)
-        ''')
+                    op, kind = _f('{} {}:', 'elif' if n else 'if', br.meta['head']), 'if'
+                new = Node(br.path, br.line, op, kind)
+                new.body = [b for b in br.body if b.kind != 'break']
+                out.append(new)
+
+        return out
+
+    def pass_remove_empty(self, nodes):
+        # remove 'else' branches which do nothing
 
-        rs = '\n'.join(rs)
-        rs = rs.replace('__PATHS__', repr(paths))  # see above
+        out = []
+
+        for node in nodes:
+            if node.kind in ('else', 'if_else') and all(b.kind == 'break' for b in node.body):
+                continue
+            out.append(node)
+
+        return out
+
+    def pass_merge_try(self, nodes):
+        # merge consecutive try blocks with identical fallbacks (and text between them)
+        # when all bodies except the last one never raise
+
+        out = []
+        i = 0
+
+        while i < len(nodes):
+            if not _is_try(nodes, i):
+                out.append(nodes[i])
+                i += 1
+                continue
+
+            head, exc = nodes[i], nodes[i + 1]
+            i += 2
+
+            while head.meta.get('safe'):
+                k = i
+                while k < len(nodes) and nodes[k].kind == 'text':
+                    k += 1
+                if not _is_try(nodes, k) or nodes[k + 1].meta['fallback'] != exc.meta['fallback']:
+                    break
+                merged = Node(head.path, head.line, head.op, 'try', dict(nodes[k].meta))
+                merged.body = head.body + nodes[i:k] + nodes[k].body
+                head, exc = merged, nodes[k + 1]
+                i = k + 2
 
-        return rs
+            out.append(head)
+            out.append(exc)
+
+        return out
+
+    def pass_merge_text(self, nodes):
+        # merge adjacent text outputs
+
+        out = []
+
+        for node in nodes:
+            if node.kind == 'text' and out and out[-1].kind == 'text':
+                prev = out[-1]
+                s = prev.meta['text'] + node.meta['text']
+                out[-1] = Node(prev.path, prev.line, _f('_PRINT({})', repr(s)), 'text', {'text': s})
+                continue
+            out.append(node)
+
+        return out
+
+
+class Stats:
+    """Compile statistics, see the 'stats' option.
+
+    Phase times are in seconds. The 'expression' time is a part of the 'parse' time.
+    """
+
+    phases = ['parse', 'expression', 'python', 'compile', 'exec']
+
+    def __init__(self):
+        self.times = dict.fromkeys(self.phases, 0.0)
+        self.total = 0.0
+        self.cached = False
+        self.template_lines = 0
+        self.python_lines = 0
+        self.try_blocks = 0
+        self.context_vars = 0
+        self.defs = 0
+        self.pure_defs = 0
+        self.includes = 0
+        self.depth = dict.fromkeys(self.phases, 0)
+
+    def timed(self, phase, fn):
+        # wrap a function to add its run time to a phase, nested (e.g. recursive) calls are counted once
+
+        def wrapper(*args, **kwargs):
+            if self.depth[phase]:
+                return fn(*args, **kwargs)
+            self.depth[phase] += 1
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.times[phase] += time.perf_counter() - t
+                self.depth[phase] -= 1
+
+        return wrapper
+
+    def cached_hit(self, python, includes):
+        self.cached = True
+        self.python_lines = python.count('\n') + 1
+        self.includes = len(includes)
+
+    def done(self, start):
+        self.total = time.perf_counter() - start
+        return self
+
+    def as_dict(self):
+        d = {k + '_ms': v * 1000 for k, v in self.times.items()}
+        d['total_ms'] = self.total * 1000
+        for k in 'cached', 'template_lines', 'python_lines', 'try_blocks', 'context_vars', 'defs', 'pure_defs', 'includes':
+            d[k] = getattr(self, k)
+        return d
+
+    def __repr__(self):
+        return _f('<Stats {}>', self.as_dict())
 
 
 class Compiler:
@@ -1084,6 +2176,7 @@ class Compiler:
         self.options = _merge(_DEFAULT_OPTIONS, options)
         if options:
             self.options['syntax'] = _merge(_DEFAULT_OPTIONS['syntax'], options.get('syntax'))
+        self.stats = Stats() if self.options.get('stats') else None
 
     def run(self, text):
         self.parser = Parser(self)
@@ -1091,10 +2184,19 @@ class Compiler:
         self.code = Code(self)
         self.command = Command(self)
 
+        if self.stats:
+            self.instrument()
+
         self.globals = set(self.option('globals', []))
 
         self.scope = {'_RT', '_', '_ERROR'}
+        # locals which are always assigned at this point, e.g. loop variables
+        self.bound = set()
         self.user_commands = {}
+        self.pure_defs = []
+        self.includes = []
+        # runtime methods called at compile time, see Expression.fold_runtime
+        self.folded = {}
         self.frames = []
 
         self.noexc_block = 0
@@ -1104,7 +2206,28 @@ class Compiler:
         self.parser.add_source(text, self.option('path'))
         self.parser.parse_until('eof')
 
-        return self.code.python()
+        python = self.code.python()
+
+        if self.stats:
+            self.stats.python_lines = python.count('\n') + 1
+            self.stats.try_blocks = self.code.num_try
+            self.stats.context_vars = len(self.code.context_vars)
+            self.stats.defs = len(self.user_commands)
+            self.stats.pure_defs = len(self.pure_defs)
+            self.stats.includes = len(self.includes)
+
+        return python
+
+    def timed(self, phase, fn):
+        return self.stats.timed(phase, fn) if self.stats else fn
+
+    def instrument(self):
+        # time compiler phases, the wrappers are only installed with the 'stats' option
+
+        self.parser.parse_until = self.timed('parse', self.parser.parse_until)
+        for name in 'parse', 'parse_ast', 'parse_args', 'parse_args_ast':
+            setattr(self.expression, name, self.timed('expression', getattr(self.expression, name)))
+        self.code.python = self.timed('python', self.code.python)
 
     def error(self, msg, *args):
         _error(msg, self.parser.current_source.path, self.parser.current_source.lineno, *args)
@@ -1137,19 +2260,94 @@ def _error(msg, path, line, *args):
     raise Error(code, msg, path, line) from None
 
 
-def _source_location(code, lineno):
-    path = 0
-    line = 0
+def _source_location(lines, lineno):
+    # the template position of a python line, or of the nearest mapped line before it
+    mapped = [n for n in lines if n <= lineno]
+    if not mapped:
+        return None, None
+    return lines[max(mapped)]
 
-    for n, ln in enumerate(code.splitlines(), 1):
-        if n >= lineno:
-            break
-        m = re.search(r'## (.*?):(\d+)', ln)
-        if m:
-            path = m.group(1)
-            line = int(m.group(2))
 
-    return path, line
+class _NotConstant(Exception):
+    pass
+
+
+_NOCONST = object()
+
+
+def _is_literal(v, size=None):
+    # can a value be inlined as a python literal?
+
+    size = size or [0]
+
+    if v is None or type(v) in (bool, int, float, str):
+        if type(v) is float and (v != v or v in (float('inf'), float('-inf'))):
+            return False
+        size[0] += len(repr(v))
+    elif type(v) in (list, tuple):
+        if not all(_is_literal(x, size) for x in v):
+            return False
+    elif type(v) is dict:
+        if not all(_is_literal(k, size) and _is_literal(x, size) for k, x in v.items()):
+            return False
+    else:
+        return False
+
+    return size[0] <= _FOLD_MAX_SIZE
+
+
+def _check_fold_size(op, a, b):
+    # do not fold expressions which are expensive or produce huge values, like 'x' * 10**9
+    if op == 'Pow' and isinstance(b, (int, float)) and abs(b) > 128:
+        raise _NotConstant()
+    if op == 'Mult':
+        for x, y in ((a, b), (b, a)):
+            if isinstance(x, (str, list, tuple)) and isinstance(y, int) and len(x) * y > _FOLD_MAX_SIZE:
+                raise _NotConstant()
+
+
+def _is_try(nodes, i):
+    return i + 1 < len(nodes) and nodes[i].kind == 'try' and nodes[i + 1].kind == 'except'
+
+
+def _options_fingerprint(options):
+    # NB: callables and plugin objects are identified by their qualified names.
+    # A method is also identified by its object, which must provide 'cache_fingerprint()'
+    # (e.g. Environment.find_include). Local functions and methods of other objects
+    # can behave differently under the same name, with them, None is returned
+
+    class _Unknown(Exception):
+        pass
+
+    def fp(v):
+        if v is None or isinstance(v, (str, int, float, bool)):
+            return repr(v)
+        if isinstance(v, dict):
+            return '{' + _comma(_f('{}: {}', repr(k), fp(x)) for k, x in sorted(v.items())) + '}'
+        if isinstance(v, (list, tuple, set)):
+            return '[' + _comma(fp(x) for x in v) + ']'
+        if not hasattr(v, '__qualname__'):
+            v = type(v)
+        if '<' in v.__qualname__:
+            raise _Unknown()
+        name = _f('<{}.{}>', getattr(v, '__module__', ''), v.__qualname__)
+        obj = getattr(v, '__self__', None)
+        if obj is None or inspect.ismodule(obj) or inspect.isclass(obj):
+            return name
+        if not hasattr(obj, 'cache_fingerprint'):
+            raise _Unknown()
+        return name + fp(obj.cache_fingerprint())
+
+    try:
+        return fp({k: v for k, v in options.items() if k not in ('cache_dir', 'stats')})
+    except _Unknown:
+        return None
+
+
+def _cacheable(options):
+    # a static context with objects cannot be fingerprinted reliably
+    static = options.get('static_context')
+    return not static or _is_literal(static)
 
 
 def _findany(pattern, subject, flags=0):
@@ -1218,5 +2416,9 @@ def _cname(o):
     return o.__class__.__name__
 
 
+def _qualname(fn):
+    return _f('{}.{}', getattr(fn, '__module__', ''), getattr(fn, '__qualname__', ''))
+
+
 def _f(fmt, *args):
     return fmt.format(*args)
@@ -0,0 +1,107 @@
+"""Template environment"""
+
+import os
+import threading
+import time
+
+from . import cache, compiler, renderer
+
+
+class _Entry:
+    def __init__(self, template, paths, checked):
+        self.template = template
+        self.paths = paths
+        self.stats = _stats(paths)
+        self.checked = checked
+
+
+class Environment:
+    """Template loader with search paths, a shared template registry and auto-reload.
+
+    Templates are looked up by name in the search paths (or by the `finder`)
+    and compiled once. With `auto_reload`, a template and all of its includes
+    are checked for modifications at most every `check_interval` seconds.
+    """
+
+    def __init__(
+            self,
+            paths=None,
+            finder=None,
+            runtime=None,
+            auto_reload=True,
+            check_interval=2,
+            **options
+    ):
+        self.paths = [os.path.abspath(p) for p in (paths or [])]
+        self.finder = finder
+        self.runtime = runtime
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.options = options
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def find(self, name, cur_path=None):
+        if self.finder:
+            return self.finder(cur_path, name)
+
+        if os.path.isabs(name):
+            return name if os.path.isfile(name) else None
+
+        if cur_path:
+            path = os.path.abspath(os.path.join(os.path.dirname(cur_path), name))
+            if os.path.isfile(path):
+                return path
+
+        for d in self.paths:
+            path = os.path.join(d, name)
+            if os.path.isfile(path):
+                return path
+
+    def find_include(self, cur_path, path):
+        # NB: fall back to the relative path, so that the compiler reports a missing include
+        return self.find(path, cur_path) or compiler._relpath(cur_path, path)
+
+    def cache_fingerprint(self):
+        # identifies 'find_include' in the 'cache_dir' key, see compiler._options_fingerprint
+        return [self.paths, self.finder]
+
+    def get_template(self, name):
+        now = time.monotonic()
+        entry = self.templates.get(name)
+
+        if entry:
+            if not self.auto_reload or now - entry.checked < self.check_interval:
+                return entry.template
+            if _stats(entry.paths) == entry.stats:
+                entry.checked = now
+                return entry.template
+
+        path = self.find(name)
+        if not path:
+            compiler._error(compiler.ERROR_FILE, name, None)
+
+        template = compiler.compile_path(path, finder=self.find_include, runtime=self.runtime, **self.options)
+
+        entry = _Entry(template, [path] + template.includes, now)
+        with self.lock:
+            self.templates[name] = entry
+
+        return template
+
+    def render(self, name, context=None, error=None, profile=None):
+        return renderer.call(
+            self.get_template(name),
+            context=context,
+            runtime=self.runtime,
+            error=error,
+            profile=profile,
+        )
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+
+def _stats(paths):
+    return [cache._stat(p) for p in paths]
@@ -0,0 +1,176 @@
+"""Template profiler"""
+
+import json
+import linecache
+import re
+import sys
+import time
+
+
+class Profiler:
+    """Per-template-line and per-def render profiler.
+
+    While a profiled render runs, the profiler traces the frames of compiled
+    templates and maps python lines back to template lines with the line table
+    of the template. For each template line, it records how many times the line
+    was entered ("hits") and the wall time spent on it, without ("time") and
+    with ("total") nested template calls, like calls of `@def` functions.
+    For each `@def`, it records the number of calls and the total time.
+
+    A profiler can be used with several renders, results are accumulated.
+    It has no effect on templates rendered without it, since the tracing is
+    only active during a profiled render.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lines = {}
+        self.defs = {}
+        self.time = 0
+        self.saved_trace = []
+        self.stack = []
+        self.codes = {}
+
+    def __enter__(self):
+        self.saved_trace.append((sys.gettrace(), time.perf_counter()))
+        sys.settrace(self._trace)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        trace, t = self.saved_trace.pop()
+        sys.settrace(trace)
+        self.time += time.perf_counter() - t
+
+    def line_stats(self):
+        """Template lines, sorted by time, the slowest first."""
+
+        return sorted(
+            [
+                {'path': path, 'line': line, 'hits': rec[0], 'time_ms': rec[1] * 1000, 'total_ms': rec[2] * 1000}
+                for (path, line), rec in self.lines.items()
+            ],
+            key=lambda r: (-r['time_ms'], r['path'], r['line'])
+        )
+
+    def def_stats(self):
+        """Template functions, sorted by time, the slowest first."""
+
+        return sorted(
+            [
+                {'name': name, 'path': path, 'line': line, 'calls': rec[0], 'time_ms': rec[1] * 1000}
+                for (name, path, line), rec in self.defs.items()
+            ],
+            key=lambda r: (-r['time_ms'], r['name'])
+        )
+
+    def as_dict(self):
+        return {
+            'time_ms': self.time * 1000,
+            'lines': self.line_stats(),
+            'defs': self.def_stats(),
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def report(self, limit=20):
+        """A text report of the `limit` slowest lines and defs."""
+
+        total = self.time * 1000 or 1
+        out = ['total {:.3f} ms'.format(self.time * 1000), '']
+
+        out.append('{:>10} {:>10} {:>6} {:>8}  {}'.format('ms', 'total ms', '%', 'hits', 'line'))
+        for r in self.line_stats()[:limit]:
+            loc = '{}:{}'.format(r['path'] or '<string>', r['line'])
+            src = linecache.getline(r['path'], r['line']).strip() if r['path'] else ''
+            out.append('{:10.3f} {:10.3f} {:6.1f} {:8}  {:24} {}'.format(
+                r['time_ms'], r['total_ms'], r['time_ms'] / total * 100, r['hits'], loc, src).rstrip())
+
+        defs = self.def_stats()[:limit]
+        if defs:
+            out.append('')
+            out.append('{:>10} {:>10} {:>6} {:>8}  {}'.format('', 'total ms', '%', 'calls', 'def'))
+            for r in defs:
+                loc = '{}:{}'.format(r['path'] or '<string>', r['line'])
+                out.append('{:10} {:10.3f} {:6.1f} {:8}  {:24} {}'.format(
+                    '', r['time_ms'], r['time_ms'] / total * 100, r['calls'], loc, r['name']))
+
+        return '\n'.join(out)
+
+    # generated helpers and internal functions (like def bodies) are named '_XYZ' or '_123'
+
+    internal_name_re = r'^_(\d+|[A-Z_]+)$'
+
+    def _trace(self, frame, event, arg):
+        # global trace function: only frames of compiled templates are traced
+        #
+        # a line record is [hits, self time, total time], the self time of a line
+        # excludes nested template frames (e.g. calls of @def functions), the total time includes them
+
+        g = frame.f_globals
+        table = g.get('_LINES')
+        if table is None or g.get('_MODULE') is not g:
+            return None
+
+        start = time.perf_counter()
+
+        paths = g['_PATHS']
+        lines = self.lines
+        stack = self.stack
+        code = frame.f_code
+
+        if code not in self.codes:
+            self.codes[code] = None
+            if code.co_firstlineno in table and not re.match(self.internal_name_re, code.co_name):
+                p, ln = table[code.co_firstlineno]
+                self.codes[code] = self.defs.setdefault((code.co_name, paths[p], ln), [0, 0.0])
+
+        fdef = self.codes[code]
+        if fdef:
+            fdef[0] += 1
+
+        if stack:
+            parent = stack[-1]
+            if parent[0]:
+                parent[0][1] += start - parent[1]
+                parent[0][2] += start - parent[1]
+
+        # the state of this frame: [current line record, time of the last event]
+        state = [None, start]
+        stack.append(state)
+
+        def local(frame, event, arg):
+            t = time.perf_counter()
+            cur = state[0]
+            if cur:
+                cur[1] += t - state[1]
+                cur[2] += t - state[1]
+
+            if event == 'line':
+                pos = table.get(frame.f_lineno)
+                if pos:
+                    key = paths[pos[0]], pos[1]
+                    rec = lines.get(key) or lines.setdefault(key, [0, 0.0, 0.0])
+                    if rec is not cur:
+                        rec[0] += 1
+                        state[0] = rec
+
+            elif event == 'return':
+                if fdef:
+                    fdef[1] += t - start
+                if stack and stack[-1] is state:
+                    stack.pop()
+                if stack:
+                    parent = stack[-1]
+                    if parent[0]:
+                        parent[0][2] += t - start
+                    parent[1] = time.perf_counter()
+                return local
+
+            # NB: the time spent in the tracer itself is not counted
+            state[1] = time.perf_counter()
+            return local
+
+        return local
@@ -1,50 +1,274 @@
-from . import compiler, runtime as rt
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+
+from . import cache as cache_, compiler, runtime as rt
 
 
 
 _DefaultRuntime = rt.Runtime()
 
+template_cache = cache_.LRUCache(maxsize=256)
+
+
 def call(
         template,
         context=None,
         runtime=None,
         error=None,
+        profile=None,
 ):
+    if profile:
+        with profile:
+            return template(runtime or _DefaultRuntime, context, error)
     return template(runtime or _DefaultRuntime, context, error)
 
 
+def call_iter(
+        template,
+        context=None,
+        runtime=None,
+        error=None,
+        chunk_size=8192,
+        profile=None,
+):
+    fn = compiler.compile_iter(template)
+    gen = fn(runtime or _DefaultRuntime, context, error)
+    if profile:
+        gen = _profiled(gen, profile)
+    return _chunks(gen, chunk_size)
+
+
+def call_many(
+        template,
+        contexts,
+        runtime=None,
+        error=None,
+):
+    body = compiler.compile_setup(template)(runtime or _DefaultRuntime, error)
+    return (body(context) for context in contexts)
+
+
+def call_parallel(
+        template,
+        contexts,
+        runtime=None,
+        error=None,
+        workers=None,
+        chunk_size=256,
+        ordered=True,
+):
+    # NB: template functions cannot be pickled, workers compile the template source once
+    compiler.compile_setup(template)
+    return _parallel(
+        (template.source, template.__name__, runtime or _DefaultRuntime, error),
+        contexts,
+        workers or os.cpu_count() or 1,
+        max(chunk_size, 1),
+        ordered,
+    )
+
+
+def call_to(
+        template,
+        fp,
+        context=None,
+        runtime=None,
+        error=None,
+        flush_size=8192,
+        encoding=None,
+        profile=None,
+):
+    if not encoding and _is_binary(fp):
+        encoding = 'utf8'
+    out = rt.Writer(fp, flush_size, encoding)
+    if profile:
+        with profile:
+            res = template(runtime or _DefaultRuntime, context, error, out)
+    else:
+        res = template(runtime or _DefaultRuntime, context, error, out)
+    if res is not None and res != '':
+        # NB: a top-level @return
+        out.write(str(res))
+
+
 def render(
         text,
 
         context=None,
         error=None,
         runtime=None,
+        profile=None,
 
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
         commands=None,
+        fast=None,
         filter=None,
         finder=None,
         globals=None,
         name=None,
+        optimize=None,
         path=None,
+        static_context=None,
         strip=None,
         syntax=None,
 ):
-    template = compiler.compile(
+    options = _compile_options(locals())
+    template = _compile_text(text, cache, options)
+    return call(
+        template,
+        context=context,
+        runtime=runtime,
+        error=error,
+        profile=profile,
+    )
+
+
+async def render_async(
         text,
-        commands=commands,
-        filter=filter,
-        finder=finder,
-        globals=globals,
-        name=name,
-        path=path,
-        strip=strip,
-        syntax=syntax,
+
+        context=None,
+        error=None,
+        runtime=None,
+        profile=None,
+
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
+        commands=None,
+        fast=None,
+        filter=None,
+        finder=None,
+        globals=None,
+        name=None,
+        optimize=None,
+        path=None,
+        static_context=None,
+        strip=None,
+        syntax=None,
+):
+    options = _compile_options(locals(), async_mode=True)
+    template = _compile_text(text, cache, options)
+    coro = call(
+        template,
+        context=context,
+        runtime=runtime,
+        error=error,
     )
-    return call(
+    if profile:
+        # NB: other tasks running meanwhile are traced as well
+        with profile:
+            return await coro
+    return await coro
+
+
+def render_iter(
+        text,
+
+        context=None,
+        error=None,
+        runtime=None,
+        profile=None,
+        chunk_size=8192,
+
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
+        commands=None,
+        fast=None,
+        filter=None,
+        finder=None,
+        globals=None,
+        name=None,
+        optimize=None,
+        path=None,
+        static_context=None,
+        strip=None,
+        syntax=None,
+):
+    options = _compile_options(locals())
+    template = _compile_text(text, cache, options)
+    return call_iter(
         template,
         context=context,
         runtime=runtime,
         error=error,
+        profile=profile,
+        chunk_size=chunk_size,
+    )
+
+
+def render_many(
+        text,
+        contexts,
+
+        error=None,
+        runtime=None,
+
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
+        commands=None,
+        fast=None,
+        filter=None,
+        finder=None,
+        globals=None,
+        name=None,
+        optimize=None,
+        path=None,
+        static_context=None,
+        strip=None,
+        syntax=None,
+):
+    options = _compile_options(locals())
+    template = _compile_text(text, cache, options)
+    return call_many(
+        template,
+        contexts,
+        runtime=runtime,
+        error=error,
+    )
+
+
+def render_parallel(
+        text,
+        contexts,
+
+        error=None,
+        runtime=None,
+        workers=None,
+        chunk_size=256,
+        ordered=True,
+
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
+        commands=None,
+        fast=None,
+        filter=None,
+        finder=None,
+        globals=None,
+        name=None,
+        optimize=None,
+        path=None,
+        static_context=None,
+        strip=None,
+        syntax=None,
+):
+    options = _compile_options(locals())
+    template = _compile_text(text, cache, options)
+    return call_parallel(
+        template,
+        contexts,
+        runtime=runtime,
+        error=error,
+        workers=workers,
+        chunk_size=chunk_size,
+        ordered=ordered,
     )
 
 
@@ -54,28 +278,245 @@ def render_path(
         context=None,
         error=None,
         runtime=None,
+        profile=None,
 
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
         commands=None,
+        fast=None,
         filter=None,
         finder=None,
         globals=None,
         name=None,
+        optimize=None,
+        static_context=None,
         strip=None,
         syntax=None,
 ):
-    template = compiler.compile_path(
-        path,
-        commands=commands,
-        filter=filter,
-        finder=finder,
-        globals=globals,
-        name=name,
-        strip=strip,
-        syntax=syntax,
+    options = _compile_options(locals())
+    template = _cached(
+        cache,
+        ('path', path, _mtime(path), _key_options(options)),
+        lambda: compiler.compile_path(**options)
     )
     return call(
         template,
         context=context,
         runtime=runtime,
         error=error,
+        profile=profile,
+    )
+
+
+def render_to(
+        text,
+        fp,
+
+        context=None,
+        error=None,
+        runtime=None,
+        profile=None,
+        flush_size=8192,
+        encoding=None,
+
+        autoescape=None,
+        cache=None,
+        cache_dir=None,
+        commands=None,
+        fast=None,
+        filter=None,
+        finder=None,
+        globals=None,
+        name=None,
+        optimize=None,
+        path=None,
+        static_context=None,
+        strip=None,
+        syntax=None,
+):
+    options = _compile_options(locals())
+    template = _compile_text(text, cache, options)
+    return call_to(
+        template,
+        fp,
+        context=context,
+        runtime=runtime,
+        error=error,
+        profile=profile,
+        flush_size=flush_size,
+        encoding=encoding,
     )
+
+
+##
+
+def _compile_text(text, cache, options):
+    return _cached(
+        cache,
+        ('text', text, _key_options(options)),
+        lambda: compiler.compile(text, **options)
+    )
+
+
+# compile options of the render functions
+
+_RENDER_OPTIONS = (
+    'autoescape',
+    'cache_dir',
+    'commands',
+    'fast',
+    'filter',
+    'finder',
+    'globals',
+    'name',
+    'optimize',
+    'path',
+    'static_context',
+    'strip',
+    'syntax',
+)
+
+
+def _compile_options(args, **extra):
+    # compile options from the arguments of a render function
+    # NB: templates are compiled with the runtime they are called with, see Expression.fold_runtime
+    options = {k: args[k] for k in _RENDER_OPTIONS if k in args}
+    options['runtime'] = args['runtime'] or _DefaultRuntime
+    options.update(extra)
+    return options
+
+
+def _key_options(options):
+    # NB: runtimes are keyed by their class, the compiler only relies on its methods,
+    # see BaseRuntime.check_runtime. The cache must not hold runtime instances either
+    return dict(options, runtime=type(options['runtime']))
+
+
+def _profiled(gen, profile):
+    # profile a generator step by step, since the caller runs between the steps
+
+    while True:
+        with profile:
+            try:
+                s = next(gen)
+            except StopIteration as exc:
+                return exc.value
+        yield s
+
+
+# the template body of a worker process, see '_parallel'
+
+_worker = {}
+
+
+def _worker_init(source, name, runtime, error):
+    template = compiler.compile_source(source, name)
+    _worker['body'] = compiler.compile_setup(template)(runtime, error)
+
+
+def _worker_render(chunk):
+    body = _worker['body']
+    return [body(context) for context in chunk]
+
+
+def _parallel(init_args, contexts, workers, chunk_size, ordered):
+    # render chunks of contexts in a process pool
+    #
+    # at most 'workers * 2' chunks are in flight, so that contexts are consumed
+    # and results are returned as the rendering goes on
+
+    contexts = iter(contexts)
+    pending = collections.deque()
+    offset = 0
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_worker_init, initargs=init_args) as ex:
+        try:
+            while True:
+                while len(pending) < workers * 2:
+                    chunk = list(itertools.islice(contexts, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append((offset, ex.submit(_worker_render, chunk)))
+                    offset += len(chunk)
+
+                if not pending:
+                    return
+
+                if ordered:
+                    _, fut = pending.popleft()
+                    yield from fut.result()
+                    continue
+
+                done, _ = concurrent.futures.wait([f for _, f in pending], return_when=concurrent.futures.FIRST_COMPLETED)
+                for item in [p for p in pending if p[1] in done]:
+                    pending.remove(item)
+                    start, fut = item
+                    for n, out in enumerate(fut.result()):
+                        yield start + n, out
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+
+
+def _chunks(gen, chunk_size):
+    # re-pack generated output into chunks of at least 'chunk_size' characters
+
+    buf = []
+    size = 0
+
+    while gen:
+        try:
+            s = next(gen)
+        except StopIteration as exc:
+            # NB: a top-level @return ends the stream with its value
+            s = exc.value
+            gen = None
+
+        if s is not None and s != '':
+            s = str(s)
+            buf.append(s)
+            size += len(s)
+
+        if buf and (size >= chunk_size or not gen):
+            yield ''.join(buf)
+            buf = []
+            size = 0
+
+
+def _cached(cache, key, fn):
+    # cache=None means the default cache, cache=False disables caching
+
+    if cache is False:
+        return fn()
+
+    cache = template_cache if cache is None else cache
+    key = cache_.make_key(*key)
+
+    # entries hold the stats of included files, like BytecodeCache,
+    # and are recompiled when any of them changed
+
+    hit = cache.get(key)
+    if hit is not None:
+        template, deps = hit
+        if all(cache_._stat(path) == st for path, st in deps):
+            return template
+
+    template = fn()
+    cache.put(key, (template, [(path, cache_._stat(path)) for path in template.includes]))
+    return template
+
+
+def _is_binary(fp):
+    if isinstance(fp, io.TextIOBase):
+        return False
+    if isinstance(fp, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    return 'b' in getattr(fp, 'mode', '')
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
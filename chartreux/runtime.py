@@ -1,11 +1,15 @@
 """Basic runtime"""
 
 import html
+import itertools
 import json
 import re
 import string
+import threading
 import builtins
 
+from . import cache
+
 
 class Error(ValueError):
     pass
@@ -25,6 +29,149 @@ class _Undef(str):
         return False
 
 
+class Lazy:
+    """A context value, which is computed when a template accesses it for the first time.
+
+    The function is called without arguments, at most once, its result is
+    kept. Lazy values are resolved when they are read as context variables
+    or with the dot syntax (`a.b`), an unused value is never computed.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = False
+        self.value = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        del d['lock']
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.done:
+            with self.lock:
+                if not self.done:
+                    self.value = self.fn()
+                    self.done = True
+        return self.value
+
+    def __repr__(self):
+        return '<Lazy {!r}>'.format(self.value if self.done else self.fn)
+
+
+class Markup(str):
+    """A string which is safe to output as is.
+
+    Escaping filters return Markup and pass Markup values through unchanged.
+    Slicing and the str methods used by string filters (`strip`, `split`, `upper` etc.)
+    keep the safe status, other operations return a plain `str`.
+    """
+
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+    def __getitem__(self, key):
+        return Markup(str.__getitem__(self, key))
+
+    def strip(self, chars=None):
+        return Markup(str.strip(self, chars))
+
+    def lstrip(self, chars=None):
+        return Markup(str.lstrip(self, chars))
+
+    def rstrip(self, chars=None):
+        return Markup(str.rstrip(self, chars))
+
+    def split(self, sep=None, maxsplit=-1):
+        return [Markup(x) for x in str.split(self, sep, maxsplit)]
+
+    def splitlines(self, keepends=False):
+        return [Markup(x) for x in str.splitlines(self, keepends)]
+
+    def upper(self):
+        return Markup(str.upper(self))
+
+    def lower(self):
+        return Markup(str.lower(self))
+
+    def title(self):
+        return Markup(str.title(self))
+
+    def capitalize(self):
+        return Markup(str.capitalize(self))
+
+    def swapcase(self):
+        return Markup(str.swapcase(self))
+
+
+def escape(val, fn=html.escape):
+    """Escape a value with a str -> str function, unless it's safe markup.
+
+    Safe values are Markup strings and objects with an `__html__` method.
+    """
+
+    if type(val) is not str:
+        if isinstance(val, Markup):
+            return val
+        h = getattr(type(val), '__html__', None)
+        if h:
+            return Markup(h(val))
+        val = str(val)
+    return Markup(fn(val))
+
+
+def _escape_xml(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _escape_xmlquote(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&apos;')
+
+
+def _xmlquote(val):
+    # safe markup is only safe as text (e.g. the output of 'xml'), quotes are escaped for attributes anyway
+    if type(val) is not str and (isinstance(val, Markup) or hasattr(type(val), '__html__')):
+        val = escape(val)
+        return Markup(str.replace(str.replace(val, '"', '&quot;'), "'", '&apos;'))
+    return escape(val, _escape_xmlquote)
+
+
+def _nl2br(val):
+    if isinstance(val, Markup):
+        return Markup(str.replace(val, '\n', '<br/>'))
+    return str(val).replace('\n', '<br/>')
+
+
+def _str(val):
+    # like 'str', but keeps safe markup
+    return val if isinstance(val, str) else str(val)
+
+
+def pure(fn):
+    """Mark a filter as pure: its result depends only on its arguments.
+
+    Pure filters with literal arguments are evaluated at compile time.
+    """
+
+    fn.pure = True
+    return fn
+
+
+class _NoCache:
+    def __getitem__(self, item):
+        return None
+
+    def __setitem__(self, key, value):
+        pass
+
+
 class _Formatter(string.Formatter):
     def format_field(self, val, spec):
         if spec:
@@ -38,14 +185,126 @@ class _Formatter(string.Formatter):
         return format(val, spec)
 
 
+class Writer:
+    """Top-level output buffer, which passes the output to a file-like object.
+
+    The output is collected until there are at least `flush_size` characters
+    and then written out in one call.
+    """
+
+    def __init__(self, fp, flush_size=8192, encoding=None):
+        self.fp = fp
+        self.flush_size = flush_size
+        self.encoding = encoding
+        self.buf = []
+        self.size = 0
+
+    def append(self, s):
+        if s is None:
+            return
+        if not isinstance(s, str):
+            s = str(s)
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            s = ''.join(self.buf)
+            self.buf = []
+            self.size = 0
+            self.write(s)
+
+    def write(self, s):
+        self.fp.write(s.encode(self.encoding) if self.encoding else s)
+
+
+class State:
+    """Per-render state: the output buffer stack, the error flag and the number of reported errors."""
+
+    def __init__(self):
+        self.buf = []
+        self.error = False
+        self.errors = 0
+
+    def pushbuf(self, out=None):
+        self.buf.append([] if out is None else out)
+
+    def popbuf(self):
+        b = self.buf.pop()
+        if isinstance(b, Writer):
+            b.flush()
+            return ''
+        try:
+            return "".join(b)
+        except TypeError:
+            return "".join(str(s) for s in b if s is not None)
+
+    def unwind(self):
+        # drop the buffers of an aborted render and return the top-level output
+        del self.buf[1:]
+        return self.popbuf() if self.buf else ''
+
+    def prints(self, s):
+        self.buf[-1].append(s)
+
+    def printa(self, *a):
+        self.buf[-1].append(' '.join(str(s) for s in a))
+
+
+class Memo:
+    """Per-render results of a pure `@def`, see the `@pure` command.
+
+    `counters` are `[hits, misses, bypassed]`, they are shared by all renders
+    of the def and reported by `BaseRuntime.memo_stats`.
+    """
+
+    def __init__(self, maxsize, counters):
+        self.cache = {}
+        self.maxsize = maxsize
+        self.counters = counters
+
+    def put(self, key, val):
+        c = self.cache
+        if len(c) >= self.maxsize:
+            # evict the oldest entry
+            del c[next(iter(c))]
+        c[key] = val
+        self.counters[1] += 1
+        return val
+
+
 class BaseRuntime:
-    """Basic runtime."""
+    """Basic runtime.
+
+    A runtime holds filters and configuration only, the render state
+    is created per call, so that a runtime can be shared between threads.
+    """
 
     undef = _Undef()
     error_class = Error
+    state_class = State
+    lazy_class = Lazy
 
-    def __init__(self):
-        self.buf = []
+    # max number of cached results of a pure def per render
+    memo_size = 1024
+
+    # fragment cache backend for @cache, by default an in-process cache per runtime
+    fragment_cache = None
+
+    # filters which make markup from text: in the autoescape mode, their input is escaped first
+    markup_filters = set()
+
+    def state(self):
+        return self.state_class()
+
+    def __getstate__(self):
+        # NB: fused filters are generated functions, they are rebuilt after unpickling
+        d = dict(self.__dict__)
+        d.pop('_fused_cache', None)
+        d.pop('_fragment_cache', None)
+        return d
 
     def prepare(self, context, context_vars):
         if not context:
@@ -65,25 +324,171 @@ class BaseRuntime:
             pass
         return getattr(obj, prop)
 
+    def get_cached(self, obj, prop, attr_sites, item_sites, site):
+        # 'get' with per-call-site caches
+        #
+        # types without __getitem__ always end up in getattr, so their sites
+        # skip the failing item lookup next time; other types keep the item-first order
+
+        if type(self).get is not BaseRuntime.get:
+            return self.get(obj, prop)
+
+        cls = type(obj)
+        if not hasattr(cls, '__getitem__'):
+            attr_sites[site] = cls
+            return getattr(obj, prop)
+        item_sites[site] = cls
+        return self.get(obj, prop)
+
+    def site_caches(self, attr_sites, item_sites):
+        # call site caches are only valid for the stock 'get'
+        if type(self).get is BaseRuntime.get:
+            return attr_sites, item_sites
+        return _NoCache(), _NoCache()
+
+    # iterables for @each are not copied, generators, cursors etc. are consumed as the loop goes on
+
     def iter1(self, x):
         if isinstance(x, (dict, list, tuple, set)):
             return x
         try:
-            return [k for k in x]
+            it = iter(x)
         except TypeError:
-            pass
-        return vars(x).keys()
+            return vars(x).keys()
+        return x if hasattr(type(x), '__len__') else it
 
     def iter2(self, x):
         if isinstance(x, dict):
             return x.items()
         if isinstance(x, (list, tuple, set)):
-            return list(enumerate(x))
+            return enumerate(x)
         try:
-            return [(k, v) for k, v in x]
+            it = iter(x)
         except TypeError:
-            pass
-        return vars(x).items()
+            return vars(x).items()
+
+        # unpack the first item here, so that a sequence of non-pairs fails
+        # when the loop is set up, and not in the loop header
+
+        try:
+            first = next(it)
+        except StopIteration:
+            return []
+        k, v = first
+        return itertools.chain([first], it)
+
+    def sized(self, x):
+        # an iterable with a length, for '@each ... index n, total'
+        if hasattr(type(x), '__len__'):
+            return x
+        return list(x)
+
+    async def aiter1(self, x):
+        if hasattr(x, '__aiter__'):
+            return [k async for k in x]
+        return self.iter1(x)
+
+    async def aiter2(self, x):
+        if hasattr(x, '__aiter__'):
+            return [(k, v) async for k, v in x]
+        return self.iter2(x)
+
+    def filter(self, name, autoescape=False):
+        # a filter function by name, unknown filters fail when they are called
+
+        fn = getattr(self, 'filter_' + name, None)
+        if fn and autoescape and name in self.markup_filters:
+            def escaped(val, *args, **kwargs):
+                return fn(self.escape(val), *args, **kwargs)
+
+            return escaped
+        if fn:
+            return fn
+
+        def missing(*args, **kwargs):
+            raise AttributeError('{!r} object has no attribute {!r}'.format(type(self).__name__, 'filter_' + name))
+
+        return missing
+
+    def fused(self, names, autoescape=False):
+        # a single callable for a chain of filters 'val | name1 | name2...'
+
+        cache = self.__dict__.setdefault('_fused_cache', {})
+        key = tuple(names), autoescape
+
+        if key not in cache:
+            cache[key] = self.fuse(key[0], autoescape)
+        return cache[key]
+
+    def fuse(self, names, autoescape=False):
+        fns = [self.filter(name, autoescape) for name in names]
+
+        def fn(val):
+            for f in fns:
+                val = f(val)
+            return val
+
+        return fn
+
+    def memo(self, name, path, line):
+        # a fresh memo for a pure def, created once per render (when the def is defined)
+        stats = self.__dict__.setdefault('_memo_stats', {})
+        key = name, path, line
+        if key not in stats:
+            stats[key] = [0, 0, 0]
+        return Memo(self.memo_size, stats[key])
+
+    def memo_stats(self):
+        """Hits and misses of pure defs rendered with this runtime, sorted by the number of calls."""
+
+        res = []
+        for (name, path, line), (hits, misses, bypassed) in self.__dict__.get('_memo_stats', {}).items():
+            calls = hits + misses + bypassed
+            res.append({
+                'name': name,
+                'path': path,
+                'line': line,
+                'calls': calls,
+                'hits': hits,
+                'misses': misses,
+                'bypassed': bypassed,
+                'hit_rate': hits / calls if calls else 0,
+            })
+        return sorted(res, key=lambda r: (-r['calls'], r['name']))
+
+    def reset_memo_stats(self):
+        self.__dict__.pop('_memo_stats', None)
+
+    def fragments(self):
+        """The fragment cache backend, see the `@cache` command."""
+
+        if self.fragment_cache is not None:
+            return self.fragment_cache
+        return self.__dict__.setdefault('_fragment_cache', cache.FragmentCache())
+
+    def cache_get(self, key):
+        return self.fragments().get(key)
+
+    def cache_put(self, key, val, ttl=None):
+        self.fragments().put(key, val, ttl)
+
+    def escape(self, val):
+        # autoescape, see the 'autoescape' option
+        if val is None:
+            return val
+        return escape(val)
+
+    def markup(self, s):
+        # captured output in the autoescape mode
+        return Markup(s)
+
+    def check_runtime(self, folded):
+        # methods which were called at compile time must be the same at run time
+        for attr, qualname in folded.items():
+            fn = getattr(type(self), attr, None)
+            name = '{}.{}'.format(getattr(fn, '__module__', ''), getattr(fn, '__qualname__', ''))
+            if name != qualname:
+                raise Error('{!r} was evaluated at compile time with {!r}, compile the template with this runtime or with fold=False'.format(attr, qualname))
 
     def isempty(self, x):
         if isinstance(x, str):
@@ -92,83 +497,119 @@ class BaseRuntime:
             return False
         return not bool(x)
 
-    def pushbuf(self):
-        self.buf.append([])
-
-    def popbuf(self):
-        b = self.buf.pop()
-        try:
-            return "".join(b)
-        except TypeError:
-            return "".join(str(s) for s in b if s is not None)
-
-    def prints(self, s):
-        self.buf[-1].append(s)
-
-    def printa(self, *a):
-        self.buf[-1].append(' '.join(str(s) for s in a))
-
-
 class Runtime(BaseRuntime):
     """Basic runtime with default filters"""
 
     formatter = _Formatter()
 
+    # built-in string filters as python snippets, chains of them are fused
+    # into a single expression, unless a filter is overridden
+
+    fusable = {
+        'as_str': '_str({})',
+        'h': '_escape({})',
+        'html': '_escape({})',
+        'lower': '{}.lower()',
+        'nl2br': '_nl2br({})',
+        'strip': '{}.strip()',
+        'title': '{}.title()',
+        'unhtml': '_unescape(str({}))',
+        'upper': '{}.upper()',
+        'url': '_str({})',
+        'xml': '_escape({}, _escape_xml)',
+        'xmlquote': '_xmlquote({})',
+    }
+
+    # these snippets accept any value, others expect a str
+
+    fusable_any = {'as_str', 'h', 'html', 'nl2br', 'unhtml', 'url', 'xml', 'xmlquote'}
+
+    markup_filters = {'linkify', 'nl2br'}
+
+    def fuse(self, names, autoescape=False):
+        for name in names:
+            if name not in self.fusable or getattr(type(self), 'filter_' + name) is not getattr(Runtime, 'filter_' + name):
+                return super().fuse(names, autoescape)
+        if autoescape and any(name in self.markup_filters for name in names) and type(self).escape is not Runtime.escape:
+            return super().fuse(names, autoescape)
+
+        e = 'val' if names[0] in self.fusable_any else '_str(val)'
+        for name in names:
+            if autoescape and name in self.markup_filters:
+                e = '_escape({})'.format(e)
+            e = self.fusable[name].format(e)
+
+        return eval('lambda val: ' + e, {
+            '_escape': escape,
+            '_escape_xml': _escape_xml,
+            '_nl2br': _nl2br,
+            '_str': _str,
+            '_unescape': html.unescape,
+            '_xmlquote': _xmlquote,
+        })
+
+    @pure
     def filter_raw(self, val):
+        if isinstance(val, str):
+            return val if isinstance(val, Markup) else Markup(val)
         return val
 
+    @pure
     def filter_as_int(self, val):
         return int(val)
 
+    @pure
     def filter_as_float(self, val):
         return float(val)
 
+    @pure
     def filter_as_str(self, val):
-        return str(val)
+        return _str(val)
 
+    @pure
     def filter_xml(self, val):
-        val = str(val)
-        val = val.replace('&', '&amp;')
-        val = val.replace('<', '&lt;')
-        val = val.replace('>', '&gt;')
-        return val
+        return escape(val, _escape_xml)
 
+    @pure
     def filter_xmlquote(self, val):
-        val = str(val)
-        val = val.replace('&', '&amp;')
-        val = val.replace('<', '&lt;')
-        val = val.replace('>', '&gt;')
-        val = val.replace('"', '&quot;')
-        val = val.replace('\'', '&apos;')
-        return val
+        return _xmlquote(val)
 
+    @pure
     def filter_html(self, val):
-        return html.escape(str(val))
+        return escape(val)
 
+    @pure
     def filter_h(self, val):
-        return html.escape(str(val))
+        return escape(val)
 
+    @pure
     def filter_unhtml(self, val):
         return html.unescape(str(val))
 
+    @pure
     def filter_nl2br(self, val):
-        return str(val).replace('\n', '<br/>')
+        return _nl2br(val)
 
+    @pure
     def filter_url(self, val):
         # @TODO
-        return str(val)
+        return _str(val)
 
+    @pure
     def filter_strip(self, val):
-        return str(val).strip()
+        return _str(val).strip()
 
+    @pure
     def filter_upper(self, val):
-        return str(val).upper()
+        return _str(val).upper()
 
+    @pure
     def filter_lower(self, val):
-        return str(val).lower()
+        return _str(val).lower()
 
+    @pure
     def filter_title(self, val):
-        return str(val).title()
+        return _str(val).title()
 
     # based on: https://daringfireball.net/2010/07/improved_regex_for_matching_urls
     linkify_re = r'''(?xi)
@@ -191,50 +632,99 @@ class Runtime(BaseRuntime):
     '''
 
 
+    @pure
     def filter_linkify(self, val, target=None, rel=None, cut=None, ellipsis=None):
-        def _repl(m):
-            url = m.group(0)
+        if not (isinstance(val, Markup) or hasattr(type(val), '__html__')):
+            def _repl(m):
+                url = m.group(0)
+
+                attr = 'href="{}"'.format(self.filter_url(url))
+                if target:
+                    attr += ' target="{}"'.format(target)
+                if rel:
+                    attr += ' rel="{}"'.format(rel)
+
+                text = url
+                if cut:
+                    text = self.filter_cut(text, cut, ellipsis)
+
+                return f'<a {attr}>{self.filter_html(text)}</a>'
+
+            return re.sub(self.linkify_re, _repl, str(val))
 
-            attr = 'href="{}"'.format(self.filter_url(url))
+        # safe markup: the text is kept as is, links are unescaped and quoted
+
+        src = escape(val)
+        buf = []
+        pos = 0
+
+        for m in re.finditer(self.linkify_re, src):
+            buf.append(src[pos:m.start()])
+            pos = m.end()
+
+            url = html.unescape(m.group(0))
+            attr = 'href="{}"'.format(_xmlquote(self.filter_url(url)))
             if target:
-                attr += ' target="{}"'.format(target)
+                attr += ' target="{}"'.format(_xmlquote(target))
             if rel:
-                attr += ' rel="{}"'.format(rel)
+                attr += ' rel="{}"'.format(_xmlquote(rel))
 
             text = url
             if cut:
                 text = self.filter_cut(text, cut, ellipsis)
 
-            return f'<a {attr}>{self.filter_html(text)}</a>'
+            buf.append(f'<a {attr}>{self.filter_html(text)}</a>')
 
-        return re.sub(self.linkify_re, _repl, str(val))
+        buf.append(src[pos:])
+        return Markup(''.join(buf))
 
+    @pure
     def filter_format(self, val, fmt):
+        if isinstance(val, Markup):
+            return Markup(self.formatter.format(fmt, val))
         return self.formatter.format(fmt, val)
 
+    @pure
     def filter_cut(self, val, n, ellipsis=None):
-        val = str(val)
+        if isinstance(val, Markup) and '<' not in val:
+            # cut the text, not the entities
+            text = html.unescape(val)
+            if len(text) <= n:
+                return val
+            return Markup(escape(text[:n]) + (ellipsis or ''))
+        val = _str(val)
         if len(val) <= n:
             return val
         return val[:n] + (ellipsis or '')
 
+    @pure
     def filter_json(self, val, pretty=False):
         # NB: allow objects to be dumped
         if not pretty:
             return json.dumps(val, default=vars)
         return json.dumps(val, default=vars, indent=4, sort_keys=True)
 
+    @pure
     def filter_slice(self, val, a, b):
+        if isinstance(val, Markup) and '<' not in val:
+            return escape(html.unescape(val)[a:b])
         return val[a:b]
 
+    @pure
     def filter_join(self, val, delim=', '):
-        return str(delim).join(str(x) for x in val)
+        items = [_str(x) for x in val]
+        if items and all(isinstance(x, Markup) for x in items):
+            return Markup(str(delim).join(items))
+        return str(delim).join(items)
 
+    @pure
     def filter_split(self, val, delim=None):
-        return str(val).split(delim)
+        return _str(val).split(delim)
 
+    @pure
     def filter_lines(self, val):
-        return str(val).splitlines()
+        return _str(val).splitlines()
 
+    @pure
     def filter_sort(self, val):
         return sorted(val)
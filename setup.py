@@ -7,5 +7,5 @@ setup(name='chartreux',
       author='Georg Barikin',
       author_email='georg@merribithouse.net',
       license='MIT',
-      packages=['chartreux'],
+      packages=['chartreux', 'chartreux.bench'],
       zip_safe=False)
@@ -0,0 +1,148 @@
+"""Async mode."""
+
+import asyncio
+
+import chartreux
+from . import u
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def value(v, delay=0):
+    await asyncio.sleep(delay)
+    return v
+
+
+async def rows(n):
+    for k in range(n):
+        await asyncio.sleep(0)
+        yield k
+
+
+def test_awaitable_context():
+    t = """
+        >{user.name}<
+        >{user.id}<
+        >{title | upper}<
+    """
+    d = {
+        'user': value({'name': 'Dax', 'id': 7}),
+        'title': value('hi'),
+    }
+    s = run(chartreux.render_async(t, d))
+    assert u.nows(s) == '>Dax<>7<>HI<'
+
+
+def test_awaitable_attribute_and_call():
+    class User:
+        async def fetch(self, n):
+            return n * 2
+
+    t = """
+        >{user.profile.name}<
+        >{user.fetch(21)}<
+    """
+    user = User()
+    user.profile = value({'name': 'Odo'})
+    d = {'user': user}
+    s = run(chartreux.render_async(t, d))
+    assert u.nows(s) == '>Odo<>42<'
+
+
+def test_async_each():
+    t = """
+        @each items as x index n
+            {n}:{x}
+        @end
+        @each pairs as k, v
+            {k}={v}
+        @end
+    """
+
+    async def pairs():
+        yield 'a', 1
+        yield 'b', 2
+
+    d = {'items': rows(3), 'pairs': pairs()}
+    s = run(chartreux.render_async(t, d))
+    assert u.nows(s) == '1:02:13:2a=1b=2'
+
+
+def test_async_filters_and_defs():
+    class Rt(chartreux.Runtime):
+        async def filter_fetch(self, val):
+            await asyncio.sleep(0)
+            return 'fetched-' + str(val)
+
+    t = """
+        @def show x
+            [{x | fetch}]
+        @end
+        @block box(flow)
+            <{flow | strip}>
+        @end
+        {show(a)}
+        @show b
+        @box
+            {c}
+        @end
+    """
+    d = {'a': 1, 'b': value(2), 'c': value(3)}
+    s = run(chartreux.render_async(t, d, runtime=Rt()))
+    assert u.nows(s) == '[fetched-1][fetched-2]<3>'
+
+
+def test_async_errors():
+    t = """
+        >{a.b}<
+    """
+    s = run(chartreux.render_async(t, {'a': value(1)}, error=u.error, path='xyz'))
+    assert u.nows(s) == '><'
+    assert u.lasterr == ('AttributeError', 'xyz', 2)
+
+
+def test_async_overlap():
+    t = "{a}{b}"
+
+    async def main():
+        tpl = chartreux.compile(t, async_mode=True)
+        return await asyncio.gather(*[
+            chartreux.call(tpl, {'a': value(n, 0.05), 'b': value(n, 0.05)})
+            for n in range(20)
+        ])
+
+    loop = asyncio.new_event_loop()
+    t0 = loop.time()
+    res = loop.run_until_complete(main())
+    elapsed = loop.time() - t0
+    loop.close()
+
+    assert res == [str(n) * 2 for n in range(20)]
+    assert elapsed < 1
+
+
+def test_async_pure():
+    t = """
+        @pure show x
+            ({x})
+        @end
+        {show(a)}{show(a)}
+    """
+    rt = chartreux.Runtime()
+    s = run(chartreux.render_async(t, {'a': value(1)}, runtime=rt))
+    assert u.nows(s) == '(1)(1)'
+    assert rt.memo_stats()[0]['hits'] == 1
+
+
+def test_async_lazy():
+    t = """
+        @if show
+            {a}
+        @end
+        {b}
+    """
+    lz = chartreux.Lazy(lambda: value('B'))
+    s = run(chartreux.render_async(t, {'show': False, 'a': chartreux.Lazy(lambda: 1 / 0), 'b': lz}))
+    assert u.nows(s) == 'B'
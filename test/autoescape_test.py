@@ -0,0 +1,142 @@
+"""Autoescape mode."""
+
+from . import u
+
+
+def test_autoescape():
+    t = '>{aa}<>{aa | html}<>{aa | raw}<>{bb}<'
+    d = {'aa': '<&>', 'bb': u.chartreux.Markup('<b>')}
+    s = u.render(t, d, autoescape=True)
+    assert s == '>&lt;&amp;&gt;<>&lt;&amp;&gt;<><&><><b><'
+
+
+def test_autoescape_off():
+    t = '>{aa}<'
+    s = u.render(t, {'aa': '<&>'})
+    assert s == '><&><'
+
+
+def test_autoescape_inline_option():
+    t = '''
+        @option autoescape
+        >{aa}<
+    '''
+    s = u.render(t, {'aa': '<'})
+    assert u.nows(s) == '>&lt;<'
+
+
+def test_autoescape_constants():
+    t = """>{'<b>'}<>{'<b>' | html}<>{none}<"""
+    src = u.chartreux.translate(t, autoescape=True, static_context={'none': None}, runtime=u.chartreux.Runtime())
+    assert '_ESC' not in src
+    assert u.render(t, {}, autoescape=True, static_context={'none': None}) == '>&lt;b&gt;<>&lt;b&gt;<><'
+
+
+def test_autoescape_none():
+    t = '>{aa}<'
+    s = u.render(t, {'aa': None}, autoescape=True)
+    assert s == '><'
+
+
+def test_def_output_is_not_escaped_again():
+    t = '''
+        @def link(url, text)
+            <a href="{url}">{text}</a>
+        @end
+        @let cell
+            <td>{aa}</td>
+        @end
+        @link '?a&b', aa
+        >{link('/', aa)}<
+        >{cell}<
+    '''
+    s = u.render(t, {'aa': '<x>'}, autoescape=True)
+    assert u.nows(s) == (
+        '<ahref="?a&amp;b">&lt;x&gt;</a>'
+        '><ahref="/">&lt;x&gt;</a><'
+        '><td>&lt;x&gt;</td><'
+    )
+
+
+def test_def_return_is_escaped():
+    t = '''
+        @def f
+            @return '<b>'
+        @end
+        >{f()}<
+    '''
+    s = u.render(t, {}, autoescape=True)
+    assert u.nows(s) == '>&lt;b&gt;<'
+
+
+def test_autoescape_custom_runtime():
+    class R(u.chartreux.Runtime):
+        def escape(self, val):
+            if isinstance(val, u.chartreux.Markup):
+                return val
+            return u.chartreux.Markup('[' + str(val) + ']')
+
+    t = '>{aa}<>{aa | raw}<'
+    s = u.render(t, {'aa': 'x'}, autoescape=True, runtime=R())
+    assert s == '>[x]<>x<'
+
+
+def test_xml_in_attribute_escapes_quotes():
+    t = '<a title="{x | xml | xmlquote}">'
+    s = u.render(t, {'x': '" onclick=alert(1)'})
+    assert s == '<a title="&quot; onclick=alert(1)">'
+
+
+def test_filters_are_not_escaped_twice():
+    d = {
+        'aa': 'a<b\nc',
+        'sp': ' <b> ',
+        'mk': u.chartreux.Markup('<i>Tom&amp;Jerry</i>'),
+        'ur': 'see https://x.com/?a=1&b=2 <now>',
+        'lst': ['<a>', '<b>'],
+        'n': '5',
+    }
+    cases = [
+        ('{aa | raw}', 'a<b\nc'),
+        ('{n | as_int}', '5'),
+        ('{n | as_float}', '5.0'),
+        ('{aa | as_str}', 'a&lt;b\nc'),
+        ('{aa | html | as_str}', 'a&lt;b\nc'),
+        ('{aa | xml}', 'a&lt;b\nc'),
+        ('{aa | xmlquote}', 'a&lt;b\nc'),
+        ('{aa | html}', 'a&lt;b\nc'),
+        ('{aa | h}', 'a&lt;b\nc'),
+        ('{aa | html | h}', 'a&lt;b\nc'),
+        ('{aa | html | unhtml}', 'a&lt;b\nc'),
+        ('{aa | nl2br}', 'a&lt;b<br/>c'),
+        ('{aa | html | nl2br}', 'a&lt;b<br/>c'),
+        ('{aa | html | url}', 'a&lt;b\nc'),
+        ('{sp | strip}', '&lt;b&gt;'),
+        ('{sp | html | strip}', '&lt;b&gt;'),
+        ('{aa | upper}', 'A&lt;B\nC'),
+        ('{aa | html | upper}', 'A&LT;B\nC'),
+        ('{mk | upper}', '<I>TOM&AMP;JERRY</I>'),
+        ('{aa | html | lower}', 'a&lt;b\nc'),
+        ('{aa | html | title}', 'A&Lt;B\nC'),
+        ('{ur | linkify}', 'see <a href="https://x.com/?a=1&amp;b=2">https://x.com/?a=1&amp;b=2</a> &lt;now&gt;'),
+        ('{ur | html | linkify}', 'see <a href="https://x.com/?a=1&amp;b=2">https://x.com/?a=1&amp;b=2</a> &lt;now&gt;'),
+        ('{aa | html | format("[{}]")}', '[a&lt;b\nc]'),
+        ('{aa | html | cut(3)}', 'a&lt;b'),
+        ('{aa | html | cut(2, "...")}', 'a&lt;...'),
+        ('{lst | json}', '[&quot;&lt;a&gt;&quot;, &quot;&lt;b&gt;&quot;]'),
+        ('{aa | html | slice(1, 3)}', '&lt;b'),
+        ('{lst | join}', '&lt;a&gt;, &lt;b&gt;'),
+        ('{aa | html | split("\\n") | join}', 'a&lt;b, c'),
+        ('{aa | html | lines | join("<br>")}', 'a&lt;b<br>c'),
+        ('{lst | sort | join}', '&lt;a&gt;, &lt;b&gt;'),
+    ]
+    for t, res in cases:
+        assert u.render(t, d, autoescape=True) == res, t
+
+
+def test_markup_filters_escape_their_input():
+    t = """>{aa | nl2br}<>{aa | strip | nl2br}<>{'<b>\\nc' | nl2br}<>{'<b> https://x.com' | linkify}<"""
+    d = {'aa': ' <b>\nc '}
+    res = '> &lt;b&gt;<br/>c <>&lt;b&gt;<br/>c<>&lt;b&gt;<br/>c<>&lt;b&gt; <a href="https://x.com">https://x.com</a><'
+    assert u.render(t, d, autoescape=True) == res
+    assert u.render(t, d, autoescape=True, runtime=u.chartreux.Runtime()) == res
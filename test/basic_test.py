@@ -25,3 +25,10 @@ def test_strip():
 
     s = u.render(t, strip=True)
     assert s == '4xxx6yyy8'
+
+
+def test_getter_text_is_kept():
+    t = "x{foo}: _GET_VAR('foo') _GET_VAR_NOEXC('foo')"
+
+    s = u.render(t, {'foo': 1})
+    assert s == "x1: _GET_VAR('foo') _GET_VAR_NOEXC('foo')"
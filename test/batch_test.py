@@ -0,0 +1,62 @@
+"""Batch rendering."""
+
+from . import u
+
+
+def test_render_many():
+    t = '''
+        @def greet(x)
+            Hi {x | upper}!
+        @end
+        @greet name
+        @each items as i
+            {i}
+        @end
+    '''
+    ctxs = [{'name': 'a', 'items': [1, 2]}, {'name': 'b', 'items': []}, {'name': 'c', 'items': [3]}]
+    res = list(u.chartreux.render_many(t, ctxs))
+    assert [u.nows(s) for s in res] == ['HiA!12', 'HiB!', 'HiC!3']
+
+
+def test_call_many_matches_call():
+    tpl = u.chartreux.compile('>{a.b}<>{c | html}<')
+    ctxs = [{'a': {'b': n}, 'c': '<%d>' % n} for n in range(5)]
+    assert list(u.chartreux.call_many(tpl, ctxs)) == [u.chartreux.call(tpl, c) for c in ctxs]
+
+
+def test_contexts_do_not_leak():
+    ctxs = [{'a': 1, 'b': 2}, {'a': 3}]
+    res = list(u.chartreux.render_many('>{a}<>{b}<', ctxs, error=u.error))
+    assert res == ['>1<>2<', '>3<><']
+
+
+def test_errors_in_batch():
+    errs = []
+    t = '''
+        >{10 / a}<
+    '''
+    res = list(u.chartreux.render_many(t, [{'a': 2}, {'a': 0}, {'a': 5}], error=lambda *a: errs.append(a[0])))
+    assert [u.nows(s) for s in res] == ['>5.0<', '><', '>2.0<']
+    assert [type(e) for e in errs] == [ZeroDivisionError]
+
+
+def test_errors_in_batch_fast_mode():
+    t = '>{10 / a}<'
+    res = list(u.chartreux.render_many(t, [{'a': 0}, {'a': 5}], error=u.error, fast=True))
+    assert res == ['>', '>2.0<']
+
+
+def test_contexts_iterator_is_lazy():
+    def ctxs():
+        for n in range(3):
+            yield {'n': n}
+
+    it = u.chartreux.render_many('{n}', ctxs())
+    assert next(it) == '0'
+    assert list(it) == ['1', '2']
+
+
+def test_batch_async_not_supported():
+    tpl = u.chartreux.compile('{a}', async_mode=True)
+    with u.raises_compiler_error('ERROR_NOT_SUPPORTED'):
+        u.chartreux.call_many(tpl, [{}])
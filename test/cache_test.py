@@ -0,0 +1,171 @@
+"""Template cache."""
+
+import threading
+
+import chartreux
+from . import u
+
+
+def test_cache_hit():
+    c = chartreux.LRUCache(maxsize=10)
+
+    s = u.render('>{a}<', {'a': 1}, cache=c)
+    assert s == '>1<'
+    s = u.render('>{a}<', {'a': 2}, cache=c)
+    assert s == '>2<'
+
+    st = c.stats()
+    assert st['hits'] == 1
+    assert st['misses'] == 1
+    assert st['size'] == 1
+
+
+def test_cache_options_in_key():
+    c = chartreux.LRUCache(maxsize=10)
+
+    s = u.render('>{a}<', {'a': '<'}, cache=c)
+    assert s == '><<'
+    s = u.render('>{a}<', {'a': '<'}, cache=c, filter='html')
+    assert s == '>&lt;<'
+
+    assert c.stats()['misses'] == 2
+
+
+def test_cache_runtime_in_key():
+    c = chartreux.LRUCache(maxsize=10)
+
+    class R(chartreux.Runtime):
+        @chartreux.pure
+        def filter_upper(self, val):
+            return 'R'
+
+    for _ in range(3):
+        assert u.render('>{"a" | upper}<', cache=c, runtime=chartreux.Runtime()) == '>A<'
+    assert u.render('>{"a" | upper}<', cache=c, runtime=R()) == '>R<'
+
+    st = c.stats()
+    assert st['hits'] == 2
+    assert st['misses'] == 2
+
+
+def test_cache_eviction_and_resize():
+    c = chartreux.LRUCache(maxsize=2)
+
+    for n in range(5):
+        u.render(str(n), cache=c)
+
+    assert len(c) == 2
+    assert c.stats()['evictions'] == 3
+
+    c.resize(1)
+    assert len(c) == 1
+    assert c.stats()['evictions'] == 4
+
+    c.clear()
+    assert c.stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'maxsize': 1}
+
+
+def test_cache_path_mtime(tmpdir):
+    c = chartreux.LRUCache(maxsize=10)
+
+    p = tmpdir.join('t')
+    p.write('A')
+    assert u.render_path(p.strpath, cache=c) == 'A'
+    assert u.render_path(p.strpath, cache=c) == 'A'
+
+    p.write('BB')
+    p.setmtime(p.mtime() + 10)
+    assert u.render_path(p.strpath, cache=c) == 'BB'
+
+    st = c.stats()
+    assert st['hits'] == 1
+    assert st['misses'] == 2
+
+
+def test_cache_include_changed(tmpdir):
+    c = chartreux.LRUCache(maxsize=10)
+
+    inc = tmpdir.join('inc')
+    inc.write('INC-1')
+    main = tmpdir.join('main')
+    main.write('@include inc\n')
+    text = '@include ' + inc.strpath + '\n'
+
+    assert u.nows(u.render_path(main.strpath, cache=c)) == 'INC-1'
+    assert u.nows(u.render(text, cache=c)) == 'INC-1'
+    assert u.nows(u.render_path(main.strpath, cache=c)) == 'INC-1'
+
+    inc.write('INC-22')
+    assert u.nows(u.render_path(main.strpath, cache=c)) == 'INC-22'
+    assert u.nows(u.render(text, cache=c)) == 'INC-22'
+    assert u.nows(u.render_path(main.strpath, cache=c)) == 'INC-22'
+
+
+def test_cache_disabled():
+    size = len(chartreux.template_cache)
+    u.render('>{a}< no cache', {'a': 1}, cache=False)
+    assert len(chartreux.template_cache) == size
+
+
+def test_cache_threads():
+    c = chartreux.LRUCache(maxsize=4)
+    errors = []
+
+    def worker(n):
+        try:
+            for k in range(50):
+                s = u.render('{x}-' + str(k % 8), {'x': n}, cache=c)
+                assert s == str(n) + '-' + str(k % 8)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert len(c) <= 4
+
+
+def test_bytecode_cache(tmpdir, monkeypatch):
+    d = tmpdir.join('cache').strpath
+    p = tmpdir.join('t')
+    p.write('>{a}<')
+
+    t = chartreux.compile_path(p.strpath, cache_dir=d)
+    assert u.nows(chartreux.call(t, {'a': 1})) == '>1<'
+
+    def fail(self, text):
+        raise AssertionError('should not compile')
+
+    monkeypatch.setattr(chartreux.Compiler, 'run', fail)
+
+    t = chartreux.compile_path(p.strpath, cache_dir=d)
+    assert u.nows(chartreux.call(t, {'a': 2})) == '>2<'
+
+    with u.pytest.raises(AssertionError):
+        chartreux.compile_path(p.strpath, cache_dir=d, filter='html')
+
+
+def test_bytecode_cache_include(tmpdir):
+    d = tmpdir.join('cache').strpath
+    inc = tmpdir.join('inc')
+    inc.write('INC-1')
+    main = tmpdir.join('main')
+    main.write('@include inc\n')
+
+    t = chartreux.compile_path(main.strpath, cache_dir=d)
+    assert t.includes == [inc.strpath]
+    assert u.nows(chartreux.call(t)) == 'INC-1'
+
+    t = chartreux.compile_path(main.strpath, cache_dir=d)
+    assert u.nows(chartreux.call(t)) == 'INC-1'
+
+    inc.write('INC-22')
+    t = chartreux.compile_path(main.strpath, cache_dir=d)
+    assert u.nows(chartreux.call(t)) == 'INC-22'
+
+    chartreux.BytecodeCache(d).clear()
+    assert tmpdir.join('cache').listdir() == []
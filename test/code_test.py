@@ -29,3 +29,14 @@ def test_import():
 
     s = u.render(t, {})
     assert u.nows(s) == u.nows('>' + sys.version + '<>/foo/bar<')
+
+
+def test_code_writes_context():
+    t = """
+        >{a}<
+        @code _['a'] = 'changed'
+        >{a}<
+    """
+
+    s = u.render(t, {'a': 'orig'})
+    assert u.nows(s) == '>orig<>changed<'
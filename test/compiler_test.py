@@ -58,6 +58,31 @@ def test_line_number():
         u.render(t)
 
 
+def test_python_syntax_error_line_number():
+    t = """\
+        abc
+        def
+        @code y = = 2
+        ghi
+    """
+
+    with u.raises_compiler_error("ERROR_SYNTAX.*'xyz' on line 3"):
+        u.render(t, path='xyz')
+
+
+def test_line_table():
+    t = """\
+        abc
+        >{aa}<
+    """
+
+    tpl = u.chartreux.compile(t, path='xyz')
+    src = tpl.source.splitlines()
+    lines = [n for n, pos in tpl.lines.items() if pos == ('xyz', 2) and 'aa' in src[n - 1]]
+    assert lines
+    assert '## xyz' not in tpl.source
+
+
 def test_custom_delims():
     t = """
         %if aa
@@ -75,3 +100,42 @@ def test_custom_expression_delims():
     """
     s = u.render(t, {'aa': 1}, syntax={'start': '{{', 'end': '}}'})
     assert u.nows(s) == '10...12...1'
+
+
+def test_stats(tmpdir):
+    tmpdir.join('inc.cx').write('<i>{bb}</i>\n<i>{cc}</i>\n')
+    tmpdir.join('page.cx').write('''
+        @def f(x)
+            {x}
+        @end
+        @include ./inc.cx
+        >{aa}<
+    ''')
+
+    tpl = u.chartreux.compile_path(tmpdir.join('page.cx').strpath, stats=True)
+    st = tpl.stats
+
+    assert st.template_lines == 9
+    assert st.python_lines == tpl.source.count('\n') + 1
+    assert st.try_blocks > 0
+    assert st.context_vars == 3
+    assert st.defs == 1
+    assert st.pure_defs == 0
+    assert st.includes == 1
+    assert not st.cached
+
+    d = st.as_dict()
+    assert all(d[p + '_ms'] >= 0 for p in st.phases)
+    assert d['expression_ms'] <= d['parse_ms'] <= d['total_ms']
+
+
+def test_no_stats_by_default():
+    assert u.chartreux.compile('abc').stats is None
+
+
+def test_stats_with_bytecode_cache(tmpdir):
+    d = tmpdir.join('cache').strpath
+    u.chartreux.compile('>{aa}<', cache_dir=d)
+    st = u.chartreux.compile('>{aa}<', cache_dir=d, stats=True).stats
+    assert st.cached
+    assert st.times['parse'] == 0
@@ -264,3 +264,88 @@ def test_dynamic_scope():
     d = {'a': 'A', 'b': 'B'}
     s = u.render(t, d)
     assert u.nows(s) == '[A,B,C][A,B,C][A,newB,newC]'
+
+
+def test_pure():
+    t = '''
+        @pure badge(amount, cur='EUR')
+            [{amount} {cur}]
+        @end
+        @each items as i
+            @badge i
+        @end
+        {badge(3, cur='USD')}
+    '''
+    rt = u.chartreux.Runtime()
+    s = u.render(t, {'items': [1, 2, 1, 1, 2]}, runtime=rt)
+    assert u.nows(s) == '[1EUR][2EUR][1EUR][1EUR][2EUR][3USD]'
+    st = rt.memo_stats()
+    assert [(r['name'], r['line'], r['calls'], r['hits'], r['misses'], r['bypassed']) for r in st] == [('badge', 2, 6, 3, 3, 0)]
+    assert st[0]['hit_rate'] == 0.5
+
+
+def test_pure_return_and_filter():
+    t = '''
+        @pure square n
+            @return n * n
+        @end
+        @pure bold x
+            @return x | '<b>{}</b>'
+        @end
+        {square(3) + square(3)} {'a' | bold} {'a' | bold}
+    '''
+    assert u.nows(u.render(t)) == '18<b>a</b><b>a</b>'
+
+
+def test_pure_keys_include_types():
+    t = '''
+        @pure show x
+            ({x})
+        @end
+        {show(1)}{show(1.0)}{show(True)}{show(1)}
+    '''
+    assert u.nows(u.render(t)) == '(1)(1.0)(True)(1)'
+
+
+def test_pure_unhashable_args():
+    t = '''
+        @pure show x, *more, **kw
+            ({x}{more}{kw})
+        @end
+        {show([1])}{show([1])}{show(1, 2, a=3)}{show(1, 2, a=3)}{show(1, a=[])}
+    '''
+    rt = u.chartreux.Runtime()
+    s = u.render(t, runtime=rt)
+    assert u.nows(s) == "([1](){})([1](){})(1(2,){'a':3})(1(2,){'a':3})(1(){'a':[]})"
+    st = rt.memo_stats()[0]
+    assert (st['hits'], st['misses'], st['bypassed']) == (1, 1, 3)
+
+
+def test_pure_memo_is_per_render():
+    tpl = u.chartreux.compile('''
+        @pure show x
+            ({x}{y})
+        @end
+        {show(1)}{show(1)}
+    ''')
+    rt = u.chartreux.Runtime()
+    res = list(u.chartreux.call_many(tpl, [{'y': 'a'}, {'y': 'b'}], runtime=rt))
+    assert [u.nows(s) for s in res] == ['(1a)(1a)', '(1b)(1b)']
+    st = rt.memo_stats()[0]
+    assert (st['hits'], st['misses']) == (2, 2)
+
+
+def test_pure_memo_size():
+    class Rt(u.chartreux.Runtime):
+        memo_size = 2
+
+    t = '''
+        @pure show x
+            ({x})
+        @end
+        {show(1)}{show(2)}{show(3)}{show(1)}{show(3)}
+    '''
+    rt = Rt()
+    assert u.nows(u.render(t, runtime=rt)) == '(1)(2)(3)(1)(3)'
+    st = rt.memo_stats()[0]
+    assert (st['hits'], st['misses']) == (1, 4)
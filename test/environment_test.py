@@ -0,0 +1,80 @@
+"""Environment."""
+
+import chartreux
+from . import u
+
+
+def test_search_paths(tmpdir):
+    tmpdir.mkdir('a').join('main').write('MAIN|\n@include part\n')
+    tmpdir.mkdir('b').join('part').write('PART')
+
+    env = chartreux.Environment(paths=[tmpdir.join('a').strpath, tmpdir.join('b').strpath])
+    s = env.render('main')
+    assert u.nows(s) == 'MAIN|PART'
+
+
+def test_registry(tmpdir):
+    tmpdir.join('main').write('>{a}<')
+
+    env = chartreux.Environment(paths=[tmpdir.strpath], auto_reload=False)
+    t1 = env.get_template('main')
+    t2 = env.get_template('main')
+    assert t1 is t2
+    assert env.render('main', {'a': 1}) == '>1<'
+
+
+def test_options(tmpdir):
+    tmpdir.join('main').write('{a}')
+
+    env = chartreux.Environment(paths=[tmpdir.strpath], filter='html')
+    assert env.render('main', {'a': '<'}) == '&lt;'
+
+
+def test_not_found(tmpdir):
+    env = chartreux.Environment(paths=[tmpdir.strpath])
+    with u.raises_compiler_error('ERROR_FILE'):
+        env.get_template('nope')
+
+
+def test_auto_reload(tmpdir):
+    main = tmpdir.join('main')
+    main.write('@include part\n')
+    part = tmpdir.join('part')
+    part.write('ONE')
+
+    env = chartreux.Environment(paths=[tmpdir.strpath], check_interval=0)
+    assert env.render('main') == 'ONE'
+
+    part.write('TWO!')
+    assert env.render('main') == 'TWO!'
+
+    env = chartreux.Environment(paths=[tmpdir.strpath], check_interval=1000)
+    assert env.render('main') == 'TWO!'
+    part.write('THREE')
+    assert env.render('main') == 'TWO!'
+
+
+def test_shared_cache_dir(tmpdir):
+    d = tmpdir.join('cache').strpath
+    tmpdir.mkdir('a').join('header').write('HEADER-A')
+    tmpdir.mkdir('b').join('header').write('HEADER-B')
+    tmpdir.mkdir('c').join('page').write('page:\n@include header\n')
+
+    env_a = chartreux.Environment(paths=[tmpdir.join('a').strpath, tmpdir.join('c').strpath], cache_dir=d)
+    env_b = chartreux.Environment(paths=[tmpdir.join('b').strpath, tmpdir.join('c').strpath], cache_dir=d)
+    assert u.nows(env_a.render('page')) == 'page:HEADER-A'
+    assert u.nows(env_b.render('page')) == 'page:HEADER-B'
+
+    env_a = chartreux.Environment(paths=[tmpdir.join('a').strpath, tmpdir.join('c').strpath], cache_dir=d, stats=True)
+    assert env_a.get_template('page').stats.cached
+
+
+def test_cache_dir_with_local_finder(tmpdir):
+    d = tmpdir.join('cache').strpath
+    tmpdir.join('page').write('@include header\n')
+
+    for text in 'ONE', 'TWO':
+        env = chartreux.Environment(paths=[tmpdir.strpath], finder=lambda cur, name, text=text: tmpdir.join(name).strpath, cache_dir=d)
+        tmpdir.join('header').write(text)
+        assert u.nows(env.render('page')) == text
+    assert not tmpdir.join('cache').check()
@@ -84,3 +84,82 @@ def test_code():
 
     with u.raises_template_error(ZeroDivisionError):
         u.render(t, d)
+
+
+def test_no_var_fast_locals():
+    t = """
+        >{aa}<
+        @def f
+            >{bb}<
+        @end
+        {f()}
+    """
+
+    s = u.render(t, {'aa': 1}, error=u.error, path='xyz')
+    assert u.lasterr == ('KeyError', 'xyz', 4)
+    assert u.nows(s) == '>1<><'
+
+    tpl = u.chartreux.compile(t, fast_locals=False)
+    s = u.chartreux.call(tpl, {'aa': 1}, error=u.error)
+    assert u.lasterr == ('KeyError', '', 4)
+    assert u.nows(s) == '>1<><'
+
+
+def test_fast_mode_stops_at_first_error():
+    t = """
+        foo
+        >{aa.bb}<
+        >{cc}<
+    """
+
+    s = u.render(t, {'aa': 123}, error=u.error, path='xyz', fast=True)
+    assert u.lasterr == ('AttributeError', 'xyz', 3)
+    assert u.nows(s) == 'foo>'
+
+    with u.raises_template_error(AttributeError):
+        u.render(t, {'aa': 123}, fast=True)
+
+
+def test_fast_mode_error_in_def():
+    t = """
+        >
+        @def f x
+            @if x.y
+                yes
+            @end
+        @end
+        @let z f(1)
+        <
+    """
+
+    s = u.render(t, {}, error=u.error, path='xyz', fast=True)
+    assert u.lasterr == ('AttributeError', 'xyz', 4)
+    assert u.nows(s) == '>'
+
+
+def test_fast_mode_include(tmpdir):
+    tmpdir.join('inc').write('abc\n{1/0}\n')
+    tmpdir.join('main').write('>\n@include inc\n<\n')
+
+    s = u.render_path(str(tmpdir.join('main')), {}, error=u.error, fast=True)
+    assert u.lasterr == ('ZeroDivisionError', 'inc', 2)
+    assert u.nows(s) == '>abc'
+
+
+def test_error_in_property():
+    class C:
+        @property
+        def bb(self):
+            return 1 / 0
+
+    t = """
+        >{aa.bb}<
+        @def f x
+            [{x.bb}]
+        @end
+        {f(aa)}
+    """
+
+    s = u.render(t, {'aa': C()}, error=u.error, path='xyz')
+    assert u.lasterr == ('ZeroDivisionError', 'xyz', 4)
+    assert u.nows(s) == '><[]'
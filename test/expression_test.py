@@ -105,3 +105,32 @@ def test_explicit_var():
     d = {'foo bar': {'boo': 123}}
     s = u.render(t, d)
     assert s == '>123<'
+
+
+def test_call_site_mixed_types():
+    class C:
+        items = 'attr'
+
+    t = '''
+        @each rows as r
+            [{r.items}]
+        @end
+    '''
+    d = {'rows': [C(), {'items': 'key'}, C(), {}, C()]}
+    s = u.render(t, d)
+    assert u.nows(s).startswith('[attr][key][attr][<built-inmethoditems')
+    assert u.nows(s).endswith('[attr]')
+
+
+def test_call_site_custom_get():
+    class R(u.chartreux.Runtime):
+        def get(self, obj, prop):
+            return prop.upper()
+
+    class C:
+        aa = 'x'
+
+    t = '@each rows as r\n{r.aa}\n@end'
+    tpl = u.chartreux.compile(t)
+    s = u.chartreux.call(tpl, {'rows': [C(), C()]}, runtime=R())
+    assert u.nows(s) == 'AAAA'
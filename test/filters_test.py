@@ -38,6 +38,24 @@ def test_filter_html():
     assert s == '>&lt;b&gt;<'
 
 
+def test_filter_xml():
+    t = '>{aa | xml}<>{aa | xmlquote}<'
+    d = {'aa': '<a href="x">\'&\'</a>'}
+    s = u.render(t, d)
+    assert s == '>&lt;a href="x"&gt;\'&amp;\'&lt;/a&gt;<>&lt;a href=&quot;x&quot;&gt;&apos;&amp;&apos;&lt;/a&gt;<'
+
+
+def test_escaping_filters_pass_markup_through():
+    class Obj:
+        def __html__(self):
+            return '<i>obj</i>'
+
+    t = '>{aa | html | html}<>{bb | xml}<>{cc | h}<>{aa | html | upper | html}<'
+    d = {'aa': '<b>', 'bb': u.chartreux.Markup('<b>'), 'cc': Obj()}
+    s = u.render(t, d)
+    assert s == '>&lt;b&gt;<><b><><i>obj</i><>&LT;B&GT;<'
+
+
 def test_filter_nl2br():
     t = '>{aa | nl2br}<'
     d = {'aa': 'aa\nbb'}
@@ -45,6 +63,18 @@ def test_filter_nl2br():
     assert s == '>aa<br/>bb<'
 
 
+def test_markup_is_not_escaped_without_autoescape():
+    t = '>{a | nl2br}<>{b | linkify}<>{(a | html) + "<hr>"}<>{c | raw | upper}<'
+    d = {'a': '<b>hi</b>\nthere', 'b': '<b> https://www.com', 'c': '<b>&amp;x</b>'}
+    s = u.render(t, d)
+    assert s == (
+        '><b>hi</b><br/>there<'
+        '><b> <a href="https://www.com">https://www.com</a><'
+        '>&lt;b&gt;hi&lt;/b&gt;\nthere<hr><'
+        '><B>&AMP;X</B><'
+    )
+
+
 def test_filter_strip():
     t = '>{aa | strip}<'
     d = {'aa': '  123  '}
@@ -73,6 +103,13 @@ def test_filter_linkify():
     assert s == '>abc <a href="https://www.com">https://www.com</a> def <a href="https://www.com">https://www.com</a>, xyz<'
 
 
+def test_filter_linkify_markup():
+    t = '>{aa | linkify(target=tt)}<'
+    d = {'aa': u.chartreux.Markup('<b> https://www.com/?a=1&amp;b=2'), 'tt': '"x'}
+    s = u.render(t, d)
+    assert s == '><b> <a href="https://www.com/?a=1&amp;b=2" target="&quot;x">https://www.com/?a=1&amp;b=2</a><'
+
+
 def test_filter_unhtml():
     t = '>{aa | unhtml}<'
     d = {'aa': '<b> abc &lt;b&gt;'}
@@ -156,3 +193,32 @@ def test_filter_arg():
 
     s = u.render(t, {})
     assert u.nows(s) == '>ABC<>456<'
+
+
+def test_filter_chain():
+    t = '>{aa | strip | lower | html}<>{aa | cut(5) | upper | nl2br}<'
+    d = {'aa': ' <B>\nXy '}
+    s = u.render(t, d)
+    assert s == '>&lt;b&gt;\nxy<> <B><br/><'
+
+
+def test_filter_chain_custom_runtime():
+    class R(u.chartreux.Runtime):
+        def filter_upper(self, val):
+            return '[' + str(val) + ']'
+
+        def filter_twice(self, val):
+            return val * 2
+
+    t = '>{aa | strip | upper | twice}<'
+    s = u.render(t, {'aa': ' x '}, runtime=R())
+    assert s == '>[x][x]<'
+
+
+def test_unknown_filter():
+    t = '''
+        >{aa | nope}<
+    '''
+    s = u.render(t, {'aa': 1}, error=u.error, path='xyz')
+    assert u.lasterr == ('AttributeError', 'xyz', 2)
+    assert u.nows(s) == '><'
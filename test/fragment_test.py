@@ -0,0 +1,164 @@
+"""Fragment caching."""
+
+import hashlib
+import pickle
+
+from . import u
+
+T = '''
+    @cache 'nav', lang
+        <nav>{lang}:{n}</nav>
+    @end
+    <p>{n}</p>
+'''
+
+
+def test_cache():
+    rt = u.chartreux.Runtime()
+    res = [u.nows(u.render(T, {'lang': lang, 'n': n}, runtime=rt)) for n, lang in enumerate(['en', 'en', 'de', 'en'])]
+    assert res == [
+        '<nav>en:0</nav><p>0</p>',
+        '<nav>en:0</nav><p>1</p>',
+        '<nav>de:2</nav><p>2</p>',
+        '<nav>en:0</nav><p>3</p>',
+    ]
+    st = rt.fragments().stats()
+    assert (st['hits'], st['misses'], st['size']) == (2, 2, 2)
+
+
+def test_ttl():
+    t = '''
+        @cache 'x' ttl=ttl
+            {n}
+        @end
+    '''
+    rt = u.chartreux.Runtime()
+    assert [u.nows(u.render(t, {'n': n, 'ttl': 0}, runtime=rt)) for n in range(3)] == ['0', '1', '2']
+    assert rt.fragments().stats()['expired'] == 2
+
+    rt = u.chartreux.Runtime()
+    assert [u.nows(u.render(t, {'n': n, 'ttl': 100}, runtime=rt)) for n in range(3)] == ['0', '0', '0']
+
+
+def test_fragments_with_errors_are_not_cached():
+    t = '''
+        @cache 'x'
+            >{a.b}<
+        @end
+    '''
+    rt = u.chartreux.Runtime()
+    assert u.nows(u.render(t, {'a': {}}, error=u.error, runtime=rt)) == '><'
+    assert u.lasterr == ('AttributeError', '', 3)
+    assert u.nows(u.render(t, {'a': {'b': 1}}, error=u.error, runtime=rt)) == '>1<'
+    assert u.nows(u.render(t, {'a': {}}, error=u.error, runtime=rt)) == '>1<'
+
+
+def test_key_errors():
+    t = '''
+        @cache a.b
+            >{c}<
+        @end
+    '''
+    rt = u.chartreux.Runtime()
+    for c in 1, 2:
+        assert u.nows(u.render(t, {'a': {}, 'c': c}, error=u.error, runtime=rt)) == '>%d<' % c
+        assert u.lasterr == ('AttributeError', '', 2)
+    assert rt.fragments().stats()['size'] == 0
+
+
+def test_cache_in_def_and_stream():
+    t = '''
+        @def box(x)
+            @cache 'box', x
+                [{x}{n}]
+            @end
+        @end
+        @each items as i
+            @box i
+        @end
+    '''
+    rt = u.chartreux.Runtime()
+    tpl = u.chartreux.compile(t)
+    assert u.nows(u.chartreux.call(tpl, {'items': [1, 2, 1], 'n': 'a'}, runtime=rt)) == '[1a][2a][1a]'
+    s = ''.join(u.chartreux.call_iter(tpl, {'items': [2, 3], 'n': 'b'}, runtime=rt, chunk_size=1))
+    assert u.nows(s) == '[2a][3b]'
+
+
+def test_autoescape():
+    t = '''
+        @cache 'x'
+            <b>{v}</b>
+        @end
+    '''
+    rt = u.chartreux.Runtime()
+    assert [u.nows(u.render(t, {'v': '<'}, autoescape=True, runtime=rt)) for _ in range(2)] == ['<b>&lt;</b>'] * 2
+
+
+def test_lru_backend():
+    c = u.chartreux.FragmentCache(maxsize=2)
+    c.put('a', 'A')
+    c.put('b', 'B', ttl=100)
+    c.put('c', 'C')
+    assert (c.get('a'), c.get('b'), c.get('c')) == (None, 'B', 'C')
+    c.put('d', 'D', ttl=0)
+    assert c.get('d') is None
+    assert c.stats() == {'hits': 2, 'misses': 2, 'evictions': 2, 'size': 1, 'maxsize': 2, 'expired': 1}
+
+
+def test_file_backend(tmpdir):
+    d = tmpdir.join('frags').strpath
+
+    rt1 = u.chartreux.Runtime()
+    rt1.fragment_cache = u.chartreux.FileFragmentCache(d)
+    rt2 = u.chartreux.Runtime()
+    rt2.fragment_cache = u.chartreux.FileFragmentCache(d)
+
+    assert u.nows(u.render(T, {'lang': 'en', 'n': 1}, runtime=rt1)) == '<nav>en:1</nav><p>1</p>'
+    assert u.nows(u.render(T, {'lang': 'en', 'n': 2}, runtime=rt2)) == '<nav>en:1</nav><p>2</p>'
+    assert rt1.fragments().stats() == {'hits': 0, 'misses': 1, 'expired': 0, 'size': 1}
+    assert rt2.fragments().stats() == {'hits': 1, 'misses': 0, 'expired': 0, 'size': 1}
+
+    c = u.chartreux.FileFragmentCache(d)
+    c.put('x', 'X', ttl=0)
+    assert c.get('x') is None
+    assert c.stats()['expired'] == 1
+
+    c = pickle.loads(pickle.dumps(c))
+    key = (hashlib.sha256(T.encode('utf8')).hexdigest(), 2, 'nav', 'en')
+    assert c.get(key) == '        <nav>en:1</nav>\n'
+    c.clear()
+    assert c.stats() == {'hits': 0, 'misses': 0, 'expired': 0, 'size': 0}
+
+
+def test_keys_are_per_site(tmpdir):
+    rt = u.chartreux.Runtime()
+    t1 = """
+        @cache 'k'
+            one
+        @end
+    """
+    t2 = """
+        @cache 'k'
+            two
+        @end
+    """
+    t3 = """
+        @cache 'k'
+            three
+        @end
+        @cache 'k'
+            four
+        @end
+    """
+    assert u.nows(u.render(t1, runtime=rt)) == 'one'
+    assert u.nows(u.render(t2, runtime=rt)) == 'two'
+    assert u.nows(u.render(t3, runtime=rt)) == 'threefour'
+
+    p1 = tmpdir.join('p1')
+    p1.write(t1)
+    p2 = tmpdir.join('p2')
+    p2.write(t1.replace('one', 'other'))
+    assert u.nows(u.render_path(p1.strpath, runtime=rt)) == 'one'
+    assert u.nows(u.render_path(p2.strpath, runtime=rt)) == 'other'
+    assert u.nows(u.render_path(p1.strpath, runtime=rt)) == 'one'
+    assert rt.fragments().stats()['hits'] == 1
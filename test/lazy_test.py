@@ -0,0 +1,82 @@
+"""Lazy context values."""
+
+import pickle
+
+from . import u
+
+
+def counter(value):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return value
+
+    return fn, calls
+
+
+def test_lazy_var():
+    fn, calls = counter('X')
+    t = '''
+        {a}{a | lower}
+        @if a == 'X'
+            ok
+        @end
+    '''
+    s = u.render(t, {'a': u.chartreux.Lazy(fn)})
+    assert u.nows(s) == 'Xxok'
+    assert len(calls) == 1
+
+
+def test_unused_lazy_is_not_computed():
+    fn, calls = counter([1, 2])
+    t = '''
+        @if show
+            @each rows as r
+                {r}
+            @end
+        @end
+        done
+    '''
+    s = u.render(t, {'show': False, 'rows': u.chartreux.Lazy(fn)})
+    assert u.nows(s) == 'done'
+    assert calls == []
+
+
+def test_lazy_attributes():
+    fn, calls = counter({'name': 'Dax', 'ships': ['Defiant']})
+
+    class User:
+        profile = u.chartreux.Lazy(fn)
+
+    t = '''
+        {user.profile.name} {user.profile.ships[0]} {data.user.profile.name}
+    '''
+    s = u.render(t, {'user': User(), 'data': {'user': {'profile': u.chartreux.Lazy(fn)}}})
+    assert u.nows(s) == 'DaxDefiantDax'
+    assert len(calls) == 2
+
+
+def test_lazy_modes():
+    t = '{a}{b.c}'
+    for opts in {'fast': True}, {'fast_locals': False}:
+        ctx = {'a': u.chartreux.Lazy(lambda: 1), 'b': {'c': u.chartreux.Lazy(lambda: 2)}}
+        assert u.chartreux.call(u.chartreux.compile(t, **opts), ctx) == '12'
+
+
+def test_lazy_errors():
+    def fail():
+        raise ValueError()
+
+    t = '''
+        >{a}<
+        >{b.c}<
+    '''
+    s = u.render(t, {'a': u.chartreux.Lazy(fail), 'b': {'c': u.chartreux.Lazy(fail)}}, error=u.error)
+    assert u.nows(s) == '><><'
+    assert u.lasterr == ('ValueError', '', 3)
+
+
+def test_lazy_pickle():
+    lz = pickle.loads(pickle.dumps(u.chartreux.Lazy(str)))
+    assert lz.get() == ''
@@ -120,3 +120,88 @@ def test_undef():
     assert u.nows(s) == '><'
 
 
+
+
+def test_iterators_are_consumed_lazily():
+    seen = []
+
+    def gen(n):
+        for k in range(n):
+            seen.append(k)
+            yield k, len(seen)
+
+    t = """
+        @each rows as k, prev
+            {k}:{prev}
+        @end
+    """
+    s = u.render(t, {'rows': gen(3)})
+    assert u.nows(s) == '0:11:22:3'
+
+
+def test_iterator_else():
+    t = """
+        >
+        @each it as e
+            {e}
+        @else
+            EMPTY!
+        @end
+        <
+    """
+    assert u.nows(u.render(t, {'it': iter([])})) == '>EMPTY!<'
+    assert u.nows(u.render(t, {'it': iter([1, 2])})) == '>12<'
+    assert u.nows(u.render(t, {'it': (x for x in [0])})) == '>0<'
+
+
+def test_iterator_index_len():
+    t = """
+        @each it as e index n, total
+            {e}:{n}/{total}
+        @end
+        @each it as e
+            {e}
+        @end
+    """
+    s = u.render(t, {'it': (x * 10 for x in range(3))})
+    assert u.nows(s) == '0:1/310:2/320:3/3'
+
+
+def test_iterator_pairs():
+    t = """
+        @each it as a, b index n
+            {a}{b}{n}
+        @end
+    """
+    s = u.render(t, {'it': zip('xy', 'XY')})
+    assert u.nows(s) == 'xX1yY2'
+
+
+def test_iterator_not_pairs():
+    t = """
+        before
+        @each it as a, b
+            {a}{b}
+        @end
+        after
+    """
+    s = u.render(t, {'it': (x for x in [1, 2])}, error=u.error, path='xyz')
+    assert u.nows(s) == 'beforeafter'
+    assert u.lasterr == ('TypeError', 'xyz', 3)
+
+
+def test_object_vars():
+    class Obj:
+        def __init__(self):
+            self.a = 1
+            self.b = 2
+
+    t = """
+        @each obj as k, v
+            {k}={v}
+        @end
+        @each obj as k
+            {k}
+        @end
+    """
+    assert u.nows(u.render(t, {'obj': Obj()})) == 'a=1b=2ab'
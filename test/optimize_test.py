@@ -0,0 +1,247 @@
+"""Code optimizer."""
+
+import pytest
+
+from . import u
+
+TEMPLATE = """
+    @def badge x
+        @if x > 2
+            <b>{x}</b>
+        @elif x
+            <i>{x}</i>
+        @else
+        @end
+    @end
+    @each rows as r index n
+        <tr><td>{n}</td><td>{r.name}</td><td>{r.name == 'b'}</td>
+        @if r.flag
+            flag
+        @elif r.name == 'c' and not r.flag
+            c!
+        @else
+            none
+        @end
+        @badge r.num
+        @with r.extra as e
+            extra={e}
+        @else
+        @end
+        </tr>
+    @end
+    @each missing
+    @else
+    @end
+"""
+
+CONTEXT = {
+    'rows': [
+        {'name': 'a', 'flag': True, 'num': 1},
+        {'name': 'b', 'flag': False, 'num': 3, 'extra': 'x'},
+        {'name': 'c', 'flag': False, 'num': 0},
+    ],
+    'missing': [],
+}
+
+
+@pytest.mark.parametrize('passes', [False, True, 'native_if', 'remove_empty', 'merge_try', 'merge_text', 'fuse_filters'])
+def test_passes_keep_output(passes):
+    opt = [passes] if isinstance(passes, str) else passes
+    s = u.render(TEMPLATE, CONTEXT, optimize=opt)
+    assert s == u.render(TEMPLATE, CONTEXT, optimize=False)
+
+
+def test_fuse_filters():
+    t = """>{a | strip | upper | html}<"""
+
+    assert '_FUSED_' in u.chartreux.translate(t)
+    src = u.chartreux.translate(t, optimize=['merge_text'])
+    assert '_FUSED_' not in src
+    assert '_F_upper' in src
+    assert u.render(t, {'a': ' <b> '}, optimize=['merge_text']) == u.render(t, {'a': ' <b> '}) == '>&lt;B&gt;<'
+
+
+def test_native_if():
+    t = """
+        @if a.b
+            yes
+        @elif a.c
+            maybe
+        @else
+            no
+        @end
+    """
+
+    src = u.chartreux.translate(t, optimize=['native_if'])
+    assert '"_"' not in src
+    assert 'elif ' in src
+    assert u.nows(u.render(t, {'a': {'c': 1}}, error=u.error)) == 'maybe'
+
+
+def test_native_if_operators_are_guarded():
+    class Bad:
+        def __bool__(self):
+            raise ValueError()
+
+    t = """
+        A
+        @if x and y
+            yes
+        @end
+        @if not x
+            no
+        @end
+        @if x == 1
+            one
+        @end
+        B
+    """
+
+    src = u.chartreux.translate(t, optimize=['native_if'])
+    assert src.count('in "_"') == 3
+
+    s = u.render(t, {'x': Bad(), 'y': 1}, error=u.error)
+    assert u.nows(s) == 'AB'
+    assert u.lasterr[0] == 'ValueError'
+
+
+def test_native_if_needs_safe_heads():
+    t = """
+        @if a.b > 1
+            yes
+        @end
+    """
+
+    src = u.chartreux.translate(t, optimize=['native_if'])
+    assert '"_"' in src
+
+
+def test_remove_empty():
+    t = """
+        @with a as x
+            {x}
+        @else
+        @end
+    """
+
+    src = u.chartreux.translate(t, optimize=['remove_empty'])
+    assert src.count('else:') < u.chartreux.translate(t, optimize=False).count('else:')
+
+
+def test_merge_try_keeps_errors():
+    t = """
+        >{a.b}:{a.c}:{a.d + 1}:{a.e}<
+    """
+
+    s = u.render(t, {'a': {'b': 1, 'd': 'x'}}, error=u.error, path='xyz')
+    assert u.nows(s) == '>1:::<'
+    assert u.lasterr == ('AttributeError', 'xyz', 2)
+
+    src = u.chartreux.translate(t, optimize=['merge_try'])
+    assert src.count('try:') < u.chartreux.translate(t, optimize=False).count('try:')
+
+
+def test_merge_text():
+    c = u.chartreux.compiler
+    nodes = [
+        c.Node('', 1, "_PRINT('a')", 'text', {'text': 'a'}),
+        c.Node('', 2, "_PRINT('b')", 'text', {'text': 'b'}),
+        c.Node('', 3, "x = 1"),
+        c.Node('', 4, "_PRINT('c')", 'text', {'text': 'c'}),
+    ]
+    nodes = c.Optimizer(None).pass_merge_text(nodes)
+    assert [n.op for n in nodes] == ["_PRINT('ab')", "x = 1", "_PRINT('c')"]
+
+
+def test_unknown_pass():
+    with u.raises_compiler_error('ERROR_OPTION'):
+        u.render('abc', optimize=['nope'])
+
+
+def test_fold_constants():
+    t = """
+        <{'&copy;' | html}|{1024 * 1024}|{'ACME' | lower}|{'abc' | cut(2, '..')}|{3.5 | ':.2f'}|{not 1 and 2}>
+    """
+
+    src = u.chartreux.translate(t, runtime=u.chartreux.Runtime())
+    assert '_F_' not in src
+    assert u.nows(u.render(t)) == '<&amp;copy;|1048576|acme|ab..|3.50|False>'
+
+
+def test_fold_default_filter():
+    t = """<{'<b>'}{x}>"""
+
+    src = u.chartreux.translate(t, filter='html', runtime=u.chartreux.Runtime())
+    assert src.count('_F_html(') == 1
+    assert u.render(t, {'x': '&'}, filter='html') == '<&lt;b&gt;&amp;>'
+
+
+def test_fold_errors_are_left_for_run_time():
+    t = """
+        >{1/0}<
+    """
+
+    s = u.render(t, error=u.error, path='xyz')
+    assert u.lasterr == ('ZeroDivisionError', 'xyz', 2)
+    assert u.nows(s) == '><'
+
+
+def test_fold_no_huge_values():
+    src = u.chartreux.translate("{'x' * 10**8}")
+    assert "'xxxx" not in src
+
+
+def test_fold_custom_filters():
+    class R(u.chartreux.Runtime):
+        @u.chartreux.pure
+        def filter_shout(self, val):
+            return str(val).upper() + '!'
+
+        def filter_whisper(self, val):
+            return str(val).lower()
+
+    t = """{'a' | shout}{'B' | whisper}"""
+
+    src = u.chartreux.translate(t, runtime=R())
+    assert '_F_shout' not in src
+    assert '_F_whisper' in src
+    assert u.render(t, runtime=R()) == 'A!b'
+
+    src = u.chartreux.translate(t, fold=False, runtime=R())
+    assert '_F_shout' in src
+
+
+def test_fold_uses_the_render_runtime():
+    class R(u.chartreux.Runtime):
+        @u.chartreux.pure
+        def filter_upper(self, val):
+            return 'CUSTOM'
+
+        @u.chartreux.pure
+        def filter_html(self, val):
+            return 'H'
+
+    t = """{"abc" | upper} {"<" | html} {x | upper}"""
+
+    # without a compile-time runtime, filters are left for the run time
+
+    tpl = u.chartreux.compile(t)
+    assert u.chartreux.call(tpl, {'x': 'y'}, runtime=R()) == 'CUSTOM H CUSTOM'
+    assert u.chartreux.call(tpl, {'x': 'y'}) == 'ABC &lt; Y'
+
+    # render() compiles with its runtime
+
+    assert u.render(t, {'x': 'y'}, runtime=R()) == 'CUSTOM H CUSTOM'
+    assert u.render(t, {'x': 'y'}) == 'ABC &lt; Y'
+
+
+def test_fold_checks_the_render_runtime():
+    class R(u.chartreux.Runtime):
+        @u.chartreux.pure
+        def filter_upper(self, val):
+            return 'CUSTOM'
+
+    tpl = u.chartreux.compile("""{"abc" | upper}""", runtime=u.chartreux.Runtime())
+    assert u.chartreux.call(tpl) == 'ABC'
+    with pytest.raises(u.chartreux.runtime.Error):
+        u.chartreux.call(tpl, runtime=R())
@@ -0,0 +1,73 @@
+"""Parallel rendering in a process pool."""
+
+import pickle
+
+from . import u
+
+
+class UpperRuntime(u.chartreux.Runtime):
+    def filter_shout(self, val):
+        return str(val).upper() + '!'
+
+
+def test_ordered_matches_render_many():
+    t = '''
+        @def row(r)
+            <li>{r.name | html}</li>
+        @end
+        @each items as r
+            @row r
+        @end
+    '''
+    ctxs = [{'items': [{'name': '<%d>' % n}, {'name': 'x%d' % n}]} for n in range(50)]
+    res = list(u.chartreux.render_parallel(t, ctxs, workers=2, chunk_size=7))
+    assert res == list(u.chartreux.render_many(t, ctxs))
+
+
+def test_unordered_yields_indexes():
+    tpl = u.chartreux.compile('>{a}<')
+    ctxs = [{'a': n} for n in range(30)]
+    res = list(u.chartreux.call_parallel(tpl, ctxs, workers=2, chunk_size=4, ordered=False))
+    assert sorted(res) == [(n, '>%d<' % n) for n in range(30)]
+
+
+def test_contexts_generator():
+    tpl = u.chartreux.compile('{a}')
+    res = list(u.chartreux.call_parallel(tpl, ({'a': n} for n in range(10)), workers=1, chunk_size=3))
+    assert res == [str(n) for n in range(10)]
+
+
+def test_empty_contexts():
+    tpl = u.chartreux.compile('{a}')
+    assert list(u.chartreux.call_parallel(tpl, [], workers=2)) == []
+
+
+def test_custom_runtime():
+    rt = UpperRuntime()
+    res = list(u.chartreux.render_parallel('{a | shout | html}', [{'a': 'x<'}, {'a': 'y'}], runtime=rt, workers=1))
+    assert res == ['X&lt;!', 'Y!']
+
+
+def test_runtime_with_fused_filters_can_be_pickled():
+    rt = u.chartreux.Runtime()
+    u.chartreux.render('{a | strip | upper | html}', {'a': ' x '}, runtime=rt)
+    rt2 = pickle.loads(pickle.dumps(rt))
+    assert u.chartreux.render('{a | strip | upper | html}', {'a': ' <y> '}, runtime=rt2) == '&lt;Y&gt;'
+
+
+def test_errors_are_raised():
+    tpl = u.chartreux.compile('>{10 / a}<')
+    with u.raises_template_error(ZeroDivisionError):
+        list(u.chartreux.call_parallel(tpl, [{'a': 1}, {'a': 0}], workers=1))
+
+
+def test_async_not_supported():
+    tpl = u.chartreux.compile('{a}', async_mode=True)
+    with u.raises_compiler_error('ERROR_NOT_SUPPORTED'):
+        u.chartreux.call_parallel(tpl, [{'a': 1}])
+
+
+def test_compile_source():
+    tpl = u.chartreux.compile('@each items as i\n{i}-\n@end')
+    tpl2 = u.chartreux.compile_source(tpl.source)
+    assert u.chartreux.call(tpl2, {'items': [1, 2]}) == u.chartreux.call(tpl, {'items': [1, 2]})
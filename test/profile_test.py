@@ -0,0 +1,101 @@
+"""Template profiler."""
+
+import json
+import sys
+
+from . import u
+
+
+def _lines(prof):
+    return {r['line']: r for r in prof.line_stats()}
+
+
+def test_line_hits():
+    t = '''@each items as x
+        {x}
+        @if x > 5
+            big
+        @end
+    @end'''
+
+    prof = u.chartreux.Profiler()
+    s = u.render(t, {'items': range(10)}, profile=prof)
+    assert u.nows(s) == '0123456big7big8big9big'
+
+    lines = _lines(prof)
+    assert lines[2]['hits'] == 10
+    assert lines[4]['hits'] == 4
+    assert all(r['time_ms'] >= 0 for r in lines.values())
+    assert prof.time > 0
+    assert sys.gettrace() is None
+
+
+def test_def_stats():
+    t = '''
+        @def row(r)
+            <td>{r}</td>
+        @end
+        @each items as x
+            @row x
+        @end
+    '''
+
+    prof = u.chartreux.Profiler()
+    u.render(t, {'items': range(5)}, profile=prof)
+
+    defs = prof.def_stats()
+    assert [(d['name'], d['line'], d['calls']) for d in defs] == [('row', 2, 5)]
+
+    # the calling line's total includes the def
+    lines = _lines(prof)
+    assert lines[6]['total_ms'] >= lines[3]['total_ms']
+
+
+def test_results_are_accumulated():
+    prof = u.chartreux.Profiler()
+    for _ in range(3):
+        u.render('>{x}<', {'x': 1}, profile=prof)
+    assert _lines(prof)[1]['hits'] == 3
+    prof.reset()
+    assert prof.line_stats() == []
+
+
+def test_includes(tmpdir):
+    tmpdir.join('inc.cx').write('<b>{x}</b>\n')
+    tmpdir.join('page.cx').write('@each items as x\n@include ./inc.cx\n@end\n')
+
+    prof = u.chartreux.Profiler()
+    u.render_path(tmpdir.join('page.cx').strpath, {'items': range(3)}, profile=prof)
+
+    r = [r for r in prof.line_stats() if r['path'].endswith('inc.cx')]
+    assert [x['line'] for x in r] == [1]
+    assert r[0]['hits'] >= 3
+
+
+def test_render_iter():
+    prof = u.chartreux.Profiler()
+    s = ''.join(u.chartreux.render_iter('@each items as x\n{x}\n@end', {'items': range(100)}, profile=prof, chunk_size=10))
+    assert len(s) > 100
+    # NB: a resumed generator enters its current line again
+    assert _lines(prof)[2]['hits'] >= 100
+    assert sys.gettrace() is None
+
+
+def test_report_and_json():
+    prof = u.chartreux.Profiler()
+    u.render('@def f\nx\n@end\n@f\n', profile=prof, path='page.cx')
+
+    rep = prof.report()
+    assert rep.startswith('total')
+    assert 'page.cx:1' in rep
+
+    d = json.loads(prof.to_json())
+    assert set(d) == {'time_ms', 'lines', 'defs'}
+    assert d['defs'][0]['name'] == 'f'
+
+
+def test_trace_is_restored_on_error():
+    prof = u.chartreux.Profiler()
+    with u.raises_template_error(ZeroDivisionError):
+        u.render('{1/x}', {'x': 0}, profile=prof)
+    assert sys.gettrace() is None
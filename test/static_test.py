@@ -0,0 +1,112 @@
+"""Static (compile-time) context."""
+
+from . import u
+
+STATIC = {
+    'lang': 'de',
+    'flags': {'beta': False, 'new_menu': True},
+    'langs': ['de', 'en'],
+    'title': '',
+}
+
+
+def translate(t):
+    return u.chartreux.translate(t, static_context=STATIC)
+
+
+def render(t, d=None):
+    return u.chartreux.call(u.chartreux.compile(t, static_context=STATIC), d, error=u.error)
+
+
+def test_interpolation_is_text():
+    t = """<{lang}|{flags.beta}|{langs | join('/')}|{lang | upper}>"""
+    assert render(t) == '<de|False|de/en|DE>'
+    assert 'lang' not in translate(t).split('_PUSHBUF(_OUT)')[1]
+
+
+def test_dead_branches():
+    t = """
+        @if lang == 'en'
+            english {aa}
+        @elif lang == 'de'
+            german
+        @else
+            other {bb}
+        @end
+    """
+
+    src = translate(t)
+    assert '"_"' not in src
+    assert 'english' not in src
+    assert 'other' not in src
+    assert '_CV_' not in src
+    assert u.nows(render(t)) == 'german'
+
+
+def test_mixed_branches():
+    t = """
+        @if flags.beta
+            beta
+        @elif aa
+            aa
+        @elif flags.new_menu
+            new
+        @elif bb
+            bb
+        @else
+            old
+        @end
+    """
+
+    src = translate(t)
+    assert 'beta' not in src
+    assert 'old' not in src
+    assert "_GET_VAR('bb')" not in src
+    assert u.nows(render(t, {'aa': 1})) == 'aa'
+    assert u.nows(render(t, {'aa': 0})) == 'new'
+
+
+def test_with():
+    t = """
+        @with title as t
+            title
+        @else
+            no title
+        @end
+        @with lang as l
+            {l}
+        @else
+            no lang
+        @end
+    """
+
+    src = translate(t)
+    assert '_RT.isempty' not in src
+    assert u.nows(render(t)) == 'notitlede'
+
+
+def test_locals_shadow_static_names():
+    t = """
+        @let lang = 'fr'
+        {lang}
+        @each langs as lang
+            {lang}
+        @end
+    """
+    assert u.nows(render(t)) == 'frdeen'
+
+
+def test_object_values_are_an_error():
+    class Obj:
+        pass
+
+    with u.raises_compiler_error('ERROR_STATIC'):
+        u.chartreux.compile('{obj}', static_context={'obj': Obj()})
+
+
+def test_object_properties():
+    class Obj:
+        name = 'x'
+
+    tpl = u.chartreux.compile('{obj.name}', static_context={'obj': Obj()})
+    assert tpl(u.chartreux.Runtime(), {}) == 'x'
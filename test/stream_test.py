@@ -0,0 +1,69 @@
+"""Streaming render."""
+
+import chartreux
+from . import u
+
+
+T = """
+    header
+    @each rows as r
+        @let cell
+            <{r}>
+        @end
+        {cell | strip}
+    @end
+    footer
+"""
+
+
+def rows(n):
+    for k in range(n):
+        yield k
+
+
+def test_render_iter():
+    chunks = list(chartreux.render_iter(T, {'rows': rows(1000)}, chunk_size=100))
+    s = chartreux.render(T, {'rows': rows(1000)})
+
+    assert ''.join(chunks) == s
+    assert len(chunks) > 10
+    assert all(len(c) >= 100 for c in chunks[:-1])
+
+
+def test_chunks_are_produced_lazily():
+    seen = []
+
+    def gen():
+        for k in range(1000):
+            seen.append(k)
+            yield k
+
+    it = chartreux.render_iter(T, {'rows': gen()}, chunk_size=10)
+    next(it)
+
+    # @each consumes the loop data as the output is produced
+    assert len(seen) < 100
+
+    rest = ''.join(it)
+    assert rest.strip().endswith('footer')
+
+
+def test_call_iter():
+    t = chartreux.compile('>{a}<')
+    assert list(chartreux.call_iter(t, {'a': 1})) == ['>1<']
+
+    t = chartreux.compile('')
+    assert list(chartreux.call_iter(t)) == []
+
+
+def test_iter_errors():
+    t = chartreux.compile('>{a.b}<', path='xyz')
+    s = ''.join(chartreux.call_iter(t, {'a': 1}, error=u.error))
+    assert s == '><'
+    assert u.lasterr == ('AttributeError', 'xyz', 1)
+
+
+def test_iter_top_level_return():
+    t = chartreux.compile('abc\n@return 42\n')
+    assert chartreux.call(t) == 42
+    assert ''.join(chartreux.call_iter(t)) == '42'
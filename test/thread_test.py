@@ -0,0 +1,51 @@
+"""Concurrent rendering with a shared runtime."""
+
+import threading
+
+import chartreux
+from . import u
+
+
+T = """
+    @def row(n)
+        @let cell
+            <{n}>
+        @end
+        [{cell | strip}]
+    @end
+    {name}:
+    @each items as x
+        @row x
+    @end
+"""
+
+
+def test_shared_runtime():
+    tpl = chartreux.compile(T)
+    rt = chartreux.Runtime()
+
+    def expected(n):
+        return u.nows(''.join('[<{}>]'.format(x) for x in range(n % 7)))
+
+    errors = []
+    start = threading.Barrier(16)
+
+    def worker(n):
+        start.wait()
+        try:
+            for k in range(200):
+                m = n + k
+                s = chartreux.call(tpl, {'name': m, 'items': range(m % 7)}, runtime=rt)
+                assert u.nows(s) == str(m) + ':' + expected(m)
+                s = chartreux.call(tpl, {'name': m, 'items': range(m % 7)})
+                assert u.nows(s) == str(m) + ':' + expected(m)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
@@ -0,0 +1,53 @@
+"""Rendering to file-like objects."""
+
+import io
+
+import chartreux
+from . import u
+
+
+T = """
+    @each rows as r
+        @let cell
+            <{r}>
+        @end
+        {cell | strip}
+    @end
+"""
+
+
+class Recorder(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+def test_render_to():
+    fp = Recorder()
+    res = chartreux.render_to(T, fp, {'rows': range(1000)}, flush_size=100)
+
+    assert res is None
+    assert fp.getvalue() == chartreux.render(T, {'rows': range(1000)})
+    assert fp.writes > 10
+
+
+def test_render_to_bytes():
+    fp = io.BytesIO()
+    chartreux.render_to('>{a}<', fp, {'a': 'füßchen'})
+    assert fp.getvalue() == '>füßchen<'.encode('utf8')
+
+    fp = io.BytesIO()
+    chartreux.render_to('>{a}<', fp, {'a': 'füßchen'}, encoding='latin1')
+    assert fp.getvalue() == '>füßchen<'.encode('latin1')
+
+
+def test_call_to_errors():
+    fp = io.StringIO()
+    t = chartreux.compile('>{a.b}<\n>{None}<', path='xyz')
+    chartreux.call_to(t, fp, {'a': 1}, error=u.error)
+    assert fp.getvalue() == '><\n><'
+    assert u.lasterr == ('AttributeError', 'xyz', 1)